@@ -0,0 +1,537 @@
+from collections import defaultdict
+
+from sqlalchemy import func, or_, and_, select, insert, update, case, cast, Date
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.orm import Session, aliased
+
+from . import models
+from .services import rules
+from .database import writes
+
+# Clients further behind than this just reload their view instead of replaying the log
+MAX_CHANGES = 1000
+DEFAULT_LEDGER = models.DEFAULT_LEDGER
+
+def lock_change_log(db: Session, *ledger_ids: str):
+    """
+    Make change ids commit in id order within each ledger, so a client can never see cursor N+1
+    while N is still in flight and then skip N. Postgres assigns serial ids at insert but shows
+    rows at commit, so writers to a ledger take a transaction-level advisory lock (released at
+    commit) before inserting change rows. SQLite already runs one write transaction at a time.
+    Ledgers are locked in sorted order so writers to several ledgers can't deadlock.
+    """
+    if db.get_bind().dialect.name != "postgresql":
+        return
+    for ledger_id in sorted(set(ledger_ids)):
+        db.execute(select(func.pg_advisory_xact_lock(func.hashtext("transaction_changes:" + ledger_id))))
+
+def record_change(db: Session, ledger_id: str, op: str, transaction_id: int | None = None):
+    lock_change_log(db, ledger_id)
+    db.add(models.TransactionChange(ledger_id=ledger_id, op=op, transaction_id=transaction_id))
+
+def current_cursor(db: Session, ledger_id: str) -> int:
+    """
+    The ledger's latest change id (ix_transaction_changes_ledger_id_id makes it one index probe).
+    Change ids are global, so other ledgers' writes don't move it but it still orders with `since`.
+    Every lower id of the ledger is already visible (see lock_change_log), so nothing is skipped.
+    """
+    change = models.TransactionChange
+    return db.query(func.max(change.id)).filter(change.ledger_id == ledger_id).scalar() or 0
+
+def filter_transactions(query, ledger_id: str, currency: str | None, month_range):
+    query = query.filter(models.Transaction.ledger_id == ledger_id)
+    if currency:
+        query = query.filter(models.Transaction.currency == currency)
+    if month_range:
+        start, end = month_range
+        query = query.filter(models.Transaction.created_at >= start, models.Transaction.created_at < end)
+    return query
+
+def _select(db: Session, columns: list | None):
+    tx = models.Transaction
+    return db.query(*[getattr(tx, name) for name in columns]) if columns else db.query(tx)
+
+def list_transactions(db: Session, ledger_id: str, skip: int, limit: int, currency: str | None, month_range,
+                      columns: list | None = None):
+    """
+    Returns (cursor, rows); the cursor is read first so the rows are at least that fresh.
+    With `columns` (attribute names) rows are plain tuples instead of ORM objects.
+    """
+    cursor = current_cursor(db, ledger_id)
+    tx = models.Transaction
+    query = filter_transactions(_select(db, columns), ledger_id, currency, month_range)
+    return cursor, query.order_by(tx.created_at.desc(), tx.id.desc()).offset(skip).limit(limit).all()
+
+def list_transactions_after(db: Session, ledger_id: str, after, limit: int, currency: str | None, month_range,
+                            columns: list | None = None):
+    """Keyset page: rows strictly after the (created_at, id) position `after`."""
+    tx = models.Transaction
+    query = filter_transactions(_select(db, columns), ledger_id, currency, month_range)
+    if after:
+        created_at, tx_id = after
+        query = query.filter(or_(tx.created_at < created_at, and_(tx.created_at == created_at, tx.id < tx_id)))
+    return query.order_by(tx.created_at.desc(), tx.id.desc()).limit(limit).all()
+
+def rollup_key(tx) -> tuple:
+    return (tx.ledger_id or DEFAULT_LEDGER, tx.currency, tx.created_at.strftime("%Y-%m"), tx.category or "其他", tx.user_id or "")
+
+def _rollup_deltas(txs, sign: int) -> dict:
+    deltas = defaultdict(lambda: [0.0, 0, None])  # key -> [amount, count, user_name]
+    for tx in txs:
+        delta = deltas[rollup_key(tx)]
+        delta[0] += sign * tx.amount
+        delta[1] += sign
+        delta[2] = tx.user_name or delta[2]
+    return deltas
+
+def touch_periods(db: Session, ledger_id: str | None = None, month: str | None = None):
+    """
+    Note which ledger month a write changed (None = all of them); reports.py drops its cached
+    buckets for those once the commit has gone through.
+    """
+    db.info.setdefault("touched_periods", set()).add((ledger_id, month))
+
+def apply_rollup(db: Session, txs, sign: int = 1):
+    """
+    Add (sign=1) or remove (sign=-1) transactions from monthly_rollups, as one upsert per
+    touched (ledger, currency, month, category, member) key. Runs inside the caller's transaction.
+    """
+    rollup = models.MonthlyRollup
+    deltas = _rollup_deltas(txs, sign)
+    if not deltas:
+        return
+    for key in deltas:
+        touch_periods(db, key[0], key[2])
+    params = [
+        {"ledger_id": key[0], "currency": key[1], "month": key[2], "category": key[3], "user_id": key[4],
+         "user_name": user_name, "amount": amount, "count": count}
+        for key, (amount, count, user_name) in deltas.items()
+    ]
+    dialect = db.get_bind().dialect.name
+    if dialect in ("sqlite", "postgresql"):
+        stmt = (sqlite if dialect == "sqlite" else postgresql).insert(rollup)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[rollup.ledger_id, rollup.currency, rollup.month, rollup.category, rollup.user_id],
+            set_={
+                "amount": rollup.amount + stmt.excluded.amount,
+                "count": rollup.count + stmt.excluded.count,
+                "user_name": func.coalesce(stmt.excluded.user_name, rollup.user_name),
+            },
+        )
+        db.execute(stmt, params)
+    else:
+        for row in params:
+            existing = db.get(rollup, tuple(row[col] for col in ("ledger_id", "currency", "month", "category", "user_id")))
+            if existing is None:
+                db.add(rollup(**row))
+            else:
+                existing.amount += row["amount"]
+                existing.count += row["count"]
+                existing.user_name = row["user_name"] or existing.user_name
+    if sign < 0:
+        # Emptied groups would otherwise show up as 0.00 slices / members
+        for key in deltas:
+            db.query(rollup).filter(
+                rollup.ledger_id == key[0], rollup.currency == key[1], rollup.month == key[2],
+                rollup.category == key[3], rollup.user_id == key[4], rollup.count <= 0,
+            ).delete(synchronize_session=False)
+
+def get_stats(db: Session, ledger_id: str, currency: str, month: str) -> dict:
+    """Month totals from monthly_rollups: a few rows per category and member, never the raw ledger."""
+    rollup = models.MonthlyRollup
+    amount_sum = func.coalesce(func.sum(rollup.amount), 0.0)
+    count_sum = func.coalesce(func.sum(rollup.count), 0)
+
+    def month_query(*columns):
+        return db.query(*columns).filter(
+            rollup.ledger_id == ledger_id, rollup.currency == currency, rollup.month == month
+        )
+
+    total, count = month_query(amount_sum, count_sum).one()
+    categories = month_query(rollup.category, amount_sum, count_sum).group_by(rollup.category).order_by(amount_sum.desc()).all()
+    members = (
+        month_query(func.max(rollup.user_name), amount_sum, count_sum)
+        .group_by(rollup.user_id)
+        .order_by(amount_sum.desc())
+        .all()
+    )
+
+    return {
+        "total": total,
+        "count": count,
+        "categories": [{"name": name, "amount": amount, "count": n} for name, amount, n in categories],
+        "members": [{"name": name or "Unknown", "amount": amount, "count": n} for name, amount, n in members],
+    }
+
+def _day(db: Session, column):
+    """Calendar day of a DateTime column, comparable with a Date column on either dialect."""
+    return func.date(column) if db.get_bind().dialect.name == "sqlite" else cast(column, Date)
+
+def daily_totals(db: Session, ledger_id: str, start, end) -> list:
+    """
+    (day, currency, category, user_id, user_name, amount, count) per day and group in [start, end):
+    the column extract reports.py builds its time series from.
+    """
+    tx = models.Transaction
+    day = _day(db, tx.created_at)
+    category = func.coalesce(tx.category, "其他")
+    return [tuple(row) for row in (
+        db.query(day, tx.currency, category, tx.user_id, func.max(tx.user_name), func.sum(tx.amount), func.count(tx.id))
+        .filter(tx.ledger_id == ledger_id, tx.created_at >= start, tx.created_at < end)
+        .group_by(day, tx.currency, category, tx.user_id)
+    )]
+
+def get_consolidated_stats(db: Session, ledger_id: str, month_range, base: str, target: str, fallback: dict) -> dict:
+    """
+    Month totals across all currencies, converted to `target` in SQL: each row is joined to the
+    fx_rates of its own day (and the target's rate on that day), so the database returns one row
+    per (currency, category, member) however many transactions there are.
+    Rates are units of `base` per unit of currency. Days without a stored rate use `fallback`
+    ({currency: rate}, see services/fx.py); those rows are counted in "estimated", and rows with no
+    rate at all in "unconverted".
+    """
+    tx = models.Transaction
+    rate, target_rate = aliased(models.FxRate), aliased(models.FxRate)
+    day = _day(db, tx.created_at)
+    fallback = {**fallback, base: 1.0}
+    rate_value = func.coalesce(rate.rate, case(fallback, value=tx.currency, else_=None))
+    target_value = 1.0 if target == base else func.coalesce(target_rate.rate, fallback.get(target))
+    converted = tx.amount * rate_value / target_value
+
+    start, end = month_range
+    query = (
+        db.query(
+            tx.currency,
+            func.coalesce(tx.category, "其他"),
+            tx.user_id,
+            func.max(tx.user_name),
+            func.sum(tx.amount),
+            func.sum(converted),
+            func.count(tx.id),
+            func.sum(case((and_(tx.currency != base, rate.rate.is_(None), rate_value.is_not(None)), 1), else_=0)),
+            func.sum(case((converted.is_(None), 1), else_=0)),
+        )
+        .outerjoin(rate, and_(rate.currency == tx.currency, rate.day == day))
+        .filter(tx.ledger_id == ledger_id, tx.created_at >= start, tx.created_at < end)
+        .group_by(tx.currency, func.coalesce(tx.category, "其他"), tx.user_id)
+    )
+    if target != base:
+        query = query.outerjoin(target_rate, and_(target_rate.currency == target, target_rate.day == day))
+    rows = query.all()
+
+    currencies = defaultdict(lambda: [0.0, 0.0, 0])  # name -> [amount, converted, count]
+    categories = defaultdict(lambda: [0.0, 0])
+    members = defaultdict(lambda: [0.0, 0, None])
+    estimated = unconverted = 0
+    for currency, category, user_id, user_name, amount, value, count, n_estimated, n_unconverted in rows:
+        value = value or 0.0
+        currencies[currency][0] += amount
+        currencies[currency][1] += value
+        currencies[currency][2] += count
+        categories[category][0] += value
+        categories[category][1] += count
+        member = members[user_id or ""]
+        member[0] += value
+        member[1] += count
+        member[2] = user_name or member[2]
+        estimated += n_estimated
+        unconverted += n_unconverted
+
+    return {
+        "total": sum(v[1] for v in currencies.values()),
+        "count": sum(v[2] for v in currencies.values()),
+        "currencies": sorted(({"name": name, "amount": a, "converted": c, "count": n}
+                              for name, (a, c, n) in currencies.items()), key=lambda b: -b["converted"]),
+        "categories": sorted(({"name": name, "amount": a, "count": n} for name, (a, n) in categories.items()),
+                             key=lambda b: -b["amount"]),
+        "members": sorted(({"name": name or "Unknown", "amount": a, "count": n} for a, n, name in members.values()),
+                          key=lambda b: -b["amount"]),
+        "estimated": estimated,
+        "unconverted": unconverted,
+    }
+
+@writes
+def save_fx_rates(db: Session, rows: list) -> int:
+    """Upsert {currency, day, rate} rows into fx_rates."""
+    fx = models.FxRate
+    dialect = db.get_bind().dialect.name
+    if rows and dialect in ("sqlite", "postgresql"):
+        stmt = (sqlite if dialect == "sqlite" else postgresql).insert(fx)
+        stmt = stmt.on_conflict_do_update(index_elements=[fx.currency, fx.day], set_={"rate": stmt.excluded.rate})
+        db.execute(stmt, rows)
+    else:
+        for row in rows:
+            db.merge(fx(**row))
+    db.commit()
+    return len(rows)
+
+def latest_fx_rates(db: Session) -> dict:
+    """{currency: rate} of each currency's most recent day in fx_rates."""
+    fx = models.FxRate
+    latest = db.query(fx.currency, func.max(fx.day).label("day")).group_by(fx.currency).subquery()
+    rows = db.query(fx.currency, fx.rate).join(latest, and_(fx.currency == latest.c.currency, fx.day == latest.c.day))
+    return dict(rows.all())
+
+def _expected_rollups(db: Session) -> dict:
+    """Rollups recomputed from the raw rows (streamed, so it works on any size ledger)."""
+    tx = models.Transaction
+    query = db.query(tx.ledger_id, tx.currency, tx.created_at, tx.category, tx.user_id, tx.user_name, tx.amount)
+    return dict(_rollup_deltas(query.order_by(tx.id).yield_per(1000), 1))
+
+@writes
+def rebuild_rollups(db: Session) -> int:
+    """Recompute monthly_rollups from scratch; returns the number of rollup rows."""
+    expected = _expected_rollups(db)
+    db.query(models.MonthlyRollup).delete()
+    touch_periods(db)
+    if expected:
+        db.execute(insert(models.MonthlyRollup), [
+            {"ledger_id": key[0], "currency": key[1], "month": key[2], "category": key[3], "user_id": key[4],
+             "user_name": user_name, "amount": amount, "count": count}
+            for key, (amount, count, user_name) in expected.items()
+        ])
+    db.commit()
+    return len(expected)
+
+def verify_rollups(db: Session, tolerance: float = 0.005) -> list:
+    """Keys whose stored rollup differs from the raw rows, as (key, stored, expected) tuples."""
+    rollup = models.MonthlyRollup
+    expected = {key: (amount, count) for key, (amount, count, _) in _expected_rollups(db).items()}
+    stored = {
+        (row.ledger_id, row.currency, row.month, row.category, row.user_id): (row.amount, row.count)
+        for row in db.query(rollup)
+    }
+    mismatches = []
+    for key in sorted(expected.keys() | stored.keys()):
+        have, want = stored.get(key, (0.0, 0)), expected.get(key, (0.0, 0))
+        if have[1] != want[1] or abs(have[0] - want[0]) > tolerance:
+            mismatches.append((key, have, want))
+    return mismatches
+
+def ensure_rollups(db: Session):
+    """First start after monthly_rollups was added: backfill it from the existing rows."""
+    if db.query(models.MonthlyRollup).first() is None and db.query(models.Transaction).first() is not None:
+        print(f"Built {rebuild_rollups(db)} monthly rollup rows")
+
+def ensure_ledger(db: Session, ledger_id: str, name: str | None = None):
+    """Register the ledger on its first write; keeps the name in step with the chat title."""
+    ledger = db.get(models.Ledger, ledger_id)
+    if ledger is None:
+        # Two members' first messages in a new chat can both get here (only tuned SQLite serializes
+        # writes), so the loser's insert must not fail the expense with an IntegrityError
+        dialect = db.get_bind().dialect.name
+        if dialect in ("sqlite", "postgresql"):
+            stmt = (sqlite if dialect == "sqlite" else postgresql).insert(models.Ledger)
+            db.execute(stmt.values(id=ledger_id, name=name).on_conflict_do_nothing(index_elements=[models.Ledger.id]))
+        else:
+            db.add(models.Ledger(id=ledger_id, name=name))
+    elif name and ledger.name != name:
+        ledger.name = name
+
+def get_ledger(db: Session, ledger_id: str) -> models.Ledger | None:
+    return db.get(models.Ledger, ledger_id)
+
+@writes
+def create_transactions(db: Session, rows: list, ledger_name: str | None = None) -> list:
+    """Insert several transactions in one batched INSERT and one commit."""
+    txs = [models.Transaction(**{
+        "ledger_id": DEFAULT_LEDGER, **data,
+        # Classified once here, so readers only ever see the stored category
+        "category": rules.categorize(data.get("category"), data.get("item"), data.get("raw_text")),
+    }) for data in rows]
+    for ledger_id in {tx.ledger_id for tx in txs}:
+        ensure_ledger(db, ledger_id, ledger_name)
+    db.add_all(txs)
+    db.flush()  # one INSERT .. RETURNING id (batched where the dialect supports it, e.g. Postgres)
+    apply_rollup(db, txs)
+    # Change rows don't need ids back, so they go out as a single executemany
+    lock_change_log(db, *(tx.ledger_id for tx in txs))
+    db.execute(insert(models.TransactionChange), [
+        {"ledger_id": tx.ledger_id, "op": "upsert", "transaction_id": tx.id} for tx in txs
+    ])
+    db.commit()
+    return txs
+
+@writes
+def create_transaction(db: Session, data: dict) -> models.Transaction:
+    return create_transactions(db, [data])[0]
+
+def update_transaction_item(db: Session, tx: models.Transaction, item: str):
+    # The category is left as it was (the member may have set it on purpose), and the item
+    # isn't part of any rollup key, so monthly_rollups stays as it is
+    tx.item = item
+    record_change(db, tx.ledger_id, "upsert", tx.id)
+    db.commit()
+
+def delete_transaction(db: Session, tx: models.Transaction):
+    record_change(db, tx.ledger_id, "delete", tx.id)
+    apply_rollup(db, [tx], -1)
+    db.delete(tx)
+    db.commit()
+
+def get_user_transaction(db: Session, ledger_id: str, tx_id: int, user_id: str) -> models.Transaction | None:
+    tx = models.Transaction
+    return db.query(tx).filter(tx.id == tx_id, tx.ledger_id == ledger_id, tx.user_id == user_id).first()
+
+@writes
+def undo_last_transaction(db: Session, ledger_id: str, user_id: str) -> int | None:
+    """Delete the user's most recent transaction in the ledger; returns its id, or None if there is none."""
+    tx = (
+        db.query(models.Transaction)
+        .filter(models.Transaction.ledger_id == ledger_id, models.Transaction.user_id == user_id)
+        .order_by(models.Transaction.created_at.desc(), models.Transaction.id.desc())
+        .first()
+    )
+    if not tx:
+        return None
+    tx_id = tx.id
+    delete_transaction(db, tx)
+    return tx_id
+
+@writes
+def delete_user_transaction(db: Session, ledger_id: str, tx_id: int, user_id: str) -> bool:
+    tx = get_user_transaction(db, ledger_id, tx_id, user_id)
+    if not tx:
+        return False
+    delete_transaction(db, tx)
+    return True
+
+@writes
+def update_user_transaction_item(db: Session, ledger_id: str, tx_id: int, user_id: str, item: str) -> bool:
+    tx = get_user_transaction(db, ledger_id, tx_id, user_id)
+    if not tx:
+        return False
+    update_transaction_item(db, tx, item)
+    return True
+
+@writes
+def reset_transactions(db: Session, ledger_id: str) -> int:
+    """Delete one ledger's transactions; other ledgers are untouched."""
+    num_deleted = db.query(models.Transaction).filter(models.Transaction.ledger_id == ledger_id).delete(synchronize_session=False)
+    db.query(models.MonthlyRollup).filter(models.MonthlyRollup.ledger_id == ledger_id).delete(synchronize_session=False)
+    touch_periods(db, ledger_id)
+    # One marker instead of a tombstone per row: clients past it reload their view
+    record_change(db, ledger_id, "reset")
+    db.commit()
+    return num_deleted
+
+def changes_since(db: Session, ledger_id: str, since: int, if_none_match: str | None = None) -> dict | None:
+    """
+    Collapse the ledger's change log after `since` into the current rows and deleted ids.
+    Returns None when `if_none_match` still matches the cursor's ETag (nothing new). The cursor
+    is the ledger's own, so writes to other ledgers leave its dashboards on 304s.
+    """
+    change = models.TransactionChange
+    cursor = current_cursor(db, ledger_id)
+    if if_none_match == f'"{cursor}"':
+        return None
+    if since >= cursor:
+        return {"cursor": cursor, "reset": False, "upserts": [], "deletes": []}
+
+    rows = (
+        db.query(change.id, change.transaction_id, change.op)
+        .filter(change.ledger_id == ledger_id, change.id > since)
+        .order_by(change.id)
+        .limit(MAX_CHANGES + 1)
+        .all()
+    )
+    if rows:
+        cursor = max(cursor, rows[-1][0])
+    if len(rows) > MAX_CHANGES or any(op == "reset" for _, _, op in rows):
+        return {"cursor": cursor, "reset": True, "upserts": [], "deletes": []}
+
+    latest = {}
+    for _, transaction_id, op in rows:
+        latest[transaction_id] = op
+    upsert_ids = [tid for tid, op in latest.items() if op == "upsert"]
+    tx = models.Transaction
+    upserts = db.query(tx).filter(tx.ledger_id == ledger_id, tx.id.in_(upsert_ids)).all() if upsert_ids else []
+    # Rows deleted after being logged as upserts also count as deletes
+    found = {tx.id for tx in upserts}
+    deletes = [tid for tid, op in latest.items() if op == "delete" or tid not in found]
+    return {"cursor": cursor, "reset": False, "upserts": upserts, "deletes": deletes}
+
+@writes
+def flush_bot_states(db: Session, upserts: dict, deletes: list, expire_before):
+    """Write-behind batch for services/state.py; also drops rows that outlived the TTL."""
+    state = models.BotState
+    if upserts:
+        existing = {row.user_id: row for row in db.query(state).filter(state.user_id.in_(list(upserts)))}
+        for user_id, data in upserts.items():
+            if user_id in existing:
+                existing[user_id].data = data
+            else:
+                db.add(state(user_id=user_id, data=data))
+    if deletes:
+        db.query(state).filter(state.user_id.in_(deletes)).delete(synchronize_session=False)
+    db.query(state).filter(state.updated_at < expire_before).delete(synchronize_session=False)
+    db.commit()
+
+def load_bot_states(db: Session, since) -> list:
+    state = models.BotState
+    return [tuple(row) for row in db.query(state.user_id, state.data, state.updated_at).filter(state.updated_at >= since)]
+
+def get_update_offset(db: Session, bot_id: str) -> int:
+    offset = db.get(models.BotOffset, bot_id)
+    return offset.update_id if offset else 0
+
+@writes
+def save_update_offset(db: Session, bot_id: str, update_id: int):
+    """Only ever moves forward, so a late save from an older batch can't rewind it."""
+    offset = db.get(models.BotOffset, bot_id)
+    if offset is None:
+        db.add(models.BotOffset(bot_id=bot_id, update_id=update_id))
+    elif update_id > offset.update_id:
+        offset.update_id = update_id
+    db.commit()
+
+@writes
+def move_ledger(db: Session, source: str, target: str) -> int:
+    """Move every transaction of `source` into `target` (e.g. the pre-ledger rows into a chat's ledger)."""
+    tx = models.Transaction
+    lock_change_log(db, source, target)
+    moved = db.query(tx).filter(tx.ledger_id == source).update({tx.ledger_id: target}, synchronize_session=False)
+    db.query(models.TransactionChange).filter(models.TransactionChange.ledger_id == source).update(
+        {models.TransactionChange.ledger_id: target}, synchronize_session=False
+    )
+    ensure_ledger(db, target)
+    record_change(db, source, "reset")
+    record_change(db, target, "reset")
+    db.commit()
+    rebuild_rollups(db)
+    return moved
+
+RECLASSIFY_CHUNK = 1000
+
+@writes
+def reclassify_transactions(db: Session, ledger_id: str | None = None, chunk: int = RECLASSIFY_CHUNK) -> int:
+    """
+    Re-run rules.categorize over stored rows (all ledgers, or one): streams them in id order,
+    one bulk UPDATE per chunk of changed rows, then rebuilds monthly_rollups. Returns rows changed.
+    """
+    tx = models.Transaction
+    query = db.query(tx.id, tx.ledger_id, tx.category, tx.item, tx.raw_text)
+    if ledger_id:
+        query = query.filter(tx.ledger_id == ledger_id)
+    changed, ledgers, last_id = 0, set(), 0
+    while True:
+        rows = query.filter(tx.id > last_id).order_by(tx.id).limit(chunk).all()
+        if not rows:
+            break
+        last_id = rows[-1].id
+        updates = []
+        for row in rows:
+            category = rules.categorize(row.category, row.item, row.raw_text)
+            if category != row.category:
+                updates.append({"id": row.id, "category": category})
+                ledgers.add(row.ledger_id)
+        if updates:
+            db.execute(update(tx), updates)  # executemany UPDATE .. WHERE id = ?
+            db.commit()
+            changed += len(updates)
+    if changed:
+        for ledger in sorted(ledgers):
+            record_change(db, ledger, "reset")  # open dashboards reload instead of replaying every row
+        db.commit()
+        rebuild_rollups(db)
+    return changed
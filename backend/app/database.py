@@ -1,23 +1,226 @@
 import os
-from sqlalchemy import create_engine
+import asyncio
+from sqlalchemy import create_engine, event, inspect, text
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.engine import make_url
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 
+from . import metrics
+
 SQLALCHEMY_DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///./family_ledger.db")
 
 # Fix for Render's postgres:// URL scheme which SQLAlchemy doesn't support anymore
 if SQLALCHEMY_DATABASE_URL and SQLALCHEMY_DATABASE_URL.startswith("postgres://"):
     SQLALCHEMY_DATABASE_URL = SQLALCHEMY_DATABASE_URL.replace("postgres://", "postgresql://", 1)
 
-if SQLALCHEMY_DATABASE_URL.startswith("sqlite"):
-    engine = create_engine(SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False})
-else:
-    engine = create_engine(SQLALCHEMY_DATABASE_URL)
+# Engine profile (DB_PROFILE): "tuned" applies the per-dialect settings below, "basic" keeps
+# SQLAlchemy's defaults. Compare them with `python -m benchmarks.bench_db`.
+DB_PROFILE = os.getenv("DB_PROFILE", "tuned")
+# SQLite: WAL lets readers run alongside the single writer; NORMAL sync is durable in WAL mode
+# except for the last commits on power loss
+SQLITE_MMAP_SIZE = int(os.getenv("SQLITE_MMAP_SIZE", str(256 * 1024 * 1024)))
+SQLITE_CACHE_KB = int(os.getenv("SQLITE_CACHE_KB", "65536"))
+SQLITE_BUSY_TIMEOUT_MS = int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "5000"))
+# Postgres: one uvicorn worker, so the async pool carries the API and the bot; the sync pool only
+# serves exports, init_db and the worker-thread fallback
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "5"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "5"))
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "300"))  # Render drops idle connections while the service sleeps
+DB_CONNECT_TIMEOUT = int(os.getenv("DB_CONNECT_TIMEOUT", "10"))
+DB_STATEMENT_TIMEOUT_MS = int(os.getenv("DB_STATEMENT_TIMEOUT_MS", "15000"))
+DB_IDLE_TX_TIMEOUT_MS = int(os.getenv("DB_IDLE_TX_TIMEOUT_MS", "60000"))
+
+_backend = make_url(SQLALCHEMY_DATABASE_URL).get_backend_name()
+_tuned = DB_PROFILE == "tuned"
+
+def _set_sqlite_pragmas(dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    for pragma in (
+        "PRAGMA journal_mode=WAL",
+        "PRAGMA synchronous=NORMAL",
+        f"PRAGMA mmap_size={SQLITE_MMAP_SIZE}",
+        f"PRAGMA cache_size=-{SQLITE_CACHE_KB}",
+        f"PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT_MS}",
+        "PRAGMA temp_store=MEMORY",
+    ):
+        cursor.execute(pragma)
+    cursor.close()
+
+def _engine_kwargs(is_async: bool, pool_size: int) -> dict:
+    kwargs = {"connect_args": {}}
+    if _backend == "sqlite" and not is_async:
+        kwargs["connect_args"]["check_same_thread"] = False
+    if _backend == "postgresql" and _tuned:
+        kwargs.update(pool_size=pool_size, max_overflow=DB_MAX_OVERFLOW, pool_timeout=DB_CONNECT_TIMEOUT,
+                      pool_pre_ping=True, pool_recycle=DB_POOL_RECYCLE)
+        if is_async:  # asyncpg
+            kwargs["connect_args"].update(timeout=DB_CONNECT_TIMEOUT, server_settings={
+                "statement_timeout": str(DB_STATEMENT_TIMEOUT_MS),
+                "idle_in_transaction_session_timeout": str(DB_IDLE_TX_TIMEOUT_MS),
+            })
+        else:  # psycopg2 / libpq
+            kwargs["connect_args"].update(connect_timeout=DB_CONNECT_TIMEOUT, options=(
+                f"-c statement_timeout={DB_STATEMENT_TIMEOUT_MS} "
+                f"-c idle_in_transaction_session_timeout={DB_IDLE_TX_TIMEOUT_MS}"
+            ))
+    return kwargs
+
+def _tune(engine):
+    if _backend == "sqlite" and _tuned:
+        event.listen(engine, "connect", _set_sqlite_pragmas)
+    metrics.instrument_engine(engine)
+
+def _async_engine_args(url: str):
+    """Map the sync URL onto its asyncio driver (aiosqlite / asyncpg)."""
+    url = make_url(url)
+    connect_args = {}
+    if url.get_backend_name() == "sqlite":
+        url = url.set(drivername="sqlite+aiosqlite")
+    elif url.get_backend_name() == "postgresql":
+        # asyncpg doesn't understand libpq's sslmode query parameter
+        sslmode = url.query.get("sslmode")
+        if sslmode:
+            url = url.difference_update_query(["sslmode"])
+            if sslmode != "disable":
+                connect_args["ssl"] = "require" if sslmode in ("require", "prefer", "allow") else True
+        url = url.set(drivername="postgresql+asyncpg")
+    else:
+        return None, None
+    return url, connect_args
+
+# Async path, used by the API routes and the bot handlers so a slow commit never blocks the event loop.
+# Falls back to running the same sync code in a worker thread when the driver isn't installed
+# or DB_ASYNC=0.
+async_engine = None
+AsyncSessionLocal = None
+if os.getenv("DB_ASYNC", "1") != "0":
+    try:
+        from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+
+        _async_url, _async_connect_args = _async_engine_args(SQLALCHEMY_DATABASE_URL)
+        if _async_url is not None:
+            _async_kwargs = _engine_kwargs(True, DB_POOL_SIZE)
+            _async_kwargs["connect_args"].update(_async_connect_args)
+            async_engine = create_async_engine(_async_url, **_async_kwargs)
+            _tune(async_engine.sync_engine)
+            AsyncSessionLocal = async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False)
+    except ImportError as e:
+        print(f"Async DB driver not available ({e}), using sync sessions in worker threads.")
+
+engine = create_engine(SQLALCHEMY_DATABASE_URL, **_engine_kwargs(False, 2 if async_engine is not None else DB_POOL_SIZE))
+_tune(engine)
 
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
 Base = declarative_base()
 
+# SQLite allows one writer at a time. With the tuned profile, writes going through run_db queue
+# here instead of racing for the file lock (and failing with "database is locked" once
+# busy_timeout runs out); readers are never held up.
+_write_lock = asyncio.Lock() if _backend == "sqlite" and _tuned else None
+
+def writes(fn):
+    """Mark a crud function as writing, so run_db serializes it on SQLite (see _write_lock)."""
+    fn.writes_db = True
+    return fn
+
+# Columns added to tables that already shipped: (table, column, DDL). create_all() never alters
+# an existing table.
+ADDED_COLUMNS = [
+    ("transactions", "ledger_id", "VARCHAR NOT NULL DEFAULT 'default'"),
+    ("transaction_changes", "ledger_id", "VARCHAR NOT NULL DEFAULT 'default'"),
+]
+# Indexes replaced by later ones
+DROPPED_INDEXES = [
+    "ix_transactions_currency_created_at_category",
+    "ix_transactions_currency_created_at_user_id",
+    "ix_transactions_created_at_id",
+]
+
+def _migrate():
+    inspector = inspect(engine)
+    tables = set(inspector.get_table_names())
+    with engine.begin() as conn:
+        for table, column, ddl in ADDED_COLUMNS:
+            if table in tables and column not in {c["name"] for c in inspector.get_columns(table)}:
+                print(f"Adding column {table}.{column}")
+                conn.execute(text(f"ALTER TABLE {table} ADD COLUMN {column} {ddl}"))
+        for name in DROPPED_INDEXES:
+            conn.execute(text(f"DROP INDEX IF EXISTS {name}"))
+
+def init_db():
+    from . import models  # noqa: F401 - registers tables on Base.metadata
+    Base.metadata.create_all(bind=engine)
+    _migrate()
+    # create_all() skips indexes on tables that already exist, so add new ones explicitly
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(bind=engine, checkfirst=True)
+    from . import search
+    search.install(engine)
+    from . import crud
+    from .services import fx
+    db = SessionLocal()
+    try:
+        crud.ensure_rollups(db)
+        if fx.FX_RATES_FILE:
+            print(f"Loaded {fx.load_rates_file(db, fx.FX_RATES_FILE)} FX rates from {fx.FX_RATES_FILE}")
+    finally:
+        db.close()
+
+# Background schema check started by the app at startup (see init_db_in_background)
+_schema_task: asyncio.Task | None = None
+
+def init_db_in_background() -> asyncio.Task:
+    """Run init_db in a worker thread so the server can answer while a remote database is checked."""
+    global _schema_task
+    _schema_task = asyncio.create_task(asyncio.to_thread(init_db))
+    return _schema_task
+
+def _run_sync_session(fn, *args, **kwargs):
+    db = SessionLocal(expire_on_commit=False)
+    try:
+        return fn(db, *args, **kwargs)
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        db.close()
+
+async def run_db(fn, *args, **kwargs):
+    """
+    Await fn(session, *args, **kwargs) without blocking the event loop.
+
+    fn is ordinary sync SQLAlchemy code (see crud.py). With an async driver it runs through
+    AsyncSession.run_sync, so IO is awaited on the loop; otherwise it runs in a worker thread.
+    Returned objects are detached but keep their loaded attributes.
+    """
+    try:
+        return await _run_db(fn, *args, **kwargs)
+    except SQLAlchemyError:
+        # Existing tables are usable straight away; only a fresh database has to wait for the schema
+        if _schema_task is None or _schema_task.done():
+            raise
+        await asyncio.shield(_schema_task)
+        return await _run_db(fn, *args, **kwargs)
+
+async def _run_db(fn, *args, **kwargs):
+    if _write_lock is not None and getattr(fn, "writes_db", False):
+        async with _write_lock:
+            return await _run_session(fn, *args, **kwargs)
+    return await _run_session(fn, *args, **kwargs)
+
+async def _run_session(fn, *args, **kwargs):
+    if AsyncSessionLocal is None:
+        return await asyncio.to_thread(_run_sync_session, fn, *args, **kwargs)
+    async with AsyncSessionLocal() as session:
+        try:
+            return await session.run_sync(fn, *args, **kwargs)
+        except Exception:
+            await session.rollback()
+            raise
+
 def get_db():
     db = SessionLocal()
     try:
@@ -1,40 +1,92 @@
-from fastapi import FastAPI, Depends, HTTPException
+from . import startup  # first, so the import phase is timed
+from fastapi import FastAPI, HTTPException, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
-from sqlalchemy.orm import Session
-from typing import List
+from fastapi.middleware.gzip import GZipMiddleware
+from fastapi.responses import StreamingResponse, PlainTextResponse
+from typing import List, Optional
 from contextlib import asynccontextmanager
+from datetime import datetime
 import asyncio
+import base64
+import csv
+import importlib
+import io
+import json
+import os
 
-from . import models, schemas, database
-from .database import engine, get_db
-from .services.bot import create_bot_app
+from . import models, schemas, database, crud, metrics, columnar, search, reports
+from .database import run_db
+from .services.llm import llm_stats
+from .services.imaging import receipt_cache
+from .services.webhook import BOT_MODE, WEBHOOK_PATH, WebhookIngress
+from .services.scheduler import scheduler
+from .services.state import pending_states
+from .services import llm
+from .services.fx import FX_BASE, rate_cache
+from .services import events
 
-# Create tables
-models.Base.metadata.create_all(bind=engine)
+# FAST_START=1 (default): answer requests at once and run the schema check and bot startup in the
+# background. FAST_START=0 finishes both before serving.
+FAST_START = os.getenv("FAST_START", "1") != "0"
 
 bot_app = None
+webhook_ingress = None
+
+async def _init_schema():
+    with startup.phase("schema"):
+        await database.init_db_in_background()
+
+async def _start_bot():
+    global bot_app, webhook_ingress
+    if not os.getenv("TELEGRAM_BOT_TOKEN"):
+        print("Telegram Bot Token not set, skipping bot startup.")
+        return
+    with startup.phase("bot"):
+        # python-telegram-bot is only imported when there is a bot to run, and off the event loop
+        with startup.phase("bot_import"):
+            bot_module = await asyncio.to_thread(importlib.import_module, ".services.bot", __package__)
+        application = bot_module.create_bot_app()
+        print(f"Starting Telegram Bot ({BOT_MODE})...")
+        await application.initialize()
+        await application.start()
+        bot_app = application
+        if BOT_MODE == "webhook":
+            ingress = WebhookIngress(application)
+            await ingress.start()
+            webhook_ingress = ingress
+        else:
+            await application.updater.start_polling()
+
+async def _run_startup():
+    for name, result in zip(("schema", "bot"), await asyncio.gather(_init_schema(), _start_bot(), return_exceptions=True)):
+        if isinstance(result, Exception):
+            print(f"Startup {name} failed: {result!r}")
+    if llm.API_KEY:
+        # Served requests don't wait for this, but the first expense message shouldn't pay for it either
+        await asyncio.to_thread(llm.warm_up)
+    startup.log_summary()
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     # Startup logic
     print("Backend started...")
-    
-    global bot_app
-    bot_app = create_bot_app()
-    if bot_app:
-        print("Starting Telegram Bot...")
-        await bot_app.initialize()
-        await bot_app.start()
-        await bot_app.updater.start_polling()
-    else:
-        print("Telegram Bot Token not set, skipping bot startup.")
+    startup_task = asyncio.create_task(_run_startup())
+    if not FAST_START:
+        await startup_task
+    startup.mark("ready")
 
     yield
     
     # Shutdown logic
+    if not startup_task.done():
+        startup_task.cancel()
+        await asyncio.gather(startup_task, return_exceptions=True)
     if bot_app:
         print("Stopping Telegram Bot...")
-        await bot_app.updater.stop()
+        if webhook_ingress:
+            await webhook_ingress.stop()
+        else:
+            await bot_app.updater.stop()
         await bot_app.stop()
         await bot_app.shutdown()
         
@@ -49,31 +101,315 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["ETag", "X-Ledger-Cursor"],
 )
+# Listings and exports are repetitive text; brotli when brotli-asgi is installed, else gzip.
+# Level 5 keeps most of the size win for a fraction of level 9's CPU.
+try:
+    from brotli_asgi import BrotliMiddleware
+    app.add_middleware(BrotliMiddleware, quality=4, minimum_size=1024, gzip_fallback=True)
+except ImportError:
+    app.add_middleware(GZipMiddleware, minimum_size=1024, compresslevel=5)
+app.add_middleware(metrics.MetricsMiddleware)
+
+# Read at scrape time
+metrics.Gauge("bot_jobs", "Bot jobs by kind and state", lambda: {
+    (kind, state): stats[state]
+    for kind, stats in scheduler.stats().items() if isinstance(stats, dict)
+    for state in ("queued", "running")
+}, ("kind", "state"))
+metrics.Gauge("bot_pending_states", "Expenses waiting for the user's item reply", lambda: len(pending_states))
+metrics.Gauge("webhook_queue_depth", "Webhook updates waiting behind their sender's previous update",
+              lambda: webhook_ingress.depth() if webhook_ingress else 0)
+metrics.Gauge("llm_circuit_open", "1 while the LLM circuit breaker rejects calls",
+              lambda: int(llm.llm_client is not None and llm.llm_client.breaker.state != "closed"))
+metrics.Gauge("sse_clients", "Connected /transactions/stream clients", events.broker.clients)
+metrics.Gauge("report_cache_entries", "Cached ledger-months of report extracts", lambda: reports.period_cache.stats()["entries"])
+metrics.Gauge("receipt_cache_entries", "Cached receipt parses", lambda: receipt_cache.stats()["entries"])
+metrics.Gauge("startup_phase_seconds", "Duration of each startup phase", lambda: {
+    (name,): value for name, value in startup.phases.items()
+}, ("phase",))
+metrics.Gauge("startup_ready_seconds", "Seconds from process launch until the API served requests",
+              lambda: startup.marks.get("ready", 0.0))
 
 @app.get("/")
 def read_root():
     return {"message": "Family Ledger API is running"}
 
+@app.get("/llm/stats")
+def read_llm_stats():
+    return {**llm_stats(), "receipt_cache": receipt_cache.stats()}
+
+@app.get("/startup")
+def read_startup():
+    """Cold-start breakdown: seconds from launch to ready, and each startup phase."""
+    return startup.report()
+
+@app.get("/metrics")
+def read_metrics():
+    return PlainTextResponse(metrics.render(), media_type=metrics.CONTENT_TYPE)
+
+@app.get("/bot/stats")
+def read_bot_stats():
+    """Handler job queues (per kind) and, in webhook mode, the update ingress queue."""
+    return {"jobs": scheduler.stats(), "webhook": webhook_ingress.stats() if webhook_ingress else None,
+            "live": events.broker.stats()}
+
+def _month_range(month: Optional[str]):
+    """'YYYY-MM' -> [start, end) datetimes, so filters stay index range scans."""
+    if not month:
+        return None
+    try:
+        start = datetime.strptime(month, "%Y-%m")
+    except ValueError:
+        raise HTTPException(status_code=400, detail="month must be YYYY-MM")
+    if start.month == 12:
+        end = start.replace(year=start.year + 1, month=1)
+    else:
+        end = start.replace(month=start.month + 1)
+    return start, end
+
+def _listing_format(format: Optional[str], raw_text: bool):
+    """Columns for ?format=columnar, None for the default JSON objects."""
+    if format in (None, "json"):
+        return None
+    if format != "columnar":
+        raise HTTPException(status_code=400, detail="format must be json or columnar")
+    return columnar.COLUMNS + (["raw_text"] if raw_text else [])
+
+@app.get("/ledgers/{ledger_id}", response_model=schemas.Ledger)
+async def read_ledger(ledger_id: str):
+    ledger = await run_db(crud.get_ledger, ledger_id)
+    if ledger is None:
+        raise HTTPException(status_code=404, detail="Ledger not found")
+    return ledger
+
 @app.get("/transactions/", response_model=List[schemas.Transaction])
-def read_transactions(skip: int = 0, limit: int = 100, db: Session = Depends(get_db)):
-    transactions = db.query(models.Transaction).order_by(models.Transaction.created_at.desc()).offset(skip).limit(limit).all()
+async def read_transactions(response: Response, skip: int = 0, limit: int = 100, currency: Optional[str] = None,
+                            month: Optional[str] = None, format: Optional[str] = None, raw_text: bool = False,
+                            ledger: str = crud.DEFAULT_LEDGER):
+    columns = _listing_format(format, raw_text)
+    cursor, transactions = await run_db(crud.list_transactions, ledger, skip, limit, currency, _month_range(month), columns)
+    if columns:
+        return Response(columnar.dumps(columnar.encode(transactions, columns)), media_type="application/json",
+                        headers={"X-Ledger-Cursor": str(cursor)})
+    # Read before the rows: anything committed in between is replayed by /transactions/changes
+    response.headers["X-Ledger-Cursor"] = str(cursor)
     return transactions
 
+def _encode_cursor(tx) -> str:
+    raw = json.dumps([tx.created_at.isoformat(), tx.id]).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+def _decode_cursor(cursor: str):
+    try:
+        created_at, tx_id = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+        return datetime.fromisoformat(created_at), int(tx_id)
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+@app.get("/transactions/page", response_model=schemas.TransactionPage)
+async def read_transactions_page(cursor: Optional[str] = None, limit: int = 100, currency: Optional[str] = None,
+                                 month: Optional[str] = None, format: Optional[str] = None, raw_text: bool = False,
+                                 ledger: str = crud.DEFAULT_LEDGER):
+    """Keyset pagination on (created_at, id): every page is an index seek, however deep."""
+    limit = max(1, min(limit, 500))
+    columns = _listing_format(format, raw_text)
+    after = _decode_cursor(cursor) if cursor else None
+    items = await run_db(crud.list_transactions_after, ledger, after, limit + 1, currency, _month_range(month), columns)
+    next_cursor = _encode_cursor(items[limit - 1]) if len(items) > limit else None
+    if columns:
+        payload = {**columnar.encode(items[:limit], columns), "next_cursor": next_cursor}
+        return Response(columnar.dumps(payload), media_type="application/json")
+    return {"items": items[:limit], "next_cursor": next_cursor}
+
+@app.get("/transactions/search", response_model=schemas.TransactionSearchPage)
+async def search_transactions(q: str, offset: int = 0, limit: int = 20, currency: Optional[str] = None,
+                              ledger: str = crud.DEFAULT_LEDGER):
+    """Ranked search over item and raw_text, e.g. ?q=星巴克 or ?q=mtr; pages with next_offset."""
+    limit = max(1, min(limit, 100))
+    offset = max(0, offset)
+    items = await run_db(search.search_transactions, ledger, q, offset, limit + 1, currency)
+    return {"items": items[:limit], "next_offset": offset + limit if len(items) > limit else None}
+
+EXPORT_COLUMNS = ["id", "created_at", "user_id", "user_name", "amount", "currency", "category", "item", "raw_text"]
+EXPORT_CHUNK = 500
+
+def _export_rows(ledger_id: str, currency: Optional[str], month_range):
+    """
+    Stream plain column tuples through a server-side cursor; no ORM objects or Pydantic models.
+    Stays on the sync engine: Starlette iterates sync generators in its threadpool.
+    """
+    db = database.SessionLocal()
+    try:
+        tx = models.Transaction
+        query = crud.filter_transactions(db.query(*[getattr(tx, name) for name in EXPORT_COLUMNS]), ledger_id, currency, month_range)
+        yield from query.order_by(tx.created_at.desc(), tx.id.desc()).yield_per(EXPORT_CHUNK)
+    finally:
+        db.close()
+
+def _export_ndjson(rows):
+    lines = []
+    for row in rows:
+        record = dict(zip(EXPORT_COLUMNS, row))
+        record["created_at"] = record["created_at"].isoformat() if record["created_at"] else None
+        lines.append(json.dumps(record, ensure_ascii=False))
+        if len(lines) >= EXPORT_CHUNK:
+            yield "\n".join(lines) + "\n"
+            lines = []
+    if lines:
+        yield "\n".join(lines) + "\n"
+
+def _export_csv(rows):
+    buf = io.StringIO()
+    writer = csv.writer(buf)
+    writer.writerow(EXPORT_COLUMNS)
+    for i, row in enumerate(rows, 1):
+        writer.writerow(row)
+        if i % EXPORT_CHUNK == 0:
+            yield buf.getvalue()
+            buf.seek(0)
+            buf.truncate()
+    yield buf.getvalue()
+
+@app.get("/transactions/export")
+def export_transactions(format: str = "ndjson", currency: Optional[str] = None, month: Optional[str] = None,
+                        ledger: str = crud.DEFAULT_LEDGER):
+    # Validated here, before the response starts streaming
+    rows = _export_rows(ledger, currency, _month_range(month))
+    if format == "csv":
+        body, media_type = _export_csv(rows), "text/csv; charset=utf-8"
+    elif format == "ndjson":
+        body, media_type = _export_ndjson(rows), "application/x-ndjson"
+    else:
+        raise HTTPException(status_code=400, detail="format must be ndjson or csv")
+    filename = f"transactions{'-' + month if month else ''}.{format}"
+    return StreamingResponse(body, media_type=media_type,
+                             headers={"Content-Disposition": f'attachment; filename="{filename}"'})
+
+@app.get("/stats", response_model=schemas.Stats)
+async def read_stats(currency: str = "CNY", month: Optional[str] = None, ledger: str = crud.DEFAULT_LEDGER):
+    """Monthly totals, category breakdown and member ranking, read from monthly_rollups."""
+    month = month or datetime.now().strftime("%Y-%m")
+    _month_range(month)  # validate
+    stats = await run_db(crud.get_stats, ledger, currency, month)
+    return {"currency": currency, "month": month, **stats}
+
+@app.get("/stats/consolidated", response_model=schemas.ConsolidatedStats)
+async def read_consolidated_stats(target: str = FX_BASE, month: Optional[str] = None, ledger: str = crud.DEFAULT_LEDGER):
+    """The month across every currency, converted to `target` at each transaction's daily rate."""
+    month = month or datetime.now().strftime("%Y-%m")
+    month_range = _month_range(month)
+    rates = await rate_cache.get()
+    target = target.upper()
+    if target not in rates:
+        raise HTTPException(status_code=400, detail=f"No exchange rate for {target}")
+    stats = await run_db(crud.get_consolidated_stats, ledger, month_range, FX_BASE, target, rates)
+    return {"target": target, "month": month, **stats}
+
+@app.get("/reports/timeseries", response_model=schemas.TimeSeriesReport)
+async def read_timeseries(granularity: str = "month", start: Optional[str] = None, end: Optional[str] = None,
+                          group_by: str = "total", window: Optional[int] = None, currency: Optional[str] = None,
+                          ledger: str = crud.DEFAULT_LEDGER):
+    """
+    Spending per day / week / month between start and end (YYYY-MM-DD, default: the last
+    90 days / 26 weeks / 12 months), one series per currency and category, member or total,
+    with a trailing `window`-bucket average (default 7 days / 4 weeks / 3 months) and the change against the previous bucket.
+    """
+    if group_by not in reports.GROUP_BY:
+        raise HTTPException(status_code=400, detail=f"group_by must be one of {', '.join(reports.GROUP_BY)}")
+    try:
+        start_day, end_day = reports.resolve_range(granularity, start, end)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    window = max(1, min(window or reports.DEFAULT_WINDOW[granularity], 52))
+    report = await reports.timeseries(ledger, granularity, start_day, end_day, group_by, window, currency)
+    return {"granularity": granularity, "start": start_day, "end": end_day, "group_by": group_by,
+            "window": window, **report}
+
+@app.get("/transactions/changes", response_model=schemas.TransactionChanges)
+async def read_transaction_changes(request: Request, response: Response, since: int = 0,
+                                   ledger: str = crud.DEFAULT_LEDGER):
+    """Delta since a cursor. Idle polls send If-None-Match and get a bodyless 304."""
+    changes = await run_db(crud.changes_since, ledger, since, request.headers.get("if-none-match"))
+    if changes is None:
+        return Response(status_code=304, headers={"ETag": request.headers["if-none-match"]})
+    response.headers["ETag"] = f'"{changes["cursor"]}"'
+    return changes
+
+@app.get("/transactions/stream")
+async def stream_transaction_changes(request: Request, since: Optional[int] = None, ledger: str = crud.DEFAULT_LEDGER):
+    """
+    Server-Sent Events: a "changes" event (same body as /transactions/changes, id = cursor) after
+    every write to the ledger, and a comment heartbeat while idle. Resumes from Last-Event-ID on
+    reconnect, else from `since`; without either it starts at the current cursor.
+    """
+    last_event_id = request.headers.get("last-event-id")
+    if last_event_id and last_event_id.isdigit():
+        since = int(last_event_id)
+    if events.broker.clients() >= events.SSE_MAX_CLIENTS:
+        return Response(status_code=503, headers={"Retry-After": "10"})
+
+    async def stream():
+        # Subscribe before the first read, so a write in between still wakes us
+        wake = events.broker.subscribe(ledger)
+        try:
+            cursor = since
+            if cursor is None:
+                cursor = await run_db(crud.current_cursor, ledger)
+            yield f"retry: {events.SSE_RETRY_MS}\n" + events.format_event(str(cursor), "hello", cursor)
+            check = since is not None  # catch up on anything after the client's cursor
+            while True:
+                if check:
+                    changes = await run_db(crud.changes_since, ledger, cursor)
+                    if changes["reset"] or changes["upserts"] or changes["deletes"]:
+                        body = schemas.TransactionChanges.model_validate(changes, from_attributes=True)
+                        yield events.format_event(body.model_dump_json(), "changes", changes["cursor"])
+                    cursor = changes["cursor"]
+                check = await events.wait(wake)
+                if not check:
+                    yield ": ping\n\n"
+        finally:
+            events.broker.unsubscribe(ledger, wake)
+
+    return StreamingResponse(stream(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+@app.post(WEBHOOK_PATH)
+async def telegram_webhook(request: Request):
+    """Telegram update delivery (BOT_MODE=webhook). Answers fast; handlers run from the ingress queue."""
+    if webhook_ingress is None:
+        if BOT_MODE == "webhook" and os.getenv("TELEGRAM_BOT_TOKEN"):
+            # Still starting up: Telegram keeps the update and retries
+            return Response(status_code=503, headers={"Retry-After": "2"})
+        raise HTTPException(status_code=404, detail="Webhook mode is not enabled")
+    if not webhook_ingress.check_secret(request.headers.get("x-telegram-bot-api-secret-token")):
+        raise HTTPException(status_code=403, detail="Invalid secret token")
+    try:
+        payload = await request.json()
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid JSON")
+    if not isinstance(payload, dict):
+        raise HTTPException(status_code=400, detail="Invalid update")
+    if webhook_ingress.submit(payload) == "busy":
+        # Telegram keeps the update and redelivers it later
+        return Response(status_code=503, headers={"Retry-After": "5"})
+    return {"ok": True}
+
 @app.post("/transactions/", response_model=schemas.Transaction)
-def create_transaction(transaction: schemas.TransactionCreate, db: Session = Depends(get_db)):
-    db_transaction = models.Transaction(**transaction.dict())
-    db.add(db_transaction)
-    db.commit()
-    db.refresh(db_transaction)
-    return db_transaction
+async def create_transaction(transaction: schemas.TransactionCreate, ledger: str = crud.DEFAULT_LEDGER):
+    tx = await run_db(crud.create_transaction, {**transaction.dict(), "ledger_id": ledger})
+    events.broker.publish(ledger)
+    return tx
 
 @app.delete("/transactions/reset")
-def reset_transactions(db: Session = Depends(get_db)):
+async def reset_transactions(ledger: str = crud.DEFAULT_LEDGER):
+    """Deletes one ledger's transactions only."""
     try:
-        num_deleted = db.query(models.Transaction).delete()
-        db.commit()
+        num_deleted = await run_db(crud.reset_transactions, ledger)
+        events.broker.publish(ledger)
         return {"message": f"Deleted {num_deleted} transactions"}
     except Exception as e:
-        db.rollback()
         raise HTTPException(status_code=500, detail=str(e))
+
+startup.mark("app_imported")
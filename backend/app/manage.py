@@ -0,0 +1,83 @@
+"""
+Maintenance commands, run from backend/:
+
+    python -m app.manage rebuild-rollups
+    python -m app.manage verify-rollups
+    python -m app.manage move-ledger default <chat id>   # hand the pre-ledger rows to a family chat
+    python -m app.manage load-fx rates.csv               # daily FX rates, see services/fx.py
+    python -m app.manage reclassify [ledger]             # re-derive stored categories from item / raw_text
+"""
+import argparse
+import sys
+
+from . import database, crud
+from .services import fx
+
+def rebuild_rollups(args):
+    db = database.SessionLocal()
+    try:
+        print(f"Rebuilt monthly_rollups: {crud.rebuild_rollups(db)} rows")
+    finally:
+        db.close()
+
+def verify_rollups(args):
+    db = database.SessionLocal()
+    try:
+        mismatches = crud.verify_rollups(db)
+    finally:
+        db.close()
+    for key, (have_amount, have_count), (want_amount, want_count) in mismatches:
+        print(f"{'/'.join(key)}: stored {have_amount:.2f} x{have_count}, expected {want_amount:.2f} x{want_count}")
+    if mismatches:
+        print(f"{len(mismatches)} rollup rows out of date, run rebuild-rollups")
+        return 1
+    print("monthly_rollups OK")
+    return 0
+
+def move_ledger(args):
+    if len(args.args) != 2:
+        print("usage: python -m app.manage move-ledger SOURCE TARGET")
+        return 2
+    source, target = args.args
+    db = database.SessionLocal()
+    try:
+        print(f"Moved {crud.move_ledger(db, source, target)} transactions from ledger {source} to {target}")
+    finally:
+        db.close()
+
+def load_fx(args):
+    if len(args.args) != 1:
+        print("usage: python -m app.manage load-fx RATES.csv")
+        return 2
+    db = database.SessionLocal()
+    try:
+        print(f"Loaded {fx.load_rates_file(db, args.args[0])} daily FX rates")
+    finally:
+        db.close()
+
+def reclassify(args):
+    db = database.SessionLocal()
+    try:
+        changed = crud.reclassify_transactions(db, args.args[0] if args.args else None)
+        print(f"Reclassified {changed} transactions")
+    finally:
+        db.close()
+
+COMMANDS = {
+    "rebuild-rollups": rebuild_rollups,
+    "verify-rollups": verify_rollups,
+    "move-ledger": move_ledger,
+    "load-fx": load_fx,
+    "reclassify": reclassify,
+}
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m app.manage")
+    parser.add_argument("command", choices=sorted(COMMANDS))
+    parser.add_argument("args", nargs="*")
+    args = parser.parse_args(argv)
+    database.init_db()
+    return COMMANDS[args.command](args) or 0
+
+if __name__ == "__main__":
+    sys.exit(main())
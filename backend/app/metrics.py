@@ -0,0 +1,223 @@
+"""
+Minimal in-process metrics registry rendered in the Prometheus text format at GET /metrics.
+
+Counters and histograms are updated from the hot paths (LLM client, SQLAlchemy engine events,
+bot handlers, HTTP middleware); gauges are read from callbacks at scrape time. Everything is
+process-local and resets on restart, which is what Prometheus expects from a scrape target.
+"""
+import time
+import threading
+from bisect import bisect_left
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+LLM_BUCKETS = (0.1, 0.25, 0.5, 1.0, 2.0, 4.0, 8.0, 15.0, 30.0, 60.0)
+DB_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1.0)
+
+_lock = threading.Lock()  # DB events also fire on worker threads
+_metrics: list = []
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def _labels(names: tuple, values: tuple, extra: str = "") -> str:
+    parts = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+def _number(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+class Counter:
+    def __init__(self, name: str, help: str, labels: tuple = ()):
+        self.name, self.help, self.label_names = name, help, labels
+        self._values: dict[tuple, float] = {}
+        _metrics.append(self)
+
+    def inc(self, amount: float = 1, **labels):
+        key = tuple(labels.get(name, "") for name in self.label_names)
+        with _lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        for key, value in sorted(self._values.items()):
+            lines.append(f"{self.name}{_labels(self.label_names, key)} {_number(value)}")
+        return lines
+
+class Histogram:
+    def __init__(self, name: str, help: str, labels: tuple = (), buckets: tuple = LATENCY_BUCKETS):
+        self.name, self.help, self.label_names = name, help, labels
+        self.buckets = tuple(buckets)
+        self._values: dict[tuple, list] = {}  # key -> [bucket counts..., sum, count]
+        _metrics.append(self)
+
+    def observe(self, value: float, **labels):
+        key = tuple(labels.get(name, "") for name in self.label_names)
+        index = bisect_left(self.buckets, value)
+        with _lock:
+            series = self._values.get(key)
+            if series is None:
+                series = self._values[key] = [0] * len(self.buckets) + [0.0, 0]
+            if index < len(self.buckets):
+                series[index] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def time(self, **labels):
+        return _Timer(self, labels)
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        for key, series in sorted(self._values.items()):
+            cumulative = 0
+            for bound, n in zip(self.buckets, series):
+                cumulative += n
+                le = 'le="%s"' % _number(bound)
+                lines.append(f"{self.name}_bucket{_labels(self.label_names, key, le)} {cumulative}")
+            le = 'le="+Inf"'
+            lines.append(f"{self.name}_bucket{_labels(self.label_names, key, le)} {series[-1]}")
+            lines.append(f"{self.name}_sum{_labels(self.label_names, key)} {_number(series[-2])}")
+            lines.append(f"{self.name}_count{_labels(self.label_names, key)} {series[-1]}")
+        return lines
+
+class _Timer:
+    def __init__(self, histogram: Histogram, labels: dict):
+        self.histogram, self.labels = histogram, labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.histogram.observe(time.perf_counter() - self.start, **self.labels)
+
+class Gauge:
+    """Value read at scrape time: fn() returns a number, or {label values tuple: number}."""
+
+    def __init__(self, name: str, help: str, fn, labels: tuple = ()):
+        self.name, self.help, self.fn, self.label_names = name, help, fn, labels
+        _metrics.append(self)
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} gauge"]
+        try:
+            values = self.fn()
+        except Exception as e:
+            print(f"Gauge {self.name} failed: {e}")
+            return lines
+        if not isinstance(values, dict):
+            values = {(): values}
+        for key, value in sorted(values.items()):
+            lines.append(f"{self.name}{_labels(self.label_names, key)} {_number(value)}")
+        return lines
+
+def render() -> str:
+    lines = []
+    for metric in _metrics:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# LLM
+llm_latency = Histogram("llm_request_duration_seconds", "LLM chat completion latency, retries included",
+                        ("model", "outcome"), LLM_BUCKETS)
+llm_tokens = Counter("llm_tokens_total", "Tokens reported by the provider", ("model", "type"))
+llm_escalations = Counter("llm_escalations_total", "Fast-tier LLM answers re-asked on the full model",
+                          ("kind", "reason"))
+expense_parses = Counter("expense_parse_total",
+                         "Where expense parses were answered: rules, cache, llm, or fallback (_simple_parse)",
+                         ("source",))
+
+# Database
+db_queries = Histogram("db_query_duration_seconds", "SQL statement execution time", ("operation",), DB_BUCKETS)
+
+# Bot and HTTP
+bot_handler_latency = Histogram("bot_handler_duration_seconds", "Telegram handler run time (excluding queueing)",
+                                ("handler", "outcome"))
+bot_job_wait = Histogram("bot_job_wait_seconds", "Time bot jobs waited for their turn / a concurrency slot",
+                         ("kind",))
+http_latency = Histogram("http_request_duration_seconds", "HTTP request latency until the response body is sent",
+                         ("method", "route", "status"))
+
+def record_llm_response(model: str, start: float, response=None, outcome: str = "ok"):
+    llm_latency.observe(time.perf_counter() - start, model=model, outcome=outcome)
+    usage = getattr(response, "usage", None)
+    if usage is not None:
+        llm_tokens.inc(usage.prompt_tokens or 0, model=model, type="prompt")
+        llm_tokens.inc(usage.completion_tokens or 0, model=model, type="completion")
+        details = getattr(usage, "prompt_tokens_details", None)
+        if details is not None and getattr(details, "cached_tokens", None):
+            llm_tokens.inc(details.cached_tokens, model=model, type="cached_prompt")
+
+def instrument_engine(engine):
+    """Time every statement on a (sync) SQLAlchemy engine; pass async_engine.sync_engine for the async one."""
+    from sqlalchemy import event
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def _before(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("query_start", []).append(time.perf_counter())
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def _after(conn, cursor, statement, parameters, context, executemany):
+        starts = conn.info.get("query_start")
+        if starts:
+            operation = statement.lstrip().split(None, 1)[0].lower() if statement.strip() else "other"
+            if operation not in ("select", "insert", "update", "delete", "with"):
+                operation = "other"
+            db_queries.observe(time.perf_counter() - starts.pop(), operation=operation)
+
+    @event.listens_for(engine, "handle_error")
+    def _error(context):
+        starts = context.connection.info.get("query_start") if context.connection is not None else None
+        if starts:
+            starts.pop()
+
+def timed_handler(name: str, handler):
+    """Wrap a bot handler so its run time lands in bot_handler_duration_seconds."""
+    async def run(update, context):
+        start = time.perf_counter()
+        outcome = "ok"
+        try:
+            return await handler(update, context)
+        except BaseException:
+            outcome = "error"
+            raise
+        finally:
+            bot_handler_latency.observe(time.perf_counter() - start, handler=name, outcome=outcome)
+    return run
+
+class MetricsMiddleware:
+    """
+    Pure ASGI middleware (streams aren't buffered): observes latency per route template, so
+    /transactions/123 and /transactions/456 share a series and unmatched paths don't add any.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        start = time.perf_counter()
+        status = {"code": 500}
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status["code"] = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            route = scope.get("route")
+            http_latency.observe(
+                time.perf_counter() - start,
+                method=scope["method"],
+                route=getattr(route, "path", "unmatched"),
+                status=status["code"],
+            )
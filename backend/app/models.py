@@ -1,7 +1,18 @@
-from sqlalchemy import Column, Integer, String, Float, DateTime, JSON
+from sqlalchemy import Column, Integer, String, Float, Date, DateTime, JSON, Index
 from datetime import datetime
 from .database import Base
 
+# Ledger of rows written before ledgers existed, and of API calls that don't name one
+DEFAULT_LEDGER = "default"
+
+class Ledger(Base):
+    """One family's book: the Telegram chat it is kept in (id = str(chat id)), or DEFAULT_LEDGER."""
+    __tablename__ = "ledgers"
+
+    id = Column(String, primary_key=True)
+    name = Column(String)  # chat title, or the member's name in a private chat
+    created_at = Column(DateTime, default=datetime.now)
+
 class BotState(Base):
     __tablename__ = "bot_states"
     
@@ -13,6 +24,7 @@ class Transaction(Base):
     __tablename__ = "transactions"
 
     id = Column(Integer, primary_key=True, index=True)
+    ledger_id = Column(String, nullable=False, default=DEFAULT_LEDGER, server_default=DEFAULT_LEDGER)
     user_id = Column(String, index=True) # Telegram User ID
     user_name = Column(String)           # Telegram User Name/Display Name
     
@@ -23,3 +35,77 @@ class Transaction(Base):
     
     raw_text = Column(String)                 # Original message text
     created_at = Column(DateTime, default=datetime.now)
+
+    __table_args__ = (
+        # Every query is scoped to one ledger, so each index leads with it and costs scale with
+        # that ledger's rows, not the whole table's
+        Index("ix_transactions_ledger_currency_created_at", "ledger_id", "currency", "created_at"),
+        # /undo: the member's latest row in this chat
+        Index("ix_transactions_ledger_user_id_created_at", "ledger_id", "user_id", "created_at"),
+    )
+
+# Keyset pagination walks (created_at DESC, id DESC) within a ledger
+Index("ix_transactions_ledger_created_at_id", Transaction.ledger_id, Transaction.created_at.desc(), Transaction.id.desc())
+
+class TransactionChange(Base):
+    """
+    Append-only change log. The autoincrement id is the dashboard's sync cursor; within a ledger ids
+    become visible in order (crud.lock_change_log).
+    """
+    __tablename__ = "transaction_changes"
+    __table_args__ = (
+        Index("ix_transaction_changes_ledger_id_id", "ledger_id", "id"),
+        {"sqlite_autoincrement": True},  # never reuse ids, cursors must only grow
+    )
+
+    id = Column(Integer, primary_key=True)
+    ledger_id = Column(String, nullable=False, default=DEFAULT_LEDGER, server_default=DEFAULT_LEDGER)
+    transaction_id = Column(Integer, index=True)  # NULL for 'reset'
+    op = Column(String, nullable=False)           # 'upsert', 'delete' or 'reset'
+    created_at = Column(DateTime, default=datetime.now)
+
+class ParseCacheEntry(Base):
+    """Optional persistent tier of the LLM parse cache (services/parse_cache.py)."""
+    __tablename__ = "llm_parse_cache"
+
+    key = Column(String, primary_key=True)         # sha1 of namespace + template
+    namespace = Column(String, nullable=False, index=True)  # prompt/model fingerprint
+    template = Column(String, nullable=False)      # normalized text, amount replaced by {n}
+    result = Column(JSON, nullable=False)
+    created_at = Column(DateTime, default=datetime.now)
+
+class MonthlyRollup(Base):
+    """
+    Per-month totals maintained by crud.py in the same transaction as the rows they summarise,
+    so /stats reads a handful of rows however large the ledger gets.
+    Rebuild / check with `python -m app.manage rebuild-rollups` / `verify-rollups`.
+    """
+    __tablename__ = "monthly_rollups"
+
+    ledger_id = Column(String, primary_key=True, default=DEFAULT_LEDGER)
+    currency = Column(String, primary_key=True)
+    month = Column(String, primary_key=True)     # 'YYYY-MM' of created_at
+    category = Column(String, primary_key=True)  # NULL categories count as '其他'
+    user_id = Column(String, primary_key=True)   # '' when the transaction has no user
+    user_name = Column(String)                   # latest display name seen for the member
+    amount = Column(Float, nullable=False, default=0.0)
+    count = Column(Integer, nullable=False, default=0)
+
+class BotOffset(Base):
+    """Highest Telegram update_id fully handled in webhook mode; older (re)deliveries are dropped."""
+    __tablename__ = "bot_offsets"
+
+    bot_id = Column(String, primary_key=True)
+    update_id = Column(Integer, nullable=False)
+    updated_at = Column(DateTime, default=datetime.now, onupdate=datetime.now)
+
+class FxRate(Base):
+    """
+    Daily exchange rates for consolidated reports: `rate` units of FX_BASE (services/fx.py) per one
+    unit of `currency`. Loaded from a file with `python -m app.manage load-fx`.
+    """
+    __tablename__ = "fx_rates"
+
+    currency = Column(String, primary_key=True)
+    day = Column(Date, primary_key=True)
+    rate = Column(Float, nullable=False)
@@ -0,0 +1,290 @@
+"""
+Time-series reports (GET /reports/timeseries): daily / weekly / monthly buckets per currency and
+category or member, with a trailing rolling average and the change against the previous bucket
+(month over month for monthly reports).
+
+Rows are read per ledger month as a small column extract (crud.daily_totals: one row per day and
+group, already summed in SQL) held in arrays. Closed months, i.e. before the current one, are
+cached in process; a commit that writes into a month drops just that month (crud.touch_periods
+plus the after_commit hook below), so back-dated receipts and deletes still show up. The current
+month is always read fresh. Bucketing runs as one vectorized pass with numpy when it is installed,
+and as a plain loop otherwise.
+"""
+import os
+import threading
+from collections import OrderedDict, defaultdict
+from datetime import date, datetime, timedelta
+
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+from . import crud
+from .database import run_db
+
+try:
+    import numpy as np
+except ImportError:  # optional: same results from the pure-Python loop
+    np = None
+
+REPORT_CACHE_MONTHS = int(os.getenv("REPORT_CACHE_MONTHS", "600"))  # ledger-months kept
+REPORT_MAX_BUCKETS = 1100
+GRANULARITIES = ("day", "week", "month")
+GROUP_BY = ("total", "category", "member")
+DEFAULT_WINDOW = {"day": 7, "week": 4, "month": 3}  # buckets in the rolling average
+DEFAULT_SPAN = {"day": 90, "week": 182, "month": 365}  # days back from `end` when no start is given
+
+class Extract:
+    """One ledger month of crud.daily_totals as parallel columns."""
+    __slots__ = ("days", "currencies", "categories", "user_ids", "user_names", "amounts", "counts")
+
+    def __init__(self, rows: list):
+        days = [row[0] if isinstance(row[0], date) else date.fromisoformat(str(row[0])[:10]) for row in rows]
+        self.days = [d.toordinal() for d in days]
+        self.currencies = [row[1] for row in rows]
+        self.categories = [row[2] for row in rows]
+        self.user_ids = [row[3] or "" for row in rows]
+        self.user_names = [row[4] for row in rows]
+        self.amounts = [float(row[5] or 0.0) for row in rows]
+        self.counts = [int(row[6] or 0) for row in rows]
+        if np is not None:
+            self.days = np.array(self.days, dtype=np.int64)
+            self.amounts = np.array(self.amounts, dtype=np.float64)
+            self.counts = np.array(self.counts, dtype=np.int64)
+
+class PeriodCache:
+    """LRU of closed-month extracts, with generation counters so a read racing a write isn't stored."""
+
+    def __init__(self, max_entries: int = REPORT_CACHE_MONTHS):
+        self.max_entries = max_entries
+        self._entries: OrderedDict[tuple, Extract] = OrderedDict()
+        self._generations: dict = {}  # (ledger, month) / ledger / None -> int
+        self._lock = threading.Lock()  # commits (and so invalidations) also happen on worker threads
+        self.hits = self.misses = 0
+
+    def generation(self, ledger_id: str, month: str) -> tuple:
+        g = self._generations
+        return g.get(None, 0), g.get(ledger_id, 0), g.get((ledger_id, month), 0)
+
+    def get(self, ledger_id: str, month: str) -> Extract | None:
+        with self._lock:
+            extract = self._entries.get((ledger_id, month))
+            if extract is not None:
+                self._entries.move_to_end((ledger_id, month))
+                self.hits += 1
+            else:
+                self.misses += 1
+            return extract
+
+    def put(self, ledger_id: str, month: str, extract: Extract, generation: tuple):
+        with self._lock:
+            if self.generation(ledger_id, month) != generation:
+                return  # written to while we were reading
+            self._entries[(ledger_id, month)] = extract
+            self._entries.move_to_end((ledger_id, month))
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, ledger_id: str | None = None, month: str | None = None):
+        with self._lock:
+            key = (ledger_id, month) if month is not None else ledger_id
+            self._generations[key] = self._generations.get(key, 0) + 1
+            for cached in list(self._entries):
+                if (ledger_id is None or cached[0] == ledger_id) and (month is None or cached[1] == month):
+                    del self._entries[cached]
+
+    def stats(self) -> dict:
+        return {"entries": len(self._entries), "hits": self.hits, "misses": self.misses}
+
+period_cache = PeriodCache()
+
+@event.listens_for(Session, "after_commit")
+def _invalidate_touched(session):
+    for ledger_id, month in session.info.pop("touched_periods", ()):
+        period_cache.invalidate(ledger_id, month)
+
+@event.listens_for(Session, "after_rollback")
+def _forget_touched(session):
+    session.info.pop("touched_periods", None)
+
+def month_start(day: date) -> date:
+    return day.replace(day=1)
+
+def next_month(day: date) -> date:
+    return day.replace(year=day.year + 1, month=1, day=1) if day.month == 12 else day.replace(month=day.month + 1, day=1)
+
+def months_between(start: date, end: date) -> list:
+    """'YYYY-MM' of every month overlapping [start, end]."""
+    months, current = [], month_start(start)
+    while current <= end:
+        months.append(current.strftime("%Y-%m"))
+        current = next_month(current)
+    return months
+
+def bucket_labels(granularity: str, start: date, end: date) -> tuple:
+    """(labels, first bucket's start) for the buckets covering [start, end]."""
+    if granularity == "day":
+        first = start
+        labels = [(first + timedelta(days=i)).isoformat() for i in range((end - first).days + 1)]
+    elif granularity == "week":
+        first = start - timedelta(days=start.weekday())  # ISO weeks, labelled by their Monday
+        labels = [(first + timedelta(weeks=i)).isoformat() for i in range((end - first).days // 7 + 1)]
+    else:
+        first = month_start(start)
+        labels = months_between(start, end)
+    return labels, first
+
+def _bucket_of(granularity: str, first: date, day_ordinal: int) -> int:
+    if granularity == "day":
+        return day_ordinal - first.toordinal()
+    if granularity == "week":
+        return (day_ordinal - first.toordinal()) // 7
+    day = date.fromordinal(day_ordinal)
+    return (day.year - first.year) * 12 + day.month - first.month
+
+def _series_keys(extract: Extract, group_by: str) -> list:
+    if group_by == "category":
+        return list(zip(extract.currencies, extract.categories))
+    if group_by == "member":
+        return list(zip(extract.currencies, extract.user_ids))
+    return [(currency, "") for currency in extract.currencies]
+
+def _rolling(values: list, window: int) -> list:
+    out, total = [], 0.0
+    for i, value in enumerate(values):
+        total += value
+        if i >= window:
+            total -= values[i - window]
+        out.append(total / min(i + 1, window))
+    return out
+
+def _change(values: list) -> list:
+    return [None] + [(cur - prev) / prev if prev else None for prev, cur in zip(values, values[1:])]
+
+def build(extracts: list, granularity: str, start: date, end: date, group_by: str, window: int) -> dict:
+    """Bucket the extracts' rows inside [start, end] into one series per (currency, group)."""
+    labels, first = bucket_labels(granularity, start, end)
+    start_ord, end_ord = start.toordinal(), end.toordinal()
+
+    keys, names = {}, {}
+    key_index, buckets, amounts, counts = [], [], [], []
+    for extract in extracts:
+        row_keys = _series_keys(extract, group_by)
+        for i, key in enumerate(row_keys):
+            index = keys.setdefault(key, len(keys))
+            key_index.append(index)
+            if group_by == "member":
+                names[key] = extract.user_names[i] or names.get(key)
+        if np is not None:
+            days = extract.days
+            if granularity == "month":
+                # An extract is a single month, so all of its rows share the bucket
+                bucket = _bucket_of("month", first, int(days[0])) if len(days) else 0
+                buckets.append(np.full(len(days), bucket, dtype=np.int64))
+            else:
+                buckets.append((days - first.toordinal()) // (7 if granularity == "week" else 1))
+            amounts.append(extract.amounts)
+            counts.append(extract.counts)
+        else:
+            buckets.extend(_bucket_of(granularity, first, d) for d in extract.days)
+            amounts.extend(extract.amounts)
+            counts.extend(extract.counts)
+
+    n_series, n_buckets = len(keys), len(labels)
+    if np is not None and key_index:
+        all_days = np.concatenate([e.days for e in extracts])
+        key_arr = np.array(key_index, dtype=np.int64)
+        bucket_arr = np.concatenate(buckets)
+        mask = (all_days >= start_ord) & (all_days <= end_ord)
+        amount_grid = np.zeros((n_series, n_buckets))
+        count_grid = np.zeros((n_series, n_buckets), dtype=np.int64)
+        np.add.at(amount_grid, (key_arr[mask], bucket_arr[mask]), np.concatenate(amounts)[mask])
+        np.add.at(count_grid, (key_arr[mask], bucket_arr[mask]), np.concatenate(counts)[mask])
+        # Trailing mean over the last `window` buckets (fewer at the start)
+        cumulative = np.cumsum(amount_grid, axis=1)
+        shifted = np.zeros_like(cumulative)
+        if window < n_buckets:
+            shifted[:, window:] = cumulative[:, :-window]
+        divisor = np.minimum(np.arange(1, n_buckets + 1), window)
+        rolling_grid = (cumulative - shifted) / divisor
+        amount_rows, count_rows, rolling_rows = amount_grid.tolist(), count_grid.tolist(), rolling_grid.tolist()
+    else:
+        amount_rows = [[0.0] * n_buckets for _ in range(n_series)]
+        count_rows = [[0] * n_buckets for _ in range(n_series)]
+        all_days = [d for e in extracts for d in e.days]
+        for key, bucket, day, amount, count in zip(key_index, buckets, all_days, amounts, counts):
+            if start_ord <= day <= end_ord:
+                amount_rows[key][bucket] += amount
+                count_rows[key][bucket] += count
+        rolling_rows = [_rolling(row, window) for row in amount_rows]
+
+    series = []
+    for (currency, group), index in keys.items():
+        if not count_rows[index] or not any(count_rows[index]):
+            continue  # only had rows outside the requested days
+        values = amount_rows[index]
+        series.append({
+            "currency": currency,
+            "key": group,
+            "name": names.get((currency, group)) or group or currency,
+            "amounts": [round(v, 2) for v in values],
+            "counts": count_rows[index],
+            "rolling": [round(v, 2) for v in rolling_rows[index]],
+            "change": [round(v, 4) if v is not None else None for v in _change(values)],
+        })
+    series.sort(key=lambda s: (s["currency"], -sum(s["amounts"])))
+    return {"buckets": labels, "series": series}
+
+def resolve_range(granularity: str, start: str | None, end: str | None) -> tuple:
+    """Parse and bound the requested [start, end] days; ValueError on bad input."""
+    if granularity not in GRANULARITIES:
+        raise ValueError(f"granularity must be one of {', '.join(GRANULARITIES)}")
+    end_day = date.fromisoformat(end) if end else datetime.now().date()
+    start_day = date.fromisoformat(start) if start else end_day - timedelta(days=DEFAULT_SPAN[granularity])
+    if start_day > end_day:
+        raise ValueError("start must not be after end")
+    if len(bucket_labels(granularity, start_day, end_day)[0]) > REPORT_MAX_BUCKETS:
+        raise ValueError(f"at most {REPORT_MAX_BUCKETS} buckets per report")
+    return start_day, end_day
+
+def _runs(months: list) -> list:
+    """Split sorted 'YYYY-MM' months into runs of consecutive months."""
+    runs = []
+    for month in months:
+        day = datetime.strptime(month, "%Y-%m").date()
+        if runs and next_month(runs[-1][-1]) == day:
+            runs[-1].append(day)
+        else:
+            runs.append([day])
+    return runs
+
+async def load_extracts(ledger_id: str, months: list) -> list:
+    """Extracts for the months (sorted 'YYYY-MM'): closed months from the cache, the rest read in one query per run."""
+    current = datetime.now().strftime("%Y-%m")
+    extracts, missing, generations = {}, [], {}
+    for month in months:
+        cached = period_cache.get(ledger_id, month) if month < current else None
+        if cached is not None:
+            extracts[month] = cached
+        else:
+            missing.append(month)
+            generations[month] = period_cache.generation(ledger_id, month)
+    for run in _runs(missing):
+        start = datetime.combine(run[0], datetime.min.time())
+        end = datetime.combine(next_month(run[-1]), datetime.min.time())
+        by_month = defaultdict(list)
+        for row in await run_db(crud.daily_totals, ledger_id, start, end):
+            by_month[str(row[0])[:7]].append(row)
+        for day in run:
+            month = day.strftime("%Y-%m")
+            extracts[month] = Extract(by_month.get(month, []))
+            if month < current:
+                period_cache.put(ledger_id, month, extracts[month], generations[month])
+    return [extracts[month] for month in months]
+
+async def timeseries(ledger_id: str, granularity: str, start: date, end: date, group_by: str, window: int,
+                     currency: str | None = None) -> dict:
+    extracts = await load_extracts(ledger_id, months_between(start, end))
+    report = build(extracts, granularity, start, end, group_by, window)
+    if currency:
+        report["series"] = [s for s in report["series"] if s["currency"] == currency]
+    return report
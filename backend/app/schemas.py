@@ -1,6 +1,6 @@
 from pydantic import BaseModel
-from datetime import datetime
-from typing import Optional
+from datetime import datetime, date
+from typing import Optional, List
 
 class TransactionBase(BaseModel):
     amount: float
@@ -16,7 +16,77 @@ class TransactionCreate(TransactionBase):
 
 class Transaction(TransactionBase):
     id: int
+    ledger_id: str
     created_at: datetime
 
     class Config:
         from_attributes = True
+
+class Ledger(BaseModel):
+    id: str
+    name: Optional[str] = None
+
+    class Config:
+        from_attributes = True
+
+class TransactionPage(BaseModel):
+    items: List[Transaction]
+    next_cursor: Optional[str] = None  # opaque; absent on the last page
+
+class TransactionSearchPage(BaseModel):
+    items: List[Transaction]
+    next_offset: Optional[int] = None  # absent on the last page
+
+class StatBucket(BaseModel):
+    name: str
+    amount: float
+    count: int
+
+class Stats(BaseModel):
+    currency: str
+    month: str
+    total: float
+    count: int
+    categories: List[StatBucket]
+    members: List[StatBucket]
+
+class CurrencyBucket(BaseModel):
+    name: str
+    amount: float     # in the currency itself
+    converted: float  # in the report's target currency
+    count: int
+
+class ConsolidatedStats(BaseModel):
+    target: str
+    month: str
+    total: float
+    count: int
+    currencies: List[CurrencyBucket]
+    categories: List[StatBucket]
+    members: List[StatBucket]
+    estimated: int    # rows converted with a fallback rate (no rate stored for their day)
+    unconverted: int  # rows with no rate at all, left out of the totals
+
+class TimeSeries(BaseModel):
+    currency: str
+    key: str   # category name, member id, or "" for the currency total
+    name: str
+    amounts: List[float]
+    counts: List[int]
+    rolling: List[float]  # trailing average over `window` buckets
+    change: List[Optional[float]]  # vs the previous bucket (None when it was 0)
+
+class TimeSeriesReport(BaseModel):
+    granularity: str
+    start: date
+    end: date
+    group_by: str
+    window: int
+    buckets: List[str]  # day, Monday of the week, or YYYY-MM
+    series: List[TimeSeries]
+
+class TransactionChanges(BaseModel):
+    cursor: int
+    reset: bool  # True: the change log can't be replayed from `since`, reload the view
+    upserts: List[Transaction]
+    deletes: List[int]
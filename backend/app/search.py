@@ -0,0 +1,111 @@
+"""
+Full-text search over item and raw_text (GET /transactions/search).
+
+- SQLite: an FTS5 table with the trigram tokenizer (substring matches, so mixed Chinese/English
+  like "星巴克" or "mtr" work without word segmentation), kept in sync with transactions by
+  triggers on insert, update of item/raw_text and delete (reset deletes rows, so it is covered).
+  Ranked by bm25.
+- Postgres: a pg_trgm GIN index on item || raw_text, which ILIKE uses; ranked by word_similarity.
+- Anything else, or when the index can't be created: plain LIKE within the ledger.
+
+Trigram indexes need terms of at least three characters; shorter terms (e.g. "咖啡") are matched
+with LIKE against the rows the longer terms selected, or the ledger's rows if there are none.
+"""
+from sqlalchemy import text, func, or_, and_, literal_column, table, column
+from sqlalchemy.orm import Session
+
+from . import models
+
+# "fts5", "trgm" or "like"; set by install() during init_db
+backend = "like"
+
+FTS_TABLE = "transactions_fts"
+
+_SQLITE_DDL = [
+    f"""CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5(
+        item, raw_text, content='transactions', content_rowid='id', tokenize='trigram case_sensitive 0')""",
+    f"""CREATE TRIGGER IF NOT EXISTS transactions_fts_insert AFTER INSERT ON transactions BEGIN
+        INSERT INTO {FTS_TABLE}(rowid, item, raw_text) VALUES (new.id, new.item, new.raw_text);
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS transactions_fts_delete AFTER DELETE ON transactions BEGIN
+        INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, item, raw_text) VALUES ('delete', old.id, old.item, old.raw_text);
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS transactions_fts_update AFTER UPDATE OF item, raw_text ON transactions BEGIN
+        INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, item, raw_text) VALUES ('delete', old.id, old.item, old.raw_text);
+        INSERT INTO {FTS_TABLE}(rowid, item, raw_text) VALUES (new.id, new.item, new.raw_text);
+    END""",
+]
+
+_POSTGRES_DDL = [
+    "CREATE EXTENSION IF NOT EXISTS pg_trgm",
+    "CREATE INDEX IF NOT EXISTS ix_transactions_search_trgm ON transactions "
+    "USING gin ((coalesce(item, '') || ' ' || coalesce(raw_text, '')) gin_trgm_ops)",
+]
+
+def install(engine):
+    """Create the search index for the engine's dialect (idempotent) and pick the query backend."""
+    global backend
+    dialect = engine.dialect.name
+    try:
+        with engine.begin() as conn:
+            if dialect == "sqlite":
+                existed = conn.execute(text("SELECT 1 FROM sqlite_master WHERE name = :name"), {"name": FTS_TABLE}).first()
+                for ddl in _SQLITE_DDL:
+                    conn.execute(text(ddl))
+                if not existed:
+                    # Index the rows written before the table existed
+                    conn.execute(text(f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('rebuild')"))
+                    print("Built the full-text search index")
+                backend = "fts5"
+            elif dialect == "postgresql":
+                for ddl in _POSTGRES_DDL:
+                    conn.execute(text(ddl))
+                backend = "trgm"
+    except Exception as e:
+        # e.g. SQLite without FTS5, or no permission to create the pg_trgm extension
+        print(f"Search index unavailable, using LIKE: {e}")
+        backend = "like"
+
+def _terms(q: str) -> list:
+    return [term for term in q.split() if term][:8]
+
+def _like(value: str) -> str:
+    return "%" + value.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%"
+
+def _document():
+    """
+    The exact expression of ix_transactions_search_trgm. Literal constants, not bind parameters:
+    a parameter (or its ::VARCHAR cast) makes a different expression and the index isn't used.
+    """
+    tx = models.Transaction
+    empty, space = literal_column("''"), literal_column("' '")
+    return func.coalesce(tx.item, empty).op("||")(space).op("||")(func.coalesce(tx.raw_text, empty))
+
+def search_transactions(db: Session, ledger_id: str, q: str, skip: int, limit: int, currency: str | None = None) -> list:
+    """Best matches first (then newest); every term must match item or raw_text."""
+    tx = models.Transaction
+    terms = _terms(q)
+    if not terms:
+        return []
+    query = db.query(tx).filter(tx.ledger_id == ledger_id)
+    if currency:
+        query = query.filter(tx.currency == currency)
+
+    long_terms = [term for term in terms if len(term) >= 3]
+    short_terms = terms if backend == "like" else [term for term in terms if len(term) < 3]
+    order = []
+    if backend == "fts5" and long_terms:
+        fts = table(FTS_TABLE, column("rowid"))
+        # Each term quoted as a phrase, so user input can't inject FTS5 query syntax
+        match = " AND ".join('"' + term.replace('"', '""') + '"' for term in long_terms)
+        query = query.join(fts, fts.c.rowid == tx.id).filter(literal_column(FTS_TABLE).op("MATCH")(match))
+        order.append(func.bm25(literal_column(FTS_TABLE)))
+    elif backend == "trgm" and long_terms:
+        document = _document()
+        query = query.filter(and_(*(document.ilike(_like(term), escape="\\") for term in long_terms)))
+        # Ranked on the terms the index matched; short terms would only skew the similarity
+        order.append(func.word_similarity(" ".join(long_terms), document).desc())
+    for term in short_terms:
+        pattern = _like(term)
+        query = query.filter(or_(tx.item.ilike(pattern, escape="\\"), tx.raw_text.ilike(pattern, escape="\\")))
+    return query.order_by(*order, tx.created_at.desc(), tx.id.desc()).offset(skip).limit(limit).all()
@@ -0,0 +1,51 @@
+"""
+Aho-Corasick multi-pattern matcher: all keywords compiled into one automaton, so a text is
+scanned once however many keywords there are (services/rules.py uses it for categories).
+"""
+from collections import deque
+
+class Automaton:
+    def __init__(self, patterns: dict):
+        """patterns: keyword -> value returned with each match."""
+        self._goto: list[dict] = [{}]
+        self._fail: list[int] = [0]
+        self._out: list[list] = [[]]  # node -> [(keyword, value)] ending here, fail chain included
+        for keyword, value in patterns.items():
+            self._add(keyword, value)
+        self._link()
+
+    def _add(self, keyword: str, value):
+        node = 0
+        for ch in keyword:
+            nxt = self._goto[node].get(ch)
+            if nxt is None:
+                nxt = len(self._goto)
+                self._goto[node][ch] = nxt
+                self._goto.append({})
+                self._fail.append(0)
+                self._out.append([])
+            node = nxt
+        self._out[node].append((keyword, value))
+
+    def _link(self):
+        queue = deque(self._goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for ch, child in self._goto[node].items():
+                queue.append(child)
+                fail = self._fail[node]
+                while fail and ch not in self._goto[fail]:
+                    fail = self._fail[fail]
+                self._fail[child] = self._goto[fail].get(ch, 0)
+                self._out[child] = self._out[child] + self._out[self._fail[child]]
+
+    def iter(self, text: str):
+        """Yields (start, end, keyword, value) for every occurrence, overlapping ones included."""
+        goto, fail, out = self._goto, self._fail, self._out
+        node = 0
+        for i, ch in enumerate(text):
+            while node and ch not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(ch, 0)
+            for keyword, value in out[node]:
+                yield i + 1 - len(keyword), i + 1, keyword, value
@@ -1,112 +1,207 @@
 import os
-import asyncio
 from telegram import Update, ForceReply
 from telegram.ext import ApplicationBuilder, ContextTypes, CommandHandler, MessageHandler, filters
-from sqlalchemy.orm import Session
-from ..database import SessionLocal
-from .. import models
-from .llm import parse_expense_text, parse_expense_image
+from ..database import run_db
+from .. import crud
+from ..metrics import timed_handler
+from .llm import parse_expenses_text_async
+from .imaging import pick_photo_size, parse_receipt
+from .state import pending_states
+from .scheduler import scheduler, JobCancelled
+from .events import broker
 
 # 获取 Token
 TELEGRAM_BOT_TOKEN = os.getenv("TELEGRAM_BOT_TOKEN")
+# Updates handled at once; per-user order and LLM/vision limits come from services/scheduler.py
+BOT_CONCURRENT_UPDATES = int(os.getenv("BOT_CONCURRENT_UPDATES", "64"))
 
-def set_state(user_id: str, data: dict):
-    db: Session = SessionLocal()
-    try:
-        state = db.query(models.BotState).filter(models.BotState.user_id == user_id).first()
-        if not state:
-            state = models.BotState(user_id=user_id, data=data)
-            db.add(state)
-        else:
-            state.data = data
-        db.commit()
-    except Exception as e:
-        print(f"Error setting state: {e}")
-        db.rollback()
-    finally:
-        db.close()
+def ledger_id(update: Update) -> str:
+    """Each chat keeps its own ledger: a family group, or one member's private chat."""
+    return str(update.effective_chat.id)
+
+def ledger_name(update: Update) -> str | None:
+    chat = update.effective_chat
+    return chat.title or chat.full_name
+
+def state_key(update: Update) -> str:
+    # Private chats keep the plain user id (chat id == user id), so earlier entries still match
+    user_id, chat_id = str(update.effective_user.id), ledger_id(update)
+    return user_id if chat_id == user_id else f"{chat_id}:{user_id}"
+
+def set_state(key: str, data: dict):
+    pending_states.set(key, data)
 
-def get_state(user_id: str) -> dict | None:
-    db: Session = SessionLocal()
+def get_state(key: str) -> dict | None:
+    # Here we follow PENDING.pop() pattern: read and clear
+    return pending_states.pop(key)
+
+def _close_on_cancel(update: Update, context: ContextTypes.DEFAULT_TYPE, status_msg):
+    """
+    If /undo cancels this job, mark its status message and drop the pending entry it saved, if
+    any. Returns the setter the handler saves its pending entry with.
+    """
+    key = state_key(update)
+    saved = []
+
+    def set_pending(data: dict):
+        set_state(key, data)
+        saved.append(data)
+
+    async def close():
+        if saved:
+            pending_states.pop(key)
+        await context.bot.edit_message_text(
+            chat_id=update.effective_chat.id,
+            message_id=status_msg.message_id,
+            text="🚫 已取消识别"
+        )
+    scheduler.on_cancel(close)
+    return set_pending
+
+def _pending_state(user_id: str, user_name: str, results: list, raw_text: str, created_at=None) -> dict:
+    """Pending entry for one parsed expense, or for several under "expenses"."""
+    expenses = [{
+        "amount": r["amount"],
+        "currency": r["currency"],
+        "category": r["category"],
+        "item": r.get("item") or "消费",
+    } for r in results]
+    data = {"user_id": user_id, "user_name": user_name, "raw_text": raw_text, "created_at": created_at}
+    if len(expenses) == 1:
+        data.update(expenses[0])
+    else:
+        data["expenses"] = expenses
+    return data
+
+# Reply that keeps the recognised item name(s) as they are
+CONFIRM_REPLIES = ("确认", "確認")
+
+def _preview_prompt(data: dict) -> str:
+    expenses = data.get("expenses")
+    if not expenses:
+        return (
+            f"预览：{data['amount']} {data['currency']}，{data['category']} - {data['item']}\n"
+            f"请回复本次消费的项目（例如：转账给XX、在XX购物），或回复“确认”使用识别的项目名"
+        )
+    lines = [f"{i}. {e['amount']} {e['currency']}，{e['category']} - {e['item']}" for i, e in enumerate(expenses, 1)]
+    return (
+        f"预览（共 {len(expenses)} 笔）：\n" + "\n".join(lines) + "\n"
+        f"回复“确认”全部保存；或逐行回复每笔的项目名（共 {len(expenses)} 行）"
+    )
+
+def _reply_items(data: dict, item_text: str) -> list | None:
+    """
+    Item names for the pending expense(s) from the user's reply: the recognised ones for
+    "确认", else one per line. None when the number of lines doesn't match the expenses.
+    """
+    expenses = data.get("expenses") or [data]
+    item_text = item_text.strip()
+    if not item_text or item_text in CONFIRM_REPLIES:
+        return [e.get("item") or "消费" for e in expenses]
+    if len(expenses) == 1:
+        return [item_text]
+    lines = [line.strip() for line in item_text.splitlines() if line.strip()]
+    return lines if len(lines) == len(expenses) else None
+
+async def _save_pending(update: Update, context: ContextTypes.DEFAULT_TYPE, data: dict, item_text: str):
+    """Save the pending expense(s) with the user's item reply: one bulk INSERT, one commit."""
+    expenses = data.get("expenses") or [data]
+    items = _reply_items(data, item_text)
+    if items is None:
+        # Keep waiting rather than save names the user didn't confirm
+        set_state(state_key(update), data)
+        await context.bot.send_message(
+            chat_id=update.effective_chat.id,
+            text=f"共 {len(expenses)} 笔，请逐行回复 {len(expenses)} 行项目名，或回复“确认”全部保存",
+            reply_markup=ForceReply(selective=True)
+        )
+        return
+    rows = [dict(
+        ledger_id=ledger_id(update),
+        user_id=data["user_id"],
+        user_name=data["user_name"],
+        amount=e["amount"],
+        currency=e["currency"],
+        category=e["category"],
+        item=item,
+        raw_text=data["raw_text"],
+        created_at=data.get("created_at")
+    ) for e, item in zip(expenses, items)]
     try:
-        state = db.query(models.BotState).filter(models.BotState.user_id == user_id).first()
-        if state:
-            data = state.data
-            # Optional: auto-clear state after read, or keep it until explicitly cleared
-            # Here we follow PENDING.pop() pattern: read and clear
-            db.delete(state)
-            db.commit()
-            return data
-        return None
+        txs = await run_db(crud.create_transactions, rows, ledger_name(update))
+        broker.publish(ledger_id(update))
+        if len(txs) == 1:
+            tx = txs[0]
+            text = (f"✅ 已记录 #{tx.id}\n"
+                    f"💰 {tx.amount} {tx.currency}\n"
+                    f"📂 {tx.category} - {tx.item}\n\n"
+                    f"操作：/undo 撤回最近一条；/delete {tx.id} 删除；/edit {tx.id} 新项目名")
+        else:
+            lines = [f"#{tx.id} 💰 {tx.amount} {tx.currency} 📂 {tx.category} - {tx.item}" for tx in txs]
+            text = (f"✅ 已记录 {len(txs)} 笔\n" + "\n".join(lines) + "\n\n"
+                    "操作：/undo 撤回最近一条；/delete 记录ID 删除；/edit 记录ID 新项目名")
+        await context.bot.send_message(
+            chat_id=update.effective_chat.id,
+            text=text,
+            parse_mode='Markdown'
+        )
     except Exception as e:
-        print(f"Error getting state: {e}")
-        db.rollback()
-        return None
-    finally:
-        db.close()
+        await context.bot.send_message(
+            chat_id=update.effective_chat.id,
+            text=f"❌ 保存失败: {str(e)}"
+        )
 
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await context.bot.send_message(
         chat_id=update.effective_chat.id,
-        text="👋 嗨！我是你的家庭记账助手。\n请直接发送消费内容，例如：\n'买菜 200 HKD' 或 '打车 50' (默认 CNY)\n也可以直接发送小票图片！"
+        text="👋 嗨！我是你的家庭记账助手。\n请直接发送消费内容，例如：\n'买菜 200 HKD' 或 '打车 50' (默认 CNY)\n也可以直接发送小票图片！\n"
+             f"本聊天的账本 ID：{ledger_id(update)}（看板地址加上 ?ledger=账本ID 查看）"
     )
 
 async def handle_photo(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = str(update.effective_user.id)
     user_name = update.effective_user.first_name
     
-    # Get the largest photo
-    photo = update.message.photo[-1]
+    # Smallest size the vision model can still read, not the largest
+    photo = pick_photo_size(update.message.photo)
     
     status_msg = await context.bot.send_message(chat_id=update.effective_chat.id, text="📸 正在识别图片...")
+    set_pending = _close_on_cancel(update, context, status_msg)
     
-    try:
-        # Download photo
+    async def download():
         file = await context.bot.get_file(photo.file_id)
-        file_path = f"temp_{photo.file_id}.jpg"
-        await file.download_to_drive(file_path)
-        
-        try:
-            # Parse image (OCR + LLM)
-            result = await asyncio.to_thread(parse_expense_image, os.path.abspath(file_path))
-            
-            if not result.get("is_expense"):
-                await context.bot.edit_message_text(
-                    chat_id=update.effective_chat.id,
-                    message_id=status_msg.message_id,
-                    text=f"🤔 无法识别账单信息。\n错误: {result.get('error', '未知原因')}"
-                )
-                return
+        return await file.download_as_bytearray()
 
-            set_state(user_id, {
-                "user_id": user_id,
-                "user_name": user_name,
-                "amount": result["amount"],
-                "currency": result["currency"],
-                "category": result["category"],
-                "item": result.get("item") or "消费",
-                "raw_text": "[Image Receipt]",
-                "created_at": result.get("created_at")
-            })
-            prompt = (
-                f"预览：{result['amount']} {result['currency']}，{result['category']}\n"
-                f"请回复本次消费的项目（例如：转账给XX、在XX购物）"
-            )
+    try:
+        # Parse image in memory (downscale + vision LLM); re-sent receipts reuse the earlier result
+        result, seen = await parse_receipt(download, ledger_id(update), photo.file_unique_id)
+        
+        if not result.get("is_expense"):
             await context.bot.edit_message_text(
                 chat_id=update.effective_chat.id,
                 message_id=status_msg.message_id,
-                text="图片识别完成，等待填写项目..."
+                text=f"🤔 无法识别账单信息。\n错误: {result.get('error', '未知原因')}"
             )
-            await context.bot.send_message(
-                chat_id=update.effective_chat.id,
-                text=prompt,
-                reply_markup=ForceReply(selective=True)
-            )
-                
-        finally:
-            # Clean up temp file
-            if os.path.exists(file_path):
-                os.remove(file_path)
+            return
+
+        data = _pending_state(user_id, user_name, result.get("expenses") or [result],
+                              "[Image Receipt]", result.get("created_at"))
+        set_pending(data)
+        prompt = _preview_prompt(data)
+        if seen == "same":
+            prompt = "⚠️ 这张小票之前识别过，如已记账请勿重复回复\n" + prompt
+        elif seen == "similar":
+            prompt = "⚠️ 这张小票和之前识别的一张很像，请核对金额，如已记账请勿重复回复\n" + prompt
+        await context.bot.edit_message_text(
+            chat_id=update.effective_chat.id,
+            message_id=status_msg.message_id,
+            text="图片识别完成，等待填写项目..."
+        )
+        await context.bot.send_message(
+            chat_id=update.effective_chat.id,
+            text=prompt,
+            reply_markup=ForceReply(selective=True)
+        )
                 
     except Exception as e:
         await context.bot.edit_message_text(
@@ -121,68 +216,25 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_name = update.effective_user.first_name
     
     # If waiting for this user's item input, take this message as item and save
-    pending_data = get_state(user_id)
+    pending_data = get_state(state_key(update))
     if pending_data:
-        data = pending_data
-        item_text = user_text.strip()
-        db: Session = SessionLocal()
-        try:
-            new_tx = models.Transaction(
-                user_id=data["user_id"],
-                user_name=data["user_name"],
-                amount=data["amount"],
-                currency=data["currency"],
-                category=data["category"],
-                item=item_text or data.get("item") or "消费",
-                raw_text=data["raw_text"],
-                created_at=data.get("created_at")
-            )
-            db.add(new_tx)
-            db.commit()
-            db.refresh(new_tx)
-            await context.bot.send_message(
-                chat_id=update.effective_chat.id,
-                text=(f"✅ 已记录 #{new_tx.id}\n"
-                      f"💰 {data['amount']} {data['currency']}\n"
-                      f"📂 {data['category']} - {item_text or '消费'}\n\n"
-                      f"操作：/undo 撤回最近一条；/delete {new_tx.id} 删除；/edit {new_tx.id} 新项目名"),
-                parse_mode='Markdown'
-            )
-            return
-        except Exception as e:
-            db.rollback()
-            await context.bot.send_message(
-                chat_id=update.effective_chat.id,
-                text=f"❌ 保存失败: {str(e)}"
-            )
-            return
-        finally:
-            db.close()
+        await _save_pending(update, context, pending_data, user_text.strip())
+        return
 
-    # 1. 调用 LLM 解析
+    # 1. 调用 LLM 解析 (a message may list several expenses: one call for all of them)
     status_msg = await context.bot.send_message(chat_id=update.effective_chat.id, text="⏳ 正在分析...")
+    set_pending = _close_on_cancel(update, context, status_msg)
     try:
-        result = await asyncio.to_thread(parse_expense_text, user_text)
-        if not result.get("is_expense"):
+        results = await parse_expenses_text_async(user_text)
+        if not results:
             await context.bot.edit_message_text(
                 chat_id=update.effective_chat.id,
                 message_id=status_msg.message_id,
                 text="🤔 这看起来不像是一笔账单。请再说具体点？"
             )
             return
-        set_state(user_id, {
-            "user_id": user_id,
-            "user_name": user_name,
-            "amount": result["amount"],
-            "currency": result["currency"],
-            "category": result["category"],
-            "item": result.get("item") or "消费",
-            "raw_text": user_text
-        })
-        prompt = (
-            f"预览：{result['amount']} {result['currency']}，{result['category']}\n"
-            f"请回复本次消费的项目（例如：转账给XX、在XX购物）"
-        )
+        data = _pending_state(user_id, user_name, results, user_text)
+        set_pending(data)
         await context.bot.edit_message_text(
             chat_id=update.effective_chat.id,
             message_id=status_msg.message_id,
@@ -190,7 +242,7 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
         )
         await context.bot.send_message(
             chat_id=update.effective_chat.id,
-            text=prompt,
+            text=_preview_prompt(data),
             reply_markup=ForceReply(selective=True)
         )
     except Exception as e:
@@ -202,20 +254,23 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 async def undo(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = str(update.effective_user.id)
-    db: Session = SessionLocal()
+    # A message still being recognised (in this chat) is the most recent thing to undo
+    cancelled = scheduler.cancel(state_key(update))
+    if cancelled:
+        await context.bot.send_message(
+            chat_id=update.effective_chat.id,
+            text=f"已取消 {cancelled} 条正在识别的消息；已保存的记录未撤回，如需撤回请再发送 /undo"
+        )
+        return
     try:
-        tx = db.query(models.Transaction).filter(models.Transaction.user_id == user_id).order_by(models.Transaction.created_at.desc()).first()
-        if not tx:
+        tx_id = await run_db(crud.undo_last_transaction, ledger_id(update), user_id)
+        if tx_id is None:
             await context.bot.send_message(chat_id=update.effective_chat.id, text="没有可撤回的记录")
             return
-        db.delete(tx)
-        db.commit()
-        await context.bot.send_message(chat_id=update.effective_chat.id, text=f"已撤回记录 #{tx.id}")
+        broker.publish(ledger_id(update))
+        await context.bot.send_message(chat_id=update.effective_chat.id, text=f"已撤回记录 #{tx_id}")
     except Exception as e:
-        db.rollback()
         await context.bot.send_message(chat_id=update.effective_chat.id, text=f"撤回失败: {str(e)}")
-    finally:
-        db.close()
 
 async def delete_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = str(update.effective_user.id)
@@ -228,20 +283,14 @@ async def delete_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
     except:
         await context.bot.send_message(chat_id=update.effective_chat.id, text="记录ID必须是数字")
         return
-    db: Session = SessionLocal()
     try:
-        tx = db.query(models.Transaction).filter(models.Transaction.id == tid, models.Transaction.user_id == user_id).first()
-        if not tx:
+        if not await run_db(crud.delete_user_transaction, ledger_id(update), tid, user_id):
             await context.bot.send_message(chat_id=update.effective_chat.id, text="未找到该记录或无权限删除")
             return
-        db.delete(tx)
-        db.commit()
+        broker.publish(ledger_id(update))
         await context.bot.send_message(chat_id=update.effective_chat.id, text=f"已删除记录 #{tid}")
     except Exception as e:
-        db.rollback()
         await context.bot.send_message(chat_id=update.effective_chat.id, text=f"删除失败: {str(e)}")
-    finally:
-        db.close()
 
 async def edit_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = str(update.effective_user.id)
@@ -258,76 +307,58 @@ async def edit_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if not new_item:
         await context.bot.send_message(chat_id=update.effective_chat.id, text="新项目名不能为空")
         return
-    db: Session = SessionLocal()
     try:
-        tx = db.query(models.Transaction).filter(models.Transaction.id == tid, models.Transaction.user_id == user_id).first()
-        if not tx:
+        if not await run_db(crud.update_user_transaction_item, ledger_id(update), tid, user_id, new_item):
             await context.bot.send_message(chat_id=update.effective_chat.id, text="未找到该记录或无权限修改")
             return
-        tx.item = new_item
-        db.commit()
+        broker.publish(ledger_id(update))
         await context.bot.send_message(chat_id=update.effective_chat.id, text=f"已更新记录 #{tid} 项目为：{new_item}")
     except Exception as e:
-        db.rollback()
         await context.bot.send_message(chat_id=update.effective_chat.id, text=f"修改失败: {str(e)}")
-    finally:
-        db.close()
 
 async def handle_item_reply(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    user_id = str(update.effective_user.id)
-    pending_data = get_state(user_id)
+    pending_data = get_state(state_key(update))
     if not pending_data:
         return
-    item_text = update.message.text.strip()
-    data = pending_data
-    db: Session = SessionLocal()
-    try:
-        new_tx = models.Transaction(
-            user_id=data["user_id"],
-            user_name=data["user_name"],
-            amount=data["amount"],
-            currency=data["currency"],
-            category=data["category"],
-            item=item_text,
-            raw_text=data["raw_text"],
-            created_at=data.get("created_at")
-        )
-        db.add(new_tx)
-        db.commit()
-        db.refresh(new_tx)
-        reply_text = (
-            f"✅ 已记录 #{new_tx.id}\n"
-            f"💰 {data['amount']} {data['currency']}\n"
-            f"📂 {data['category']} - {item_text}\n\n"
-            f"操作：/undo 撤回最近一条；/delete {new_tx.id} 删除；/edit {new_tx.id} 新项目名"
-        )
-        await context.bot.send_message(
-            chat_id=update.effective_chat.id,
-            text=reply_text,
-            parse_mode='Markdown'
-        )
-    except Exception as e:
-        db.rollback()
-        await context.bot.send_message(
-            chat_id=update.effective_chat.id,
-            text=f"❌ 保存失败: {str(e)}"
-        )
-    finally:
-        db.close()
+    await _save_pending(update, context, pending_data, update.message.text.strip())
+
+def _scheduled(kind: str, handler):
+    """Run the handler as a scheduler job: in order per user, within the kind's concurrency limit."""
+    async def run(update: Update, context: ContextTypes.DEFAULT_TYPE):
+        try:
+            await scheduler.run(state_key(update), kind, handler, update, context)
+        except JobCancelled:
+            pass
+    return run
+
+async def _post_init(application):
+    await pending_states.load()
+
+async def _post_shutdown(application):
+    await pending_states.flush()
+
 def create_bot_app():
     if not TELEGRAM_BOT_TOKEN:
         print("Telegram Token not set, bot will not run.")
         return None
     
-    application = ApplicationBuilder().token(TELEGRAM_BOT_TOKEN).build()
+    application = (
+        ApplicationBuilder()
+        .token(TELEGRAM_BOT_TOKEN)
+        .post_init(_post_init)
+        .post_shutdown(_post_shutdown)
+        .concurrent_updates(BOT_CONCURRENT_UPDATES)
+        .build()
+    )
     
-    start_handler = CommandHandler('start', start)
-    msg_handler = MessageHandler(filters.TEXT & (~filters.COMMAND) & (~filters.REPLY), handle_message)
-    photo_handler = MessageHandler(filters.PHOTO, handle_photo)
-    reply_handler = MessageHandler(filters.TEXT & filters.REPLY, handle_item_reply)
-    undo_handler = CommandHandler('undo', undo)
-    delete_handler = CommandHandler('delete', delete_cmd)
-    edit_handler = CommandHandler('edit', edit_cmd)
+    start_handler = CommandHandler('start', timed_handler("start", start))
+    msg_handler = MessageHandler(filters.TEXT & (~filters.COMMAND) & (~filters.REPLY),
+                                 _scheduled("text", timed_handler("message", handle_message)))
+    photo_handler = MessageHandler(filters.PHOTO, _scheduled("vision", timed_handler("photo", handle_photo)))
+    reply_handler = MessageHandler(filters.TEXT & filters.REPLY, _scheduled("text", timed_handler("item_reply", handle_item_reply)))
+    undo_handler = CommandHandler('undo', timed_handler("undo", undo))
+    delete_handler = CommandHandler('delete', timed_handler("delete", delete_cmd))
+    edit_handler = CommandHandler('edit', timed_handler("edit", edit_cmd))
     
     application.add_handler(start_handler)
     application.add_handler(photo_handler)
@@ -0,0 +1,65 @@
+"""
+In-process pub/sub for live dashboards (GET /transactions/stream, Server-Sent Events).
+
+Write paths (REST routes, bot handlers) call publish(ledger_id) after their commit; every stream
+subscribed to that ledger wakes up and sends the delta from /transactions/changes' logic. Idle
+streams only send a heartbeat comment, without touching the database.
+
+Process-local: with several workers, or for writes from `python -m app.manage`, dashboards see
+the change on their next reconnect (resume from Last-Event-ID) or reload.
+"""
+import asyncio
+import os
+
+SSE_HEARTBEAT = float(os.getenv("SSE_HEARTBEAT", "15"))  # below common proxy idle timeouts
+SSE_MAX_CLIENTS = int(os.getenv("SSE_MAX_CLIENTS", "200"))
+SSE_RETRY_MS = int(os.getenv("SSE_RETRY_MS", "3000"))  # EventSource reconnect delay
+
+class Broker:
+    def __init__(self):
+        self._subscribers: dict[str, set[asyncio.Event]] = {}
+        self.published = 0
+
+    def subscribe(self, ledger_id: str) -> asyncio.Event:
+        event = asyncio.Event()
+        self._subscribers.setdefault(ledger_id, set()).add(event)
+        return event
+
+    def unsubscribe(self, ledger_id: str, event: asyncio.Event):
+        subscribers = self._subscribers.get(ledger_id)
+        if subscribers is not None:
+            subscribers.discard(event)
+            if not subscribers:
+                del self._subscribers[ledger_id]
+
+    def publish(self, ledger_id: str):
+        """Wake the ledger's streams. Several writes before a stream runs collapse into one wake-up."""
+        self.published += 1
+        for event in self._subscribers.get(ledger_id, ()):
+            event.set()
+
+    def clients(self) -> int:
+        return sum(len(s) for s in self._subscribers.values())
+
+    def stats(self) -> dict:
+        return {"clients": self.clients(), "ledgers": len(self._subscribers), "published": self.published}
+
+broker = Broker()
+
+def format_event(data: str, event: str | None = None, event_id: int | None = None) -> str:
+    lines = []
+    if event_id is not None:
+        lines.append(f"id: {event_id}")
+    if event:
+        lines.append(f"event: {event}")
+    lines.extend(f"data: {line}" for line in data.splitlines() or [""])
+    return "\n".join(lines) + "\n\n"
+
+async def wait(event: asyncio.Event, timeout: float = SSE_HEARTBEAT) -> bool:
+    """True when woken by publish(), False on heartbeat timeout."""
+    try:
+        await asyncio.wait_for(event.wait(), timeout)
+    except asyncio.TimeoutError:
+        return False
+    event.clear()
+    return True
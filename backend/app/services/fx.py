@@ -0,0 +1,84 @@
+"""
+Exchange rates for consolidated (all-currency) reports.
+
+Daily rates live in the fx_rates table and are loaded from a CSV file, so reports work offline:
+
+    date,currency,rate
+    2026-01-02,HKD,0.9123
+    2026-01-02,USDT,7.1800
+
+`rate` is units of FX_BASE per one unit of the currency. Gaps between two loaded days (weekends,
+holidays) are filled with the earlier rate. Days after the last loaded one, or currencies with no
+rows at all, use the latest stored rate, then FX_DEFAULT_RATES; the latest rates are kept in a
+small in-process cache so reports don't look them up on every request.
+"""
+import csv
+import os
+import time
+from datetime import date, timedelta
+
+from ..database import run_db
+from .. import crud
+
+FX_BASE = os.getenv("FX_BASE", "CNY")
+# Rough rates used until real ones are loaded, "CUR=rate,..."
+FX_DEFAULT_RATES = os.getenv("FX_DEFAULT_RATES", "HKD=0.92,USDT=7.2")
+FX_RATES_FILE = os.getenv("FX_RATES_FILE")  # loaded (upserted) on every start when set
+FX_CACHE_TTL = int(os.getenv("FX_CACHE_TTL", "300"))
+
+def _parse_defaults(value: str) -> dict:
+    rates = {}
+    for part in value.split(","):
+        if "=" in part:
+            currency, rate = part.split("=", 1)
+            rates[currency.strip().upper()] = float(rate)
+    return rates
+
+DEFAULT_RATES = _parse_defaults(FX_DEFAULT_RATES)
+
+def read_rates_file(path: str) -> list:
+    """CSV rows -> [{currency, day, rate}], forward-filled over gaps between loaded days."""
+    by_currency: dict[str, dict[date, float]] = {}
+    with open(path, newline="", encoding="utf-8") as f:
+        for row in csv.DictReader(f):
+            currency = row["currency"].strip().upper()
+            if currency == FX_BASE:
+                continue
+            by_currency.setdefault(currency, {})[date.fromisoformat(row["date"].strip())] = float(row["rate"])
+    rows = []
+    for currency, days in by_currency.items():
+        ordered = sorted(days)
+        for day, next_day in zip(ordered, ordered[1:] + [None]):
+            current = day
+            while True:
+                rows.append({"currency": currency, "day": current, "rate": days[day]})
+                current += timedelta(days=1)
+                if next_day is None or current >= next_day:
+                    break
+    return rows
+
+class RateCache:
+    """Latest stored rate per currency, merged over DEFAULT_RATES; refreshed every FX_CACHE_TTL seconds."""
+
+    def __init__(self, ttl: int = FX_CACHE_TTL):
+        self.ttl = ttl
+        self._rates: dict | None = None
+        self._loaded_at = 0.0
+
+    async def get(self) -> dict:
+        if self._rates is None or time.monotonic() - self._loaded_at > self.ttl:
+            stored = await run_db(crud.latest_fx_rates)
+            self._rates = {**DEFAULT_RATES, **stored, FX_BASE: 1.0}
+            self._loaded_at = time.monotonic()
+        return self._rates
+
+    def invalidate(self):
+        self._rates = None
+
+rate_cache = RateCache()
+
+def load_rates_file(db, path: str) -> int:
+    rows = read_rates_file(path)
+    crud.save_fx_rates(db, rows)
+    rate_cache.invalidate()
+    return len(rows)
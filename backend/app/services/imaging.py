@@ -0,0 +1,168 @@
+"""
+Receipt photos for the vision parse: pick the smallest Telegram size the model can read, shrink and
+re-encode it in memory, and reuse the result for exact re-sends within a ledger (same
+file_unique_id or same bytes), so a receipt sent twice costs one vision call. Near-identical
+pictures (perceptual hash) are only flagged, since different receipts can share a hash.
+"""
+import io
+import os
+import hashlib
+import asyncio
+import threading
+from collections import OrderedDict
+
+from .llm import parse_expense_image_async
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:  # Pillow is optional: without it photos are sent as downloaded and only exact re-sends are deduplicated
+    Image = None
+
+# The vision models work on roughly a 768px short side (2048px long side cap) in "high" detail,
+# so anything bigger is bytes and upload time the provider throws away.
+RECEIPT_SHORT_SIDE = int(os.getenv("RECEIPT_SHORT_SIDE", "768"))
+RECEIPT_LONG_SIDE = int(os.getenv("RECEIPT_LONG_SIDE", "2048"))
+RECEIPT_JPEG_QUALITY = int(os.getenv("RECEIPT_JPEG_QUALITY", "82"))
+# Max differing bits (of 64) for a receipt to be flagged as a likely duplicate (it is still parsed)
+RECEIPT_HASH_DISTANCE = int(os.getenv("RECEIPT_HASH_DISTANCE", "6"))
+RECEIPT_CACHE_SIZE = int(os.getenv("RECEIPT_CACHE_SIZE", "256"))
+
+def pick_photo_size(photos):
+    """Smallest Telegram PhotoSize that still reaches the model's working resolution."""
+    ordered = sorted(photos, key=lambda p: p.width * p.height)
+    for photo in ordered:
+        if min(photo.width, photo.height) >= RECEIPT_SHORT_SIDE:
+            return photo
+    return ordered[-1]
+
+def dhash(image) -> int:
+    """64-bit difference hash: survives re-compression, resizing and small crops."""
+    small = image.convert("L").resize((9, 8), Image.LANCZOS)
+    pixels = small.tobytes()
+    bits = 0
+    for row in range(8):
+        for col in range(8):
+            left = pixels[row * 9 + col]
+            right = pixels[row * 9 + col + 1]
+            bits = (bits << 1) | (left > right)
+    return bits
+
+def prepare_image(data: bytes) -> tuple[bytes, int | None]:
+    """Downscale + re-encode as JPEG in memory; returns (jpeg bytes, perceptual hash)."""
+    if Image is None:
+        return data, None
+    image = ImageOps.exif_transpose(Image.open(io.BytesIO(data)))
+    image_hash = dhash(image)
+    scale = min(RECEIPT_SHORT_SIDE / min(image.size), RECEIPT_LONG_SIDE / max(image.size), 1.0)
+    if scale < 1.0:
+        image = image.resize((round(image.width * scale), round(image.height * scale)), Image.LANCZOS)
+    out = io.BytesIO()
+    image.convert("RGB").save(out, format="JPEG", quality=RECEIPT_JPEG_QUALITY, optimize=True)
+    # Keep the original if re-encoding didn't actually make it smaller
+    return (out.getvalue() if out.tell() < len(data) else data), image_hash
+
+class ReceiptCache:
+    """
+    Vision results per ledger, reused only for the same photo: its Telegram file_unique_id or a
+    digest of its bytes. The perceptual hash (a 9x8 thumbnail) can't tell two receipts from one
+    shop or template apart, so a hash within max_distance bits only flags a likely duplicate and
+    the photo is parsed afresh. Each receipt is one entry holding all its keys; the least recently
+    used receipts are dropped together with their keys.
+    """
+
+    def __init__(self, max_entries: int = RECEIPT_CACHE_SIZE, max_distance: int = RECEIPT_HASH_DISTANCE):
+        self.max_entries = max_entries
+        self.max_distance = max_distance
+        self._entries: OrderedDict[int, dict] = OrderedDict()  # receipt id -> {"result", "keys"}
+        self._keys: dict[tuple, int] = {}  # (scope, "file" | "digest" | "phash", value) -> receipt id
+        self._next_id = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.similar = 0
+
+    def _link(self, receipt_id: int, key: tuple):
+        self._keys[key] = receipt_id
+        self._entries[receipt_id]["keys"].append(key)
+
+    def get(self, scope: str, file_unique_id: str | None = None, digest: str | None = None,
+            count_miss: bool = True) -> dict | None:
+        """
+        A copy of the cached result for this photo in `scope` (the ledger), or None. A digest
+        match also learns the file id, so re-sends are recognised before downloading. Pass
+        count_miss=False for a lookup that another one follows, so each photo counts once.
+        """
+        with self._lock:
+            receipt_id = self._keys.get((scope, "file", file_unique_id)) if file_unique_id else None
+            if receipt_id is None and digest:
+                receipt_id = self._keys.get((scope, "digest", digest))
+                if receipt_id is not None and file_unique_id:
+                    self._link(receipt_id, (scope, "file", file_unique_id))
+            if receipt_id is None:
+                self.misses += count_miss
+                return None
+            self._entries.move_to_end(receipt_id)
+            self.hits += 1
+            return dict(self._entries[receipt_id]["result"])
+
+    def has_similar(self, scope: str, image_hash: int | None) -> bool:
+        """Whether a receipt within max_distance bits of this perceptual hash was parsed in `scope`."""
+        if image_hash is None:
+            return False
+        with self._lock:
+            # A few hundred 64-bit popcounts: cheaper than any index structure at this size
+            found = any(kind == "phash" and key_scope == scope and (value ^ image_hash).bit_count() <= self.max_distance
+                        for key_scope, kind, value in self._keys)
+            self.similar += found
+            return found
+
+    def put(self, scope: str, result: dict, file_unique_id: str | None = None, digest: str | None = None,
+            image_hash: int | None = None):
+        with self._lock:
+            receipt_id = self._next_id
+            self._next_id += 1
+            self._entries[receipt_id] = {"result": result, "keys": []}
+            for kind, value in (("file", file_unique_id), ("digest", digest), ("phash", image_hash)):
+                if value is not None:
+                    self._link(receipt_id, (scope, kind, value))
+            while len(self._entries) > self.max_entries:
+                old_id, old = self._entries.popitem(last=False)
+                for key in old["keys"]:
+                    if self._keys.get(key) == old_id:  # not re-pointed at a newer receipt since
+                        del self._keys[key]
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"entries": len(self._entries), "hits": self.hits, "misses": self.misses,
+                    "similar": self.similar}
+
+receipt_cache = ReceiptCache()
+
+async def parse_receipt(download, scope: str, file_unique_id: str | None = None) -> tuple[dict, str]:
+    """
+    Download the photo into memory (`download` is an async callable returning bytes), shrink it
+    and run the vision parse, reusing the result of the same photo sent earlier in `scope` (the
+    ledger). Exact re-sends are recognised before downloading. Returns (result, seen): seen is
+    "same" for a reused result, "similar" when a near-identical receipt was parsed before, else "".
+    """
+    cached = receipt_cache.get(scope, file_unique_id, count_miss=False)
+    if cached:
+        return cached, "same"
+
+    data = bytes(await download())
+    digest = hashlib.sha256(data).hexdigest()
+    cached = receipt_cache.get(scope, file_unique_id, digest)
+    if cached:
+        return cached, "same"
+
+    try:
+        image, image_hash = await asyncio.to_thread(prepare_image, data)
+    except Exception as e:
+        print(f"Image preprocessing failed, sending original: {e}")
+        image, image_hash = data, None
+    similar = receipt_cache.has_similar(scope, image_hash)
+
+    result = await parse_expense_image_async(image)
+    if result.get("is_expense"):
+        receipt_cache.put(scope, result, file_unique_id, digest, image_hash)
+    return result, "similar" if similar else ""
@@ -1,9 +1,15 @@
 import os
 import json
+import time
 import base64
-import re
-from openai import OpenAI
+import random
+import asyncio
+from collections import deque
+from functools import lru_cache
 from dotenv import load_dotenv
+from .parse_cache import ParseCache, cache_namespace
+from . import rules
+from .. import metrics, startup
 
 load_dotenv()
 
@@ -17,14 +23,47 @@ if os.getenv("DASHSCOPE_API_KEY"):
     BASE_URL = "https://dashscope.aliyuncs.com/compatible-mode/v1"
     VISION_MODEL = "qwen-vl-max" # 通义千问视觉增强版
     TEXT_MODEL = "qwen-plus"     # 通义千问增强版
+    FAST_VISION_MODEL = "qwen-vl-plus"
+    FAST_TEXT_MODEL = "qwen-turbo"
     print("Using DashScope (Aliyun) models...")
 else:
     # OpenAI 默认配置
     BASE_URL = os.getenv("OPENAI_BASE_URL") 
     VISION_MODEL = "gpt-4o" 
     TEXT_MODEL = "gpt-4o-mini"
+    FAST_VISION_MODEL = "gpt-4o-mini"
+    FAST_TEXT_MODEL = "gpt-4o-mini"  # already the cheapest; the compact prompt is the saving
 
-client = OpenAI(api_key=API_KEY, base_url=BASE_URL)
+FAST_TEXT_MODEL = os.getenv("LLM_FAST_TEXT_MODEL", FAST_TEXT_MODEL)
+FAST_VISION_MODEL = os.getenv("LLM_FAST_VISION_MODEL", FAST_VISION_MODEL)
+
+# The OpenAI SDK takes ~0.4s to import, so it is loaded on the first LLM call rather than at startup
+@lru_cache(maxsize=None)
+def _openai():
+    with startup.phase("llm_sdk_import"):
+        import openai
+    return openai
+
+def warm_up():
+    """Import the SDK ahead of the first call (main runs this in a thread once startup is done)."""
+    _openai()
+
+# Async client limits (see AsyncLLMClient)
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "4"))
+LLM_TEXT_TIMEOUT = float(os.getenv("LLM_TEXT_TIMEOUT", "20"))
+LLM_VISION_TIMEOUT = float(os.getenv("LLM_VISION_TIMEOUT", "45"))
+# Room for {"expenses": [...]} with a few dozen line items (~40 tokens each); a cut-off answer is unparseable
+LLM_VISION_MAX_TOKENS = int(os.getenv("LLM_VISION_MAX_TOKENS", "1500"))
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "2"))
+LLM_HEDGE_AFTER = float(os.getenv("LLM_HEDGE_AFTER", "0"))  # seconds before a duplicate request is sent; 0 = off
+LLM_BREAKER_FAILURES = int(os.getenv("LLM_BREAKER_FAILURES", "5"))
+LLM_BREAKER_RESET = float(os.getenv("LLM_BREAKER_RESET", "30"))
+
+# "tiered": COMPACT_PROMPT on the fast model first, SYSTEM_PROMPT on TEXT_MODEL / VISION_MODEL
+# only when that answer fails validation or is unsure; "single": always the latter
+LLM_ROUTING = os.getenv("LLM_ROUTING", "tiered")
+LLM_ESCALATE_BELOW = float(os.getenv("LLM_ESCALATE_BELOW", "0.7"))  # fast-tier self-reported confidence
+LLM_FAST_SHARE = 0.5  # of a call's timeout the fast tier may use, the rest is left for escalating
 
 SYSTEM_PROMPT = """
 You are a smart expense tracking assistant for a family living in both Mainland China and Hong Kong.
@@ -67,140 +106,599 @@ Rules:
 - ALWAYS return 'item' and 'category' in Simplified Chinese.
 """
 
+# Appended when a message lists several expenses; they all come back from one call
+MULTI_EXPENSE_PROMPT = SYSTEM_PROMPT + """
+### Multiple expenses:
+The input may list several separate expenses (one per line, or separated by "；", ";" or "，").
+Return {"expenses": [...]} with one object per expense, in the original order, each with amount, currency, category and item.
+"""
+
+# Fast-tier prompt: the same contract in a fraction of the tokens, plus a confidence the router
+# escalates on. Prompts are static and always the first message, and the multi-expense variants
+# extend them rather than wrap them, so providers' prefix caches can reuse the shared part;
+# everything per request (text, image) goes in the last message.
+COMPACT_PROMPT = """Extract the expense in the user's message or receipt as JSON:
+{"amount": number, "currency": "CNY"|"HKD"|"USDT", "category": "餐饮"|"交通"|"购物"|"居住"|"娱乐"|"医疗"|"转账"|"其他", "item": "short description in Simplified Chinese (translate)", "confidence": 0-1}
+Currency: 港币/港元/HKD/HK$/港纸, or Hong Kong context (MTR, 旺角, 茶餐厅, 八达通) -> HKD. USDT/U/Tether/泰达币, or crypto (gas fee, ETH, TRX, Binance, OKX) -> USDT. Otherwise CNY.
+confidence: how sure you are of amount and currency. Not an expense: {"is_expense": false}. JSON only.
+"""
+
+COMPACT_MULTI_PROMPT = COMPACT_PROMPT + """Several expenses (one per line, or separated by "；" ";" "，"): {"expenses": [...]}, one object each, in order.
+"""
+
+CURRENCIES = ("CNY", "HKD", "USDT")
+
+# Repeated phrases skip the LLM; keyed on the prompts + models so editing any of them invalidates it
+if LLM_ROUTING == "tiered":
+    parse_cache = ParseCache(cache_namespace(f"{FAST_TEXT_MODEL}>{TEXT_MODEL}", COMPACT_PROMPT + SYSTEM_PROMPT))
+else:
+    parse_cache = ParseCache(cache_namespace(TEXT_MODEL, SYSTEM_PROMPT))
+
 def _simple_parse(text: str):
-    """Fallback regex parser for simple text inputs"""
-    lower = text.lower()
-    currency = "CNY"
-    if any(tok in lower for tok in ["hkd", "港币", "港元", "港幣", "港紙", "蚊"]):
-        currency = "HKD"
-    if any(tok in lower for tok in ["usdt", "tether", "泰达币"]):
-        currency = "USDT"
-    if any(tok in lower for tok in ["cny", "人民币", "rmb"]):
-        currency = "CNY"
-    if ("块" in text) or ("元" in text):
-        currency = "CNY"
-    m = re.search(r"([0-9]+(?:\\.[0-9]+)?)", text)
-    if not m:
+    """Fallback rule-based parser for simple text inputs"""
+    result = rules.parse(text)
+    if not result:
         return None
-    amount = float(m.group(1))
-    category = "其他"
-    if any(kw in text for kw in ["充值", "会员", "充值值", "会员费"]):
-        category = "其他"
-    elif any(kw in text for kw in ["餐", "饭", "早餐", "午饭", "晚餐", "买菜", "超市"]):
-        category = "餐饮"
-    elif any(kw in text for kw in ["打车", "出租", "交通", "地铁", "公交", "的士", "巴士", "MTR", "mtr"]):
-        category = "交通"
-    item = text.strip()
-    return {"is_expense": True, "amount": amount, "currency": currency, "category": category, "item": item}
-
-def parse_expense_text(text: str):
-    if not API_KEY:
+    result.pop("confidence")
+    return result
+
+class CircuitOpenError(Exception):
+    pass
+
+class TruncatedResponse(Exception):
+    """The answer stopped at max_tokens (finish_reason "length"), so its JSON is cut off."""
+
+def _content(response) -> str:
+    choice = response.choices[0]
+    if choice.finish_reason == "length":
+        raise TruncatedResponse(f"answer cut off at {response.usage.completion_tokens if response.usage else '?'} tokens")
+    return choice.message.content
+
+class CircuitBreaker:
+    """
+    Opens after `failure_threshold` consecutive failures and rejects calls for `reset_after`
+    seconds; then lets a single probe through (half-open) and closes again if it succeeds.
+    """
+
+    def __init__(self, failure_threshold: int = LLM_BREAKER_FAILURES, reset_after: float = LLM_BREAKER_RESET):
+        self.failure_threshold = failure_threshold
+        self.reset_after = reset_after
+        self.failures = 0
+        self.opened_at = None
+        self.probing = False
+        self.trips = 0
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at >= self.reset_after:
+            return "half_open"
+        return "open"
+
+    def allow(self) -> bool:
+        state = self.state
+        if state == "closed":
+            return True
+        if state == "half_open" and not self.probing:
+            self.probing = True
+            return True
+        return False
+
+    def record_success(self):
+        self.failures = 0
+        self.opened_at = None
+        self.probing = False
+
+    def record_failure(self):
+        self.failures += 1
+        if self.probing or self.failures >= self.failure_threshold:
+            if self.opened_at is None or self.probing:
+                self.trips += 1
+            self.opened_at = time.monotonic()
+        self.probing = False
+
+@lru_cache(maxsize=None)
+def retryable_errors() -> tuple:
+    openai = _openai()
+    return (
+        asyncio.TimeoutError,
+        openai.APITimeoutError,
+        openai.APIConnectionError,
+        openai.RateLimitError,
+        openai.InternalServerError,
+    )
+
+class AsyncLLMClient:
+    """
+    AsyncOpenAI wrapper: bounded concurrency, a deadline per call, jittered exponential
+    retries, optional request hedging and a circuit breaker, plus latency/error counters.
+    """
+
+    def __init__(self, max_concurrency: int = LLM_MAX_CONCURRENCY, max_retries: int = LLM_MAX_RETRIES,
+                 hedge_after: float = LLM_HEDGE_AFTER):
+        self._client = None
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self.max_retries = max_retries
+        self.hedge_after = hedge_after
+        self.breaker = CircuitBreaker()
+        self.calls = 0
+        self.errors = 0
+        self.retries = 0
+        self.hedges = 0
+        self.rejected = 0
+        self._latencies = deque(maxlen=500)
+
+    async def chat(self, timeout: float, **kwargs):
+        """chat.completions.create with a total deadline of `timeout` seconds across retries."""
+        if not self.breaker.allow():
+            self.rejected += 1
+            raise CircuitOpenError("LLM circuit breaker is open")
+        probe = self.breaker.probing  # allow() only sets it for the half-open probe, i.e. this call
+
+        retryable = retryable_errors()
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        self.calls += 1
+        start = time.perf_counter()
+        try:
+            async with self._semaphore:
+                for attempt in range(self.max_retries + 1):
+                    try:
+                        remaining = deadline - loop.time()
+                        if remaining <= 0:
+                            raise asyncio.TimeoutError()
+                        response = await asyncio.wait_for(self._hedged(kwargs), remaining)
+                        break
+                    except retryable:
+                        backoff = random.uniform(0, min(4.0, 0.5 * 2 ** attempt))  # full jitter
+                        if attempt == self.max_retries or loop.time() + backoff >= deadline:
+                            raise
+                        self.retries += 1
+                        await asyncio.sleep(backoff)
+        except retryable:
+            self.errors += 1
+            self.breaker.record_failure()
+            metrics.record_llm_response(kwargs.get("model"), start, outcome="error")
+            raise
+        except Exception:
+            # The provider answered (e.g. 400), so it's reachable: don't count towards tripping
+            self.errors += 1
+            self.breaker.record_success()
+            metrics.record_llm_response(kwargs.get("model"), start, outcome="error")
+            raise
+        except BaseException:
+            # Cancelled (/undo, shutdown): a probe that never answered counts as failed, or the
+            # breaker would wait on it in half-open forever
+            if probe:
+                self.breaker.record_failure()
+            raise
+        self.breaker.record_success()
+        self._latencies.append(time.perf_counter() - start)
+        metrics.record_llm_response(kwargs.get("model"), start, response)
+        return response
+
+    @property
+    def client(self):
+        if self._client is None:
+            # The SDK's own retries would ignore our deadline and breaker
+            self._client = _openai().AsyncOpenAI(api_key=API_KEY, base_url=BASE_URL, max_retries=0)
+        return self._client
+
+    async def _hedged(self, kwargs):
+        """Send the request; if it hasn't answered after hedge_after seconds, race a duplicate."""
+        first = asyncio.ensure_future(self.client.chat.completions.create(**kwargs))
+        if not self.hedge_after:
+            return await first
+        done, _ = await asyncio.wait({first}, timeout=self.hedge_after)
+        if done:
+            return first.result()
+        self.hedges += 1
+        second = asyncio.ensure_future(self.client.chat.completions.create(**kwargs))
+        pending = {first, second}
+        try:
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        return task.result()
+            return first.result()  # both failed: surface the original error
+        finally:
+            for task in pending:
+                task.cancel()
+
+    def stats(self) -> dict:
+        latencies = sorted(self._latencies)
+
+        def pct(q):
+            return round(latencies[min(len(latencies) - 1, int(q * len(latencies)))] * 1000, 1) if latencies else None
+
+        return {
+            "calls": self.calls,
+            "errors": self.errors,
+            "retries": self.retries,
+            "hedges": self.hedges,
+            "rejected_by_breaker": self.rejected,
+            "breaker_state": self.breaker.state,
+            "breaker_trips": self.breaker.trips,
+            "latency_ms_p50": pct(0.5),
+            "latency_ms_p95": pct(0.95),
+        }
+
+llm_client = AsyncLLMClient() if API_KEY else None
+
+class UsageLog:
+    """
+    Tokens and latency of every routed call, totalled per (kind, stage, model) so routes can be
+    compared (/bot/stats, benchmarks/bench_llm.py). kind: text / multi / vision; stage: fast / full.
+    """
+
+    def __init__(self, keep: int = 200):
+        self.recent = deque(maxlen=keep)
+        self.totals: dict[tuple, dict] = {}
+        self.escalations: dict[tuple, int] = {}
+
+    def record(self, kind: str, stage: str, model: str, seconds: float, response=None, outcome: str = "ok") -> dict:
+        usage = getattr(response, "usage", None)
+        details = getattr(usage, "prompt_tokens_details", None)
+        call = {
+            "kind": kind,
+            "stage": stage,
+            "model": model,
+            "outcome": outcome,
+            "latency_ms": round(seconds * 1000, 1),
+            "prompt_tokens": getattr(usage, "prompt_tokens", 0) or 0,
+            "cached_tokens": getattr(details, "cached_tokens", 0) or 0,  # served from the provider's prefix cache
+            "completion_tokens": getattr(usage, "completion_tokens", 0) or 0,
+        }
+        self.recent.append(call)
+        total = self.totals.setdefault((kind, stage, model), {
+            "calls": 0, "errors": 0, "prompt_tokens": 0, "cached_tokens": 0, "completion_tokens": 0, "latency_ms": 0.0,
+        })
+        total["calls"] += 1
+        total["errors"] += outcome != "ok"
+        for key in ("prompt_tokens", "cached_tokens", "completion_tokens", "latency_ms"):
+            total[key] += call[key]
+        return call
+
+    def escalated(self, kind: str, reason: str):
+        self.escalations[(kind, reason)] = self.escalations.get((kind, reason), 0) + 1
+        metrics.llm_escalations.inc(kind=kind, reason=reason)
+
+    def reset(self):
+        self.recent.clear()
+        self.totals.clear()
+        self.escalations.clear()
+
+    def stats(self) -> dict:
+        routes = []
+        for (kind, stage, model), total in sorted(self.totals.items()):
+            calls = total["calls"]
+            routes.append({
+                "kind": kind, "stage": stage, "model": model, "calls": calls, "errors": total["errors"],
+                "prompt_tokens": total["prompt_tokens"], "cached_tokens": total["cached_tokens"],
+                "completion_tokens": total["completion_tokens"],
+                "avg_latency_ms": round(total["latency_ms"] / calls, 1),
+            })
+        return {
+            "routing": LLM_ROUTING,
+            "routes": routes,
+            "escalations": {f"{kind}:{reason}": n for (kind, reason), n in sorted(self.escalations.items())},
+        }
+
+usage_log = UsageLog()
+
+def _decode(content: str):
+    try:
+        return json.loads(content)
+    except (TypeError, ValueError):
+        return None
+
+def _has_chinese(value: str) -> bool:
+    return any("\u4e00" <= ch <= "\u9fff" for ch in value)
+
+def _check_expense(parsed, text: str | None = None) -> str | None:
+    """Why a fast-tier expense can't be trusted (the escalation reason), or None if it can."""
+    if not isinstance(parsed, dict):
+        return "invalid"
+    ruled = rules.parse(text) if text is not None else None
+    if not parsed.get("is_expense", True):
+        # "Not an expense" for a message with an amount in it gets a second opinion
+        return "disagree" if ruled else None
+    amount = parsed.get("amount")
+    if isinstance(amount, bool) or not isinstance(amount, (int, float)) or amount <= 0:
+        return "amount"
+    if parsed.get("currency") not in CURRENCIES:
+        return "currency"
+    if not isinstance(parsed.get("item"), str) or not _has_chinese(parsed["item"]):
+        return "item"  # missing, or left untranslated
+    confidence = parsed.get("confidence")
+    if isinstance(confidence, (int, float)) and confidence < LLM_ESCALATE_BELOW:
+        return "low_confidence"
+    if ruled and abs(ruled["amount"] - amount) > 0.005:
+        return "disagree"
+    return None
+
+def _check_text(text: str):
+    return lambda parsed: _check_expense(parsed, text)
+
+def _check_multi(segments: list):
+    def check(parsed):
+        expenses = parsed.get("expenses") if isinstance(parsed, dict) else None
+        if not isinstance(expenses, list):
+            return "invalid"
+        if len(expenses) != len(segments):
+            return "count"
+        for expense, segment in zip(expenses, segments):
+            reason = _check_expense(expense, segment)
+            if reason:
+                return reason
+        return None
+    return check
+
+def _check_image(parsed) -> str | None:
+    if not isinstance(parsed, dict):
+        return "invalid"
+    expenses = parsed.get("expenses")
+    for expense in expenses if isinstance(expenses, list) and expenses else [parsed]:
+        if isinstance(expense, dict) and not expense.get("is_expense", True):
+            return "not_expense"  # the member sent it as a receipt
+        reason = _check_expense(expense)
+        if reason:
+            return reason
+    return None
+
+async def _ask(kind: str, stage: str, model: str, messages: list, timeout: float, **kwargs):
+    """One JSON chat completion through llm_client, accounted in usage_log; returns the response."""
+    start = time.perf_counter()
+    try:
+        response = await llm_client.chat(timeout=timeout, model=model, messages=messages,
+                                         response_format={ "type": "json_object" }, **kwargs)
+    except CircuitOpenError:
+        raise
+    except Exception:
+        usage_log.record(kind, stage, model, time.perf_counter() - start, outcome="error")
+        raise
+    usage_log.record(kind, stage, model, time.perf_counter() - start, response)
+    return response
+
+async def _routed(kind: str, fast_messages: list, full_messages: list, check, timeout: float, **kwargs) -> str:
+    """
+    Content of the fast tier's answer if `check` (decoded JSON -> escalation reason or None)
+    accepts it, else of the full prompt on the full model. Both share one `timeout` budget.
+    """
+    fast_model, full_model = (FAST_VISION_MODEL, VISION_MODEL) if kind == "vision" else (FAST_TEXT_MODEL, TEXT_MODEL)
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout
+    if LLM_ROUTING == "tiered":
+        try:
+            response = await _ask(kind, "fast", fast_model, fast_messages, timeout * LLM_FAST_SHARE, **kwargs)
+            content = _content(response)
+            reason = check(_decode(content))
+        except CircuitOpenError:
+            raise
+        except TruncatedResponse:
+            reason = "truncated"
+        except Exception as e:
+            print(f"LLM fast tier error, escalating: {e!r}")
+            reason = "error"
+        if reason is None:
+            return content
+        usage_log.escalated(kind, reason)
+    response = await _ask(kind, "full", full_model, full_messages, max(deadline - loop.time(), 1.0), **kwargs)
+    return _content(response)
+
+def _text_messages(text: str, prompt: str = SYSTEM_PROMPT) -> list:
+    return [
+        {"role": "system", "content": prompt},
+        {"role": "user", "content": text}
+    ]
+
+def _image_messages(base64_image: str, prompt: str = SYSTEM_PROMPT) -> list:
+    return [
+        {
+            "role": "system",
+            "content": prompt
+        },
+        {
+            "role": "user",
+            "content": [
+                {"type": "text", "text": "这是我的消费小票，请识别其中的金额、币种、类别和商品名称。"
+                                         "如果图片里有多张小票或多笔独立的消费，请返回 {\"expenses\": [...]}，每笔一个对象。"},
+                {
+                    "type": "image_url",
+                    "image_url": {
+                        "url": f"data:image/jpeg;base64,{base64_image}",
+                        "detail": "high"
+                    }
+                }
+            ]
+        }
+    ]
+
+def _finish_text_parse(text: str, content: str):
+    parsed = json.loads(content)
+
+    # Validation and fallback logic
+    if not isinstance(parsed, dict):
         fallback = _simple_parse(text)
-        if fallback:
-            return fallback
-        return {"is_expense": False, "error": "NO_API_KEY"}
+        return fallback if fallback else {"is_expense": False}
+
+    if not parsed.get("is_expense", True): # Default true if not specified
+         parse_cache.put(text, {"is_expense": False})
+         return {"is_expense": False}
+
+    parsed.pop("confidence", None)  # fast-tier routing hint, not part of the parse
+
+    # Ensure essential fields
+    if "amount" not in parsed:
+        fallback = _simple_parse(text)
+        if fallback: parsed["amount"] = fallback["amount"]
+
+    if "currency" not in parsed:
+        parsed["currency"] = "CNY"
+
+    if "item" not in parsed:
+        parsed["item"] = text[:20]
+
+    parsed["is_expense"] = True
+    parse_cache.put(text, parsed)
+    return parsed
+
+def _text_fallback(text: str, error):
+    fallback = _simple_parse(text)
+    metrics.expense_parses.inc(source="fallback" if fallback else "failed")
+    if fallback:
+        return fallback
+    return {"is_expense": False, "error": str(error) or type(error).__name__}
+
+def _pre_llm_text(text: str):
+    """Rule fast path and no-key fallback; None means the LLM (or its cache) must decide."""
+    # Confident rule matches ("买菜 200", "午饭 500 港币") never need the LLM
+    fast = rules.fast_parse(text)
+    if fast:
+        metrics.expense_parses.inc(source="rules")
+        fast.pop("confidence")
+        return fast
+
+    if not API_KEY:
+        return _text_fallback(text, "NO_API_KEY")
+    return None
+
+async def parse_expense_text_async(text: str):
+    """One expense from a text message: rules, then the parse cache, then the LLM; falls back to the rule parser while the provider is unhealthy."""
+    early = _pre_llm_text(text)
+    if early:
+        return early
+
+    # The DB tier does blocking IO, keep it off the event loop
+    cached = await asyncio.to_thread(parse_cache.get, text) if parse_cache.use_db else parse_cache.get(text)
+    if cached:
+        metrics.expense_parses.inc(source="cache")
+        return cached
 
     try:
-        response = client.chat.completions.create(
-            model=TEXT_MODEL,
-            messages=[
-                {"role": "system", "content": SYSTEM_PROMPT},
-                {"role": "user", "content": text}
-            ],
-            response_format={ "type": "json_object" }
-        )
-        
-        content = response.choices[0].message.content
-        parsed = json.loads(content)
-        
-        # Validation and fallback logic
-        if not isinstance(parsed, dict):
-            fallback = _simple_parse(text)
-            return fallback if fallback else {"is_expense": False}
-            
-        if not parsed.get("is_expense", True): # Default true if not specified
-             return {"is_expense": False}
-             
-        # Ensure essential fields
-        if "amount" not in parsed:
-            fallback = _simple_parse(text)
-            if fallback: parsed["amount"] = fallback["amount"]
-        
-        if "currency" not in parsed:
-            parsed["currency"] = "CNY"
-            
-        if "item" not in parsed:
-            parsed["item"] = text[:20]
-
-        parsed["is_expense"] = True
-        return parsed
+        content = await _routed("text", _text_messages(text, COMPACT_PROMPT), _text_messages(text),
+                                _check_text(text), LLM_TEXT_TIMEOUT)
+        metrics.expense_parses.inc(source="llm")
+        if parse_cache.use_db:
+            return await asyncio.to_thread(_finish_text_parse, text, content)
+        return _finish_text_parse(text, content)
     except Exception as e:
-        print(f"LLM Text Error: {e}")
-        fallback = _simple_parse(text)
-        if fallback:
-            return fallback
-        return {"is_expense": False, "error": str(e)}
+        print(f"LLM Text Error: {e!r}")
+        return _text_fallback(text, e)
+
+def _fill_expense(expense: dict, default_item: str) -> dict | None:
+    if not isinstance(expense, dict) or not expense.get("is_expense", True) or "amount" not in expense:
+        return None
+    expense.pop("confidence", None)
+    expense.setdefault("currency", "CNY")
+    expense.setdefault("category", "其他")
+    if not expense.get("item"):
+        expense["item"] = default_item
+    expense["is_expense"] = True
+    return expense
 
-def encode_image(image_path):
-    with open(image_path, "rb") as image_file:
-        return base64.b64encode(image_file.read()).decode('utf-8')
+def _finish_multi_parse(segments: list, content: str) -> list:
+    parsed = json.loads(content)
+    expenses = parsed.get("expenses") if isinstance(parsed, dict) else parsed
+    if not isinstance(expenses, list):
+        expenses = [parsed]
+    results = []
+    for i, expense in enumerate(expenses):
+        filled = _fill_expense(expense, segments[i][:20] if i < len(segments) else "消费")
+        if filled:
+            results.append(filled)
+    return results
 
-def parse_expense_image(image_path: str):
+async def parse_expenses_text_async(text: str) -> list:
     """
-    Use GPT-4o Vision to directly understand the receipt image.
+    All expenses in one message. A single expense takes the normal path; a list is answered
+    by the rule engine when every line is confident, else by one LLM call for the whole list.
     """
+    segments = rules.split_expenses(text)
+    if len(segments) == 1:
+        result = await parse_expense_text_async(text)
+        return [result] if result.get("is_expense") else []
+
+    fast = [rules.fast_parse(seg) for seg in segments]
+    if all(fast):
+        metrics.expense_parses.inc(source="rules")
+        for result in fast:
+            result.pop("confidence")
+        return fast
+
+    fallback = [result for result in (_simple_parse(seg) for seg in segments) if result]
+    if not API_KEY:
+        metrics.expense_parses.inc(source="fallback")
+        return fallback
+    try:
+        content = await _routed("multi", _text_messages(text, COMPACT_MULTI_PROMPT),
+                                _text_messages(text, MULTI_EXPENSE_PROMPT), _check_multi(segments), LLM_TEXT_TIMEOUT)
+        metrics.expense_parses.inc(source="llm")
+        return _finish_multi_parse(segments, content) or fallback
+    except Exception as e:
+        print(f"LLM Text Error: {e!r}")
+        metrics.expense_parses.inc(source="fallback")
+        return fallback
+
+def _finish_image_parse(content: str):
+    parsed = json.loads(content)
+
+    # Several receipts / line items in one photo
+    if isinstance(parsed.get("expenses"), list):
+        expenses = [e for e in (_fill_expense(e, "未知商品") for e in parsed["expenses"]) if e]
+        if len(expenses) > 1:
+            return {"is_expense": True, "expenses": expenses}
+        if expenses:
+            return expenses[0]
+        return {"is_expense": False, "error": "Could not find amount in image."}
+
+    if not parsed.get("is_expense", True):
+        return {"is_expense": False, "error": "AI recognized this is not an expense receipt."}
+
+    parsed.pop("confidence", None)
+
+    # Basic validation
+    if "amount" not in parsed:
+         return {"is_expense": False, "error": "Could not find amount in image."}
+
+    if "currency" not in parsed:
+        parsed["currency"] = "CNY" # Default
+
+    if "item" not in parsed:
+        parsed["item"] = "未知商品"
+
+    parsed["is_expense"] = True
+    return parsed
+
+TOO_MANY_ITEMS = "小票条目太多，识别结果不完整，请分开拍摄或直接发送文字"
+
+async def parse_expense_image_async(image: bytes):
+    """Vision parse of an in-memory JPEG (see imaging.parse_receipt, which shrinks it first)."""
     if not API_KEY:
         return {"is_expense": False, "error": "No API Key configured"}
 
-    print(f"Analyzing image with {VISION_MODEL}: {image_path}")
-    
+    print(f"Analyzing image ({LLM_ROUTING}): {len(image) // 1024} KB")
+
     try:
-        base64_image = encode_image(image_path)
-        
-        response = client.chat.completions.create(
-            model=VISION_MODEL,
-            messages=[
-                {
-                    "role": "system",
-                    "content": SYSTEM_PROMPT
-                },
-                {
-                    "role": "user",
-                    "content": [
-                        {"type": "text", "text": "这是我的消费小票，请识别其中的金额、币种、类别和商品名称。"},
-                        {
-                            "type": "image_url",
-                            "image_url": {
-                                "url": f"data:image/jpeg;base64,{base64_image}",
-                                "detail": "high"
-                            }
-                        }
-                    ]
-                }
-            ],
-            response_format={ "type": "json_object" },
-            max_tokens=300
-        )
-
-        content = response.choices[0].message.content
-        parsed = json.loads(content)
-        
-        if not parsed.get("is_expense", True):
-            return {"is_expense": False, "error": "AI recognized this is not an expense receipt."}
-            
-        # Basic validation
-        if "amount" not in parsed:
-             return {"is_expense": False, "error": "Could not find amount in image."}
-             
-        if "currency" not in parsed:
-            parsed["currency"] = "CNY" # Default
-            
-        if "item" not in parsed:
-            parsed["item"] = "未知商品"
-
-        parsed["is_expense"] = True
-        return parsed
+        base64_image = base64.b64encode(image).decode('utf-8')
+        content = await _routed("vision", _image_messages(base64_image, COMPACT_PROMPT), _image_messages(base64_image),
+                                _check_image, LLM_VISION_TIMEOUT, max_tokens=LLM_VISION_MAX_TOKENS)
+        return _finish_image_parse(content)
 
-    except Exception as e:
+    except CircuitOpenError:
+        return {"is_expense": False, "error": "识别服务暂时不可用，请稍后再试或直接发送文字"}
+    except TruncatedResponse as e:
         print(f"LLM Vision Error: {e}")
+        return {"is_expense": False, "error": TOO_MANY_ITEMS}
+    except Exception as e:
+        print(f"LLM Vision Error: {e!r}")
         return {"is_expense": False, "error": f"Vision API Error: {str(e)}"}
+
+def llm_stats() -> dict:
+    return {
+        "client": llm_client.stats() if llm_client else None,
+        "parse_cache": parse_cache.stats(),
+        "usage": usage_log.stats(),
+    }
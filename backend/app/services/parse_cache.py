@@ -0,0 +1,140 @@
+import os
+import re
+import hashlib
+import threading
+import unicodedata
+from collections import OrderedDict
+
+from ..database import SessionLocal
+from .. import models
+
+LLM_CACHE_SIZE = int(os.getenv("LLM_CACHE_SIZE", "2048"))
+LLM_CACHE_DB = os.getenv("LLM_CACHE_DB", "0") == "1"
+
+AMOUNT_PLACEHOLDER = "{n}"
+NUMBER_RE = re.compile(r"[0-9]+(?:\.[0-9]+)?")
+
+def cache_namespace(model: str, prompt: str) -> str:
+    """Fingerprint of everything that shapes a parse; changing either starts a fresh cache."""
+    return hashlib.sha1(f"{model}\n{prompt}".encode("utf-8")).hexdigest()[:12]
+
+def normalize(text: str) -> str:
+    text = unicodedata.normalize("NFKC", text).strip().lower()
+    return re.sub(r"\s+", " ", text)
+
+def _templates(normalized: str):
+    """
+    Candidate (template, amount) pairs: the exact text, then the text with each number
+    abstracted, so "买菜 200" and "买菜 350" share "买菜 {n}".
+    """
+    yield normalized, None
+    for m in NUMBER_RE.finditer(normalized):
+        yield normalized[:m.start()] + AMOUNT_PLACEHOLDER + normalized[m.end():], float(m.group())
+
+class ParseCache:
+    """Two-tier cache of LLM expense parses: bounded in-memory LRU, optional llm_parse_cache table."""
+
+    def __init__(self, namespace: str, max_entries: int = LLM_CACHE_SIZE, use_db: bool = LLM_CACHE_DB):
+        self.namespace = namespace
+        self.max_entries = max_entries
+        self.use_db = use_db
+        self._entries: OrderedDict[str, dict] = OrderedDict()
+        self._lock = threading.Lock()
+        self._stale_purged = False
+        self.hits = 0
+        self.db_hits = 0
+        self.misses = 0
+
+    def _key(self, template: str) -> str:
+        return hashlib.sha1(f"{self.namespace}\n{template}".encode("utf-8")).hexdigest()
+
+    def get(self, text: str) -> dict | None:
+        candidates = [(self._key(t), t, amount) for t, amount in _templates(normalize(text))]
+        with self._lock:
+            for key, _, amount in candidates:
+                result = self._entries.get(key)
+                if result is not None:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return self._fill(result, amount)
+
+        if self.use_db:
+            found = self._db_get([key for key, _, _ in candidates])
+            for key, _, amount in candidates:
+                if key in found:
+                    self._remember(key, found[key])
+                    self.db_hits += 1
+                    return self._fill(found[key], amount)
+
+        self.misses += 1
+        return None
+
+    def put(self, text: str, result: dict):
+        """Cache an LLM result, abstracting the amount when it appears verbatim in the text."""
+        normalized = normalize(text)
+        template, stored = normalized, dict(result)
+        amount = result.get("amount")
+        if isinstance(amount, (int, float)):
+            for t, number in list(_templates(normalized))[1:]:
+                if number == float(amount):
+                    template = t
+                    stored.pop("amount")
+                    break
+        key = self._key(template)
+        self._remember(key, stored)
+        if self.use_db:
+            self._db_put(key, template, stored)
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.db_hits + self.misses
+        return {
+            "namespace": self.namespace,
+            "entries": len(self._entries),
+            "hits": self.hits,
+            "db_hits": self.db_hits,
+            "misses": self.misses,
+            "hit_rate": (self.hits + self.db_hits) / lookups if lookups else 0.0,
+        }
+
+    def _fill(self, result: dict, amount: float | None) -> dict:
+        filled = dict(result)
+        if "amount" not in filled and amount is not None:
+            filled["amount"] = amount
+        return filled
+
+    def _remember(self, key: str, result: dict):
+        with self._lock:
+            self._entries[key] = result
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def _db_get(self, keys: list) -> dict:
+        db = SessionLocal()
+        try:
+            if not self._stale_purged:
+                self._stale_purged = True
+                db.query(models.ParseCacheEntry).filter(
+                    models.ParseCacheEntry.namespace != self.namespace
+                ).delete(synchronize_session=False)
+                db.commit()
+            rows = db.query(models.ParseCacheEntry.key, models.ParseCacheEntry.result).filter(
+                models.ParseCacheEntry.key.in_(keys)
+            )
+            return {key: result for key, result in rows}
+        except Exception as e:
+            print(f"Parse cache DB error: {e}")
+            return {}
+        finally:
+            db.close()
+
+    def _db_put(self, key: str, template: str, result: dict):
+        db = SessionLocal()
+        try:
+            db.merge(models.ParseCacheEntry(key=key, namespace=self.namespace, template=template, result=result))
+            db.commit()
+        except Exception as e:
+            db.rollback()
+            print(f"Parse cache DB error: {e}")
+        finally:
+            db.close()
@@ -0,0 +1,190 @@
+import os
+import re
+
+from .automaton import Automaton
+
+# Messages scoring at least this much skip the LLM entirely
+RULES_CONFIDENCE_THRESHOLD = float(os.getenv("RULES_CONFIDENCE_THRESHOLD", "0.8"))
+
+# Currency rules, mirroring "Currency Inference Rules" in SYSTEM_PROMPT.
+# Checked in this order; matched tokens are removed so "港元" doesn't also count as "元".
+EXPLICIT_CURRENCY = [
+    ("HKD", ["港币", "港元", "港幣", "港紙", "港纸", "hkd", "hk$", "蚊"]),
+    ("USDT", ["usdt", "tether", "泰达币"]),
+    ("CNY", ["人民币", "rmb", "cny", "元", "块"]),
+]
+# A bare "u" / "U" next to an amount or after 买 ("10 U", "10u", "买U")
+USDT_U_RE = re.compile(r"(?<![a-z])u(?![a-z])")
+
+CONTEXT_CURRENCY = [
+    ("HKD", ["mtr", "港铁", "旺角", "茶餐厅", "八达通", "7-11 hk", "铜锣湾", "尖沙咀", "中环", "湾仔", "香港",
+             "fps", "转数快", "转數快"]),
+    ("USDT", ["gas fee", "trx", "eth", "binance", "okx", "币安"]),
+    ("CNY", ["微信支付", "微信", "支付宝", "淘宝", "美团", "滴滴", "拼多多"]),
+]
+
+# Checked in order, first match wins (same precedence as the old _simple_parse / deriveCategory)
+CATEGORY_KEYWORDS = [
+    ("其他", ["充值", "会员", "gas fee", "买u"]),
+    ("转账", ["转账", "fps", "轉帳", "轉賬", "转數快", "转数快", "红包"]),
+    ("餐饮", ["餐", "饭", "早餐", "午饭", "晚饭", "晚餐", "吃饭", "买菜", "超市", "咖啡", "奶茶", "星巴克", "麦当劳",
+             "mcdonald", "kfc", "肯德基", "外卖", "水果", "买水", "breakfast", "lunch", "dinner", "coffee"]),
+    ("交通", ["打车", "出租", "交通", "地铁", "公交", "的士", "巴士", "mtr", "港铁", "滴滴", "停车", "加油", "八达通",
+             "taxi", "uber", "bus", "高铁", "火车", "机票"]),
+    ("购物", ["快递", "顺丰", "菜鸟", "淘宝", "京东", "拼多多", "购物", "买衣服", "买鞋"]),
+    ("居住", ["房租", "租金", "水费", "电费", "水电", "燃气", "物业"]),
+    ("娱乐", ["电影", "游戏", "旅游", "ktv"]),
+    ("医疗", ["医院", "药", "体检", "看病"]),
+]
+
+_CURRENCY_WORDS = "|".join(re.escape(tok) for _, tokens in EXPLICIT_CURRENCY for tok in tokens)
+CURRENCY_AFTER_RE = re.compile(rf"^(?:{_CURRENCY_WORDS}|u)(?![a-z])", re.IGNORECASE)
+CURRENCY_BEFORE_RE = re.compile(rf"(?<![a-z])(?:{_CURRENCY_WORDS})$", re.IGNORECASE)
+
+# Digits that are part of a name, not an amount
+NON_AMOUNT_TOKENS = ["7-11", "7-eleven", "711"]
+NUMBER_RE = re.compile(r"[0-9]+(?:\.[0-9]+)?")
+THOUSANDS_RE = re.compile(r"(?<=[0-9]),(?=[0-9]{3}(?![0-9]))")
+
+# Confidence weights: amount + currency + category
+SCORE_SINGLE_AMOUNT = 0.5
+SCORE_PICKED_AMOUNT = 0.35   # several numbers, one of them next to a currency token
+SCORE_GUESSED_AMOUNT = 0.15  # several numbers, took the last
+SCORE_EXPLICIT_CURRENCY = 0.25
+SCORE_CONTEXT_CURRENCY = 0.15
+SCORE_DEFAULT_CURRENCY = 0.1
+SCORE_CATEGORY = 0.25
+PENALTY_CONFLICT = 0.2
+
+def _contains(text: str, keyword: str) -> bool:
+    # ASCII keywords match whole words ("bus" must not hit "business"); CJK ones match anywhere
+    if keyword.isascii() and keyword[0].isalnum():
+        return re.search(rf"(?<![a-z]){re.escape(keyword)}(?![a-z])", text) is not None
+    return keyword in text
+
+def _find_currency(lower: str):
+    """Returns (currency, score, conflict)."""
+    remaining = lower
+    explicit = []
+    for currency, tokens in EXPLICIT_CURRENCY:
+        for tok in tokens:
+            if _contains(remaining, tok):
+                explicit.append(currency)
+                remaining = remaining.replace(tok, " ")
+        if currency == "USDT" and USDT_U_RE.search(remaining):
+            explicit.append(currency)
+    if explicit:
+        return explicit[0], SCORE_EXPLICIT_CURRENCY, len(set(explicit)) > 1
+
+    context = [currency for currency, tokens in CONTEXT_CURRENCY if any(_contains(lower, tok) for tok in tokens)]
+    if context:
+        return context[0], SCORE_CONTEXT_CURRENCY, len(set(context)) > 1
+    return "CNY", SCORE_DEFAULT_CURRENCY, False
+
+def _find_amount(lower: str):
+    """Returns (amount, span, score) or None."""
+    masked = lower
+    for tok in NON_AMOUNT_TOKENS:
+        masked = masked.replace(tok, "#" * len(tok))
+    numbers = list(NUMBER_RE.finditer(masked))
+    if not numbers:
+        return None
+    if len(numbers) == 1:
+        m = numbers[0]
+        return float(m.group()), m.span(), SCORE_SINGLE_AMOUNT
+    currency_words = [tok for _, tokens in EXPLICIT_CURRENCY for tok in tokens] + ["u"]
+    for m in numbers:
+        after = masked[m.end():].lstrip()
+        before = masked[:m.start()].rstrip()
+        if any(after.startswith(tok) or before.endswith(tok) for tok in currency_words):
+            return float(m.group()), m.span(), SCORE_PICKED_AMOUNT
+    m = numbers[-1]
+    return float(m.group()), m.span(), SCORE_GUESSED_AMOUNT
+
+# Every category keyword in one automaton -> precedence (index into CATEGORY_KEYWORDS)
+_CATEGORY_AUTOMATON = Automaton({
+    kw: rank for rank, (_, keywords) in reversed(list(enumerate(CATEGORY_KEYWORDS))) for kw in keywords
+})
+
+def _word_boundary(text: str, start: int, end: int, keyword: str) -> bool:
+    # Same rule as _contains: ASCII keywords match whole words only
+    if not (keyword.isascii() and keyword[0].isalnum()):
+        return True
+    return not (start > 0 and "a" <= text[start - 1] <= "z") and not (end < len(text) and "a" <= text[end] <= "z")
+
+def classify(text: str) -> str | None:
+    """First category in CATEGORY_KEYWORDS with a keyword in the text, in one pass over it."""
+    lower = text.lower()
+    best = None
+    for start, end, keyword, rank in _CATEGORY_AUTOMATON.iter(lower):
+        if (best is None or rank < best) and _word_boundary(lower, start, end, keyword):
+            best = rank
+            if best == 0:
+                break
+    return CATEGORY_KEYWORDS[best][0] if best is not None else None
+
+def categorize(category: str | None, item: str | None, raw_text: str | None) -> str:
+    """
+    Category stored with a transaction: the parsed one unless it is missing or the catch-all
+    "其他", in which case the item and original message are classified.
+    """
+    category = (category or "").strip()
+    if category and category != "其他":
+        return category
+    return classify(f"{item or ''} {raw_text or ''}") or category or "其他"
+
+def parse(text: str) -> dict | None:
+    """
+    Rule-based parse with a confidence score in [0, 1].
+    Returns None when there is no amount at all (let the LLM decide if it's an expense).
+    """
+    text = THOUSANDS_RE.sub("", text.strip())
+    lower = text.lower()
+    found = _find_amount(lower)
+    if not found:
+        return None
+    amount, (start, end), amount_score = found
+
+    currency, currency_score, conflict = _find_currency(lower)
+    category = classify(lower)
+    confidence = amount_score + currency_score + (SCORE_CATEGORY if category else 0.0)
+    if conflict:
+        confidence -= PENALTY_CONFLICT
+
+    # Drop the amount and a currency word right next to it ("45 港币", "HK$50", "10u")
+    before = CURRENCY_BEFORE_RE.sub("", text[:start].rstrip())
+    after = CURRENCY_AFTER_RE.sub("", text[end:].lstrip())
+    item = re.sub(r"\s+", " ", f"{before} {after}").strip() or text
+    return {
+        "is_expense": True,
+        "amount": amount,
+        "currency": currency,
+        "category": category or "其他",
+        "item": item,
+        "confidence": round(max(confidence, 0.0), 2),
+    }
+
+def fast_parse(text: str, threshold: float = RULES_CONFIDENCE_THRESHOLD) -> dict | None:
+    """The rule parse if it is confident enough to skip the LLM, else None."""
+    result = parse(text)
+    if result and result["confidence"] >= threshold:
+        return result
+    return None
+
+# Separators between expenses in one message; commas only when not inside a number ("1,000")
+SEGMENT_SPLIT_RE = re.compile(r"[\n；;]+")
+COMMA_SPLIT_RE = re.compile(r"，|、|(?<![0-9]),|,(?![0-9])")
+
+def split_expenses(text: str) -> list:
+    """
+    Split a message listing several expenses ("早餐 20\n地铁 6\n午饭 45 港币") into one
+    segment per expense. Returns a single segment when it doesn't look like a list.
+    """
+    segments = [seg.strip() for seg in SEGMENT_SPLIT_RE.split(text) if seg.strip()]
+    if len(segments) == 1:
+        parts = [part.strip() for part in COMMA_SPLIT_RE.split(segments[0]) if part.strip()]
+        if len(parts) > 1 and all(NUMBER_RE.search(part) for part in parts):
+            segments = parts
+    if len(segments) > 1 and all(_find_amount(seg.lower()) for seg in segments):
+        return segments
+    return [text.strip()]
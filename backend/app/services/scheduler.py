@@ -0,0 +1,152 @@
+import os
+import time
+import asyncio
+from collections import defaultdict
+from contextvars import ContextVar
+
+from .. import metrics
+
+# Bot handler jobs allowed to run at once, per kind. Vision parses are the slow, expensive ones.
+BOT_TEXT_JOBS = int(os.getenv("BOT_TEXT_JOBS", "8"))
+BOT_VISION_JOBS = int(os.getenv("BOT_VISION_JOBS", "2"))
+
+# The job whose task is running; set in JobScheduler._execute (each task has its own context)
+_current_job: ContextVar["Job | None"] = ContextVar("current_job", default=None)
+
+class JobCancelled(Exception):
+    """The job was cancelled (e.g. by /undo) before or while it ran."""
+
+class Job:
+    def __init__(self, key: str, kind: str):
+        self.key = key
+        self.kind = kind
+        self.queued_at = time.monotonic()
+        self.started_at: float | None = None
+        self.task: asyncio.Task | None = None
+        self.on_cancel: list = []  # async callables, run once the task is cancelled
+
+class JobScheduler:
+    """
+    Runs bot handler jobs with a concurrency limit per kind ("text", "vision") while keeping
+    each user's jobs strictly in arrival order: a user's job starts only after their previous one
+    finished, so "早餐 20" is always parsed before the item reply that follows it. Different users
+    run in parallel up to the limits. Jobs are keyed per user and chat (bot.state_key, the same
+    key as the pending entry), so a user's chats don't queue behind or cancel each other.
+    """
+
+    def __init__(self, limits: dict | None = None):
+        limits = limits or {"text": BOT_TEXT_JOBS, "vision": BOT_VISION_JOBS}
+        self.limits = dict(limits)
+        self._semaphores = {kind: asyncio.Semaphore(n) for kind, n in limits.items()}
+        self._tails: dict[str, asyncio.Future] = {}      # key -> done-future of its last job
+        self._jobs: dict[str, list[Job]] = defaultdict(list)
+        self._counts = {kind: {"queued": 0, "running": 0, "done": 0, "cancelled": 0, "failed": 0}
+                        for kind in limits}
+        self._started = {kind: 0 for kind in limits}
+        self._wait_total = {kind: 0.0 for kind in limits}
+        self._wait_max = {kind: 0.0 for kind in limits}
+        self._cleanups: set[asyncio.Task] = set()  # running on_cancel callbacks, kept referenced
+
+    async def run(self, key: str, kind: str, fn, *args):
+        """Await fn(*args) as this user's next job. Raises JobCancelled if cancel() got to it."""
+        job = Job(key, kind)
+        previous = self._tails.get(key)
+        done = asyncio.get_running_loop().create_future()
+        self._tails[key] = done
+        self._jobs[key].append(job)
+        self._counts[kind]["queued"] += 1
+        job.task = asyncio.create_task(self._execute(job, previous, fn, args))
+        # A done callback rather than `finally`: a task cancelled before its first step never runs its body
+        job.task.add_done_callback(lambda task: self._finished(job, done))
+        try:
+            await asyncio.wait({job.task})
+        except asyncio.CancelledError:
+            job.task.cancel()  # the handler itself was cancelled (shutdown)
+            raise
+        if job.task.cancelled():
+            raise JobCancelled()
+        return job.task.result()
+
+    async def _execute(self, job: Job, previous: asyncio.Future | None, fn, args):
+        if previous is not None:
+            # shield: being cancelled while queued must not cancel the previous job's future
+            await asyncio.shield(previous)
+        counts = self._counts[job.kind]
+        _current_job.set(job)
+        async with self._semaphores[job.kind]:
+            job.started_at = time.monotonic()
+            wait = job.started_at - job.queued_at
+            self._started[job.kind] += 1
+            self._wait_total[job.kind] += wait
+            self._wait_max[job.kind] = max(self._wait_max[job.kind], wait)
+            metrics.bot_job_wait.observe(wait, kind=job.kind)
+            counts["queued"] -= 1
+            counts["running"] += 1
+            try:
+                return await fn(*args)
+            finally:
+                counts["running"] -= 1
+
+    def _finished(self, job: Job, done: asyncio.Future):
+        counts = self._counts[job.kind]
+        if job.task.cancelled():
+            counts["cancelled"] += 1
+            if job.started_at is None:
+                counts["queued"] -= 1
+            for callback in job.on_cancel:
+                cleanup = asyncio.ensure_future(callback())
+                self._cleanups.add(cleanup)
+                cleanup.add_done_callback(self._cleanup_done)
+        elif job.task.exception() is not None:
+            counts["failed"] += 1
+        else:
+            counts["done"] += 1
+        done.set_result(None)  # lets the user's next job start
+        if self._tails.get(job.key) is done:
+            del self._tails[job.key]
+        jobs = self._jobs.get(job.key)
+        if jobs and job in jobs:  # cancel() already dropped it otherwise
+            jobs.remove(job)
+            if not jobs:
+                del self._jobs[job.key]
+
+    def _cleanup_done(self, cleanup: asyncio.Task):
+        self._cleanups.discard(cleanup)
+        if not cleanup.cancelled() and cleanup.exception() is not None:
+            print(f"Job cancel callback failed: {cleanup.exception()!r}")
+
+    def on_cancel(self, callback):
+        """
+        Run `callback()` (async) if the current job gets cancelled, e.g. to close out the status
+        message it already sent. No-op outside a scheduler job.
+        """
+        job = _current_job.get()
+        if job is not None:
+            job.on_cancel.append(callback)
+
+    def cancel(self, key: str) -> int:
+        """Cancel the key's queued and running jobs; returns how many were cancelled."""
+        cancelled = 0
+        for job in self._jobs.pop(key, []):
+            if job.task and not job.task.done():
+                job.task.cancel()
+                cancelled += 1
+        return cancelled
+
+    def pending(self, key: str) -> int:
+        return len(self._jobs.get(key, []))
+
+    def stats(self) -> dict:
+        stats = {}
+        for kind, counts in self._counts.items():
+            started = self._started[kind]
+            stats[kind] = {
+                "limit": self.limits[kind],
+                **counts,
+                "avg_wait_ms": round(1000 * self._wait_total[kind] / started, 1) if started else 0.0,
+                "max_wait_ms": round(1000 * self._wait_max[kind], 1),
+            }
+        stats["users_waiting"] = len(self._jobs)
+        return stats
+
+scheduler = JobScheduler()
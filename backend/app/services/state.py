@@ -0,0 +1,131 @@
+import os
+import time
+import asyncio
+from collections import OrderedDict
+from datetime import datetime, timedelta
+
+from ..database import run_db
+from .. import crud
+
+# Pending two-step entries (waiting for the user's item reply)
+BOT_STATE_STORE = os.getenv("BOT_STATE_STORE", "db")  # "memory" or "db" (memory + write-behind to bot_states)
+BOT_STATE_TTL = int(os.getenv("BOT_STATE_TTL", "1800"))
+BOT_STATE_MAX = int(os.getenv("BOT_STATE_MAX", "1000"))
+BOT_STATE_FLUSH_DELAY = float(os.getenv("BOT_STATE_FLUSH_DELAY", "1.0"))
+
+class MemoryStateStore:
+    """
+    In-process TTL + LRU map. Memory is authoritative, so the common
+    "no pending state" check never touches the database.
+    """
+
+    def __init__(self, ttl: int = BOT_STATE_TTL, max_entries: int = BOT_STATE_MAX):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries: OrderedDict[str, tuple[float, dict]] = OrderedDict()  # key -> (expires_at, data)
+
+    def set(self, key: str, data: dict, expires_at: float | None = None):
+        self._entries[key] = (expires_at or time.time() + self.ttl, data)
+        self._entries.move_to_end(key)
+        self._evict()
+
+    def pop(self, key: str) -> dict | None:
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return None
+        expires_at, data = entry
+        return data if expires_at > time.time() else None
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _evict(self):
+        # Entries are kept in set order with one TTL, so expired ones are always at the front
+        now = time.time()
+        while self._entries:
+            key, (expires_at, _) = next(iter(self._entries.items()))
+            if expires_at > now and len(self._entries) <= self.max_entries:
+                break
+            self._entries.popitem(last=False)
+            self._on_evict(key)
+
+    def _on_evict(self, key: str):
+        pass
+
+    async def load(self):
+        pass
+
+    async def flush(self):
+        pass
+
+class WriteBehindStateStore(MemoryStateStore):
+    """
+    MemoryStateStore that also mirrors entries into bot_states in batches, off the
+    request path, so pending entries survive a restart.
+    """
+
+    def __init__(self, ttl: int = BOT_STATE_TTL, max_entries: int = BOT_STATE_MAX,
+                 flush_delay: float = BOT_STATE_FLUSH_DELAY):
+        super().__init__(ttl, max_entries)
+        self.flush_delay = flush_delay
+        self._dirty: dict[str, dict | None] = {}  # key -> data, or None to delete
+        self._flush_task: asyncio.Task | None = None
+
+    def set(self, key: str, data: dict, expires_at: float | None = None):
+        super().set(key, data, expires_at)
+        self._mark_dirty(key, data)
+
+    def pop(self, key: str) -> dict | None:
+        data = super().pop(key)
+        if data is not None:
+            self._mark_dirty(key, None)
+        return data
+
+    def _on_evict(self, key: str):
+        self._mark_dirty(key, None)
+
+    def _mark_dirty(self, key: str, data: dict | None):
+        self._dirty[key] = data
+        if self._flush_task is None or self._flush_task.done():
+            try:
+                self._flush_task = asyncio.get_running_loop().create_task(self._flush_later())
+            except RuntimeError:
+                pass  # no running loop; flushed on the next write or at shutdown
+
+    async def _flush_later(self):
+        await asyncio.sleep(self.flush_delay)
+        await self.flush()
+
+    async def flush(self):
+        if not self._dirty:
+            return
+        batch, self._dirty = self._dirty, {}
+        upserts = {key: data for key, data in batch.items() if data is not None}
+        deletes = [key for key, data in batch.items() if data is None]
+        expire_before = datetime.now() - timedelta(seconds=self.ttl)
+        try:
+            await run_db(crud.flush_bot_states, upserts, deletes, expire_before)
+        except Exception as e:
+            print(f"Error flushing bot states: {e}")
+            # Keep newer writes that arrived during the failed flush
+            self._dirty = {**batch, **self._dirty}
+
+    async def load(self):
+        """Restart recovery: pull entries that haven't expired yet back into memory."""
+        since = datetime.now() - timedelta(seconds=self.ttl)
+        try:
+            rows = await run_db(crud.load_bot_states, since)
+        except Exception as e:
+            print(f"Error loading bot states: {e}")
+            return
+        for key, data, updated_at in sorted(rows, key=lambda row: row[2]):
+            MemoryStateStore.set(self, key, data, updated_at.timestamp() + self.ttl)
+        if rows:
+            print(f"Restored {len(rows)} pending bot states")
+
+def create_state_store(kind: str = BOT_STATE_STORE) -> MemoryStateStore:
+    if kind == "memory":
+        return MemoryStateStore()
+    return WriteBehindStateStore()
+
+pending_states = create_state_store()
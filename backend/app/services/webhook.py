@@ -0,0 +1,183 @@
+import os
+import hmac
+import time
+import asyncio
+import hashlib
+
+from ..database import run_db
+from .. import crud
+
+# "polling" (default) or "webhook". Webhook mode needs a public https URL; on Render
+# RENDER_EXTERNAL_URL is set automatically.
+BOT_MODE = os.getenv("BOT_MODE", "polling")
+WEBHOOK_URL = os.getenv("WEBHOOK_URL") or os.getenv("RENDER_EXTERNAL_URL")
+WEBHOOK_PATH = "/telegram/webhook"
+WEBHOOK_SECRET = os.getenv("TELEGRAM_WEBHOOK_SECRET")
+# Updates accepted but not handled yet; past this the route answers 503 and Telegram retries later
+WEBHOOK_QUEUE_SIZE = int(os.getenv("WEBHOOK_QUEUE_SIZE", "100"))
+WEBHOOK_DRAIN_TIMEOUT = float(os.getenv("WEBHOOK_DRAIN_TIMEOUT", "10"))
+
+def default_secret(token: str) -> str:
+    # Telegram allows 1-256 chars of A-Z a-z 0-9 _ -
+    return hashlib.sha256(f"webhook:{token}".encode()).hexdigest()[:32]
+
+def shard_key(payload: dict):
+    """Who sent the update; one sender's updates are handled one after another, in arrival order."""
+    for value in payload.values():
+        if isinstance(value, dict):
+            sender = value.get("from") or value.get("chat") or {}
+            return sender.get("id")
+    return None
+
+class WebhookIngress:
+    """
+    Takes Telegram webhook updates off the HTTP request and hands each to Application.process_update
+    in its own task.
+
+    Each sender's updates are chained, so they are handled in arrival order (the pending item flow
+    depends on it), while different senders run in parallel: a 45s receipt only holds back its
+    sender's later messages, and how many handlers run at once is the JobScheduler's limits, not
+    ours. At most queue_size updates are in flight. The highest update_id below which everything
+    has been handled is saved to bot_offsets; anything at or under it, or already in flight, is a
+    Telegram redelivery and is acknowledged without running the handlers (and their LLM calls) again.
+    """
+
+    def __init__(self, application, queue_size: int = WEBHOOK_QUEUE_SIZE, secret: str | None = WEBHOOK_SECRET):
+        self.application = application
+        self.secret = secret or default_secret(application.bot.token)
+        self.queue_size = max(1, queue_size)
+        self._tasks: set[asyncio.Task] = set()
+        self._tails: dict = {}            # sender -> task of their latest update
+        self._waiting = 0                 # in flight, behind the sender's previous update
+        self._bot_id = ""
+        self._accepting = False
+        self._watermark = 0               # every update_id <= this has been handled
+        self._saved = 0                   # watermark as last written to bot_offsets
+        self._seen: set[int] = set()      # accepted ids above the watermark (in flight or done)
+        self._pending: set[int] = set()   # accepted ids not finished yet
+        self._save_task: asyncio.Task | None = None
+        self.accepted = 0
+        self.duplicates = 0
+        self.rejected = 0
+        self.handled = 0
+        self.failed = 0
+        self.total_wait = 0.0
+
+    async def start(self, url: str | None = WEBHOOK_URL):
+        from telegram import Update  # the bot stack is imported lazily, off the startup path
+
+        self._bot_id = str(self.application.bot.id)
+        self._watermark = self._saved = await run_db(crud.get_update_offset, self._bot_id)
+        self._accepting = True
+        if url:
+            await self.application.bot.set_webhook(
+                url=url.rstrip("/") + WEBHOOK_PATH,
+                secret_token=self.secret,
+                allowed_updates=Update.ALL_TYPES,
+                # One delivery at a time keeps Telegram's order: a 503 holds back everything after it
+                # until the retry succeeds, so the watermark never skips an update that was refused.
+                # We only start a task per request, so this doesn't limit throughput.
+                max_connections=1,
+            )
+            print(f"Telegram webhook set to {url.rstrip('/')}{WEBHOOK_PATH} (last handled update {self._watermark})")
+        else:
+            print("WEBHOOK_URL not set, expecting the webhook to be registered already.")
+
+    async def stop(self):
+        # The webhook stays registered: Telegram's next delivery is what wakes a sleeping instance
+        self._accepting = False
+        if self._tasks:
+            _, unfinished = await asyncio.wait(set(self._tasks), timeout=WEBHOOK_DRAIN_TIMEOUT)
+            if unfinished:
+                print(f"Webhook updates not drained after {WEBHOOK_DRAIN_TIMEOUT}s, {len(unfinished)} updates dropped")
+                for task in unfinished:
+                    task.cancel()
+                await asyncio.gather(*unfinished, return_exceptions=True)
+        await self._save()
+
+    def check_secret(self, header: str | None) -> bool:
+        return header is not None and hmac.compare_digest(header, self.secret)
+
+    def submit(self, payload: dict) -> str:
+        """Returns "accepted", "duplicate" or "busy" (too many in flight / shutting down: answer 503)."""
+        update_id = payload.get("update_id")
+        if not isinstance(update_id, int):
+            return "duplicate"  # nothing to handle; acknowledge so Telegram doesn't retry it
+        if update_id <= self._watermark or update_id in self._seen:
+            self.duplicates += 1
+            return "duplicate"
+        if not self._accepting or len(self._pending) >= self.queue_size:
+            self.rejected += 1
+            return "busy"
+        sender = shard_key(payload)
+        task = asyncio.get_running_loop().create_task(
+            self._handle(update_id, payload, time.monotonic(), self._tails.get(sender)))
+        self._tails[sender] = task
+        self._tasks.add(task)
+        task.add_done_callback(lambda task: self._done(sender, task))
+        self._seen.add(update_id)
+        self._pending.add(update_id)
+        self.accepted += 1
+        return "accepted"
+
+    async def _handle(self, update_id: int, payload: dict, queued_at: float, previous: asyncio.Task | None):
+        from telegram import Update
+
+        if previous is not None:
+            self._waiting += 1
+            try:
+                await asyncio.wait({previous})  # only its order matters here, not how it ended
+            finally:
+                self._waiting -= 1
+        self.total_wait += time.monotonic() - queued_at
+        try:
+            await self.application.process_update(Update.de_json(payload, self.application.bot))
+            self.handled += 1
+        except Exception as e:
+            self.failed += 1
+            print(f"Error handling update {update_id}: {e}")
+        # Not reached when cancelled at shutdown: the watermark stays below it and Telegram redelivers
+        self._finish(update_id)
+
+    def _done(self, sender, task: asyncio.Task):
+        self._tasks.discard(task)
+        if self._tails.get(sender) is task:
+            del self._tails[sender]
+
+    def _finish(self, update_id: int):
+        self._pending.discard(update_id)
+        # Out-of-order completions only move the watermark up to the oldest update still running
+        watermark = min(self._pending) - 1 if self._pending else max(self._seen, default=self._watermark)
+        if watermark <= self._watermark:
+            return
+        self._watermark = watermark
+        self._seen = {seen for seen in self._seen if seen > watermark}
+        if self._save_task is None or self._save_task.done():
+            self._save_task = asyncio.get_running_loop().create_task(self._save())
+
+    async def _save(self):
+        # One writer at a time; keeps going while the watermark moved during the last write
+        while self._saved < self._watermark:
+            watermark = self._watermark
+            try:
+                await run_db(crud.save_update_offset, self._bot_id, watermark)
+            except Exception as e:
+                print(f"Error saving webhook offset: {e}")
+                return
+            self._saved = watermark
+
+    def depth(self) -> int:
+        return self._waiting
+
+    def stats(self) -> dict:
+        return {
+            "queued": self.depth(),
+            "in_flight": len(self._pending),
+            "accepted": self.accepted,
+            "duplicates": self.duplicates,
+            "rejected": self.rejected,
+            "handled": self.handled,
+            "failed": self.failed,
+            "avg_wait_ms": round(1000 * self.total_wait / self.handled, 1) if self.handled else 0.0,
+            "last_update_id": self._watermark,
+        }
@@ -0,0 +1,50 @@
+"""
+Cold-start timing: how long after the process launched the API was ready, and how long each
+startup phase took (imports, schema check, bot startup, first LLM SDK load). Served at
+GET /startup and as startup_* gauges in /metrics; a one-line summary is printed once
+the background phases finish.
+"""
+import os
+import time
+from contextlib import contextmanager
+
+_IMPORTED_AT = time.time()
+
+def _process_start() -> float:
+    """Wall-clock launch time of this process (Linux /proc); falls back to when this module was imported."""
+    try:
+        with open("/proc/self/stat") as f:
+            start_ticks = int(f.read().rsplit(")", 1)[1].split()[19])
+        with open("/proc/uptime") as f:
+            uptime = float(f.read().split()[0])
+        return time.time() - uptime + start_ticks / os.sysconf("SC_CLK_TCK")
+    except (OSError, ValueError, IndexError):
+        return _IMPORTED_AT
+
+PROCESS_START = _process_start()
+
+phases: dict[str, float] = {}  # phase -> duration in seconds
+marks: dict[str, float] = {}   # event -> seconds since process start
+
+def mark(name: str):
+    marks.setdefault(name, time.time() - PROCESS_START)
+
+@contextmanager
+def phase(name: str):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        phases[name] = time.perf_counter() - start
+
+def report() -> dict:
+    return {
+        "process_start": PROCESS_START,
+        "marks": {name: round(value, 3) for name, value in marks.items()},
+        "phases": {name: round(value, 3) for name, value in phases.items()},
+    }
+
+def log_summary():
+    parts = [f"{name} {value:.2f}s" for name, value in phases.items()]
+    ready = marks.get("ready")
+    print(f"Startup: ready {ready:.2f}s after launch; " + ", ".join(parts) if ready is not None else "Startup: " + ", ".join(parts))
@@ -0,0 +1,161 @@
+"""
+API benchmark: seeds a ledger with 10^5-10^6 rows, then hammers the read and write routes in-process
+(httpx over ASGI, no network) with concurrent clients.
+
+    cd backend
+    python -m benchmarks.bench_api                                   # 100k rows, SQLite
+    python -m benchmarks.bench_api --rows 1000000 --concurrency 32 --requests 2000
+    python -m benchmarks.bench_api --db postgresql://localhost/ledger_bench --rows 1000000
+    python -m benchmarks.bench_api --only stats,search,write
+
+The seeded database is reused while its row count matches --rows (use --reseed to force).
+Reports p50/p95/p99 latency, requests per second and SQL statements per request.
+"""
+import argparse
+import asyncio
+import random
+import time
+from datetime import datetime, timedelta
+
+from . import common
+
+CURRENCIES = [("CNY", 0.6), ("HKD", 0.35), ("USDT", 0.05)]
+CATEGORIES = ["餐饮", "交通", "购物", "居住", "娱乐", "医疗", "转账", "其他"]
+USERS = [("1001", "爸爸"), ("1002", "妈妈"), ("1003", "小明"), ("1004", "奶奶")]
+ITEMS = ["午饭", "打车", "超市", "房租", "电影", "买药", "转账给老王", "话费", "咖啡", "地铁"]
+SEED_BATCH = 10_000
+
+def seed(db_url: str, rows: int, months: int, reseed: bool):
+    from sqlalchemy import insert
+    from app import database, models, crud
+
+    database.init_db()
+    db = database.SessionLocal()
+    try:
+        existing = db.query(models.Transaction).count()
+        if existing == rows and not reseed:
+            print(f"Reusing {existing} seeded rows in {db_url}")
+            return
+        print(f"Seeding {rows} rows into {db_url} ...")
+        start = time.perf_counter()
+        db.query(models.Transaction).delete()
+        db.query(models.TransactionChange).delete()
+        rng = random.Random(42)
+        now = datetime.now()
+        span = timedelta(days=30 * months).total_seconds()
+        currencies, weights = zip(*CURRENCIES)
+        for offset in range(0, rows, SEED_BATCH):
+            batch = []
+            for _ in range(min(SEED_BATCH, rows - offset)):
+                user_id, user_name = rng.choice(USERS)
+                item = rng.choice(ITEMS)
+                amount = round(rng.lognormvariate(3.5, 1.0), 2)
+                batch.append({
+                    "user_id": user_id, "user_name": user_name, "amount": amount,
+                    "currency": rng.choices(currencies, weights)[0], "category": rng.choice(CATEGORIES),
+                    "item": item, "raw_text": f"{item} {amount}",
+                    "created_at": now - timedelta(seconds=rng.uniform(0, span)),
+                })
+            db.execute(insert(models.Transaction), batch)
+        db.commit()
+        rollups = crud.rebuild_rollups(db)
+        print(f"Seeded in {time.perf_counter() - start:.1f}s ({rollups} rollup rows)")
+    finally:
+        db.close()
+
+def scenarios(month: str) -> dict:
+    """name -> async fn(client, state) performing one request."""
+    async def list_month(client, state):
+        r = await client.get("/transactions/", params={"currency": "CNY", "month": month, "limit": 100})
+        state["cursor"] = r.headers.get("x-ledger-cursor", "0")
+        return r
+
+    async def list_all(client, state):
+        return await client.get("/transactions/", params={"limit": 100})
+
+    async def page_deep(client, state):
+        # Five pages in, the way "load more" walks the ledger
+        cursor = None
+        for _ in range(5):
+            r = await client.get("/transactions/page", params={"limit": 100, **({"cursor": cursor} if cursor else {})})
+            cursor = r.json()["next_cursor"]
+            if not cursor:
+                break
+        return r
+
+    async def stats(client, state):
+        return await client.get("/stats", params={"currency": "CNY", "month": month})
+
+    async def changes_idle(client, state):
+        cursor = state.get("cursor") or "0"
+        return await client.get("/transactions/changes", params={"since": cursor}, headers={"If-None-Match": f'"{cursor}"'})
+
+    async def search(client, state):
+        state["q"] = (state.get("q", 0) + 1) % len(ITEMS)
+        return await client.get("/transactions/search", params={"q": ITEMS[state["q"]], "limit": 20})
+
+    async def write(client, state):
+        return await client.post("/transactions/", json={
+            "user_id": "1001", "user_name": "爸爸", "amount": 12.5, "currency": "CNY",
+            "category": "餐饮", "item": "bench", "raw_text": "bench 12.5",
+        })
+
+    return {"list_month": list_month, "list_all": list_all, "page_deep": page_deep, "stats": stats,
+            "changes_idle": changes_idle, "search": search, "write": write}
+
+async def hammer(app, name: str, fn, requests: int, concurrency: int, counter) -> dict:
+    import httpx
+
+    latencies, errors = [], 0
+    state = {}
+    remaining = iter(range(requests))
+
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://bench") as client:
+        await fn(client, state)  # warm-up, also primes state["cursor"]
+
+        async def worker():
+            nonlocal errors
+            for _ in remaining:
+                start = time.perf_counter()
+                r = await fn(client, state)
+                latencies.append(time.perf_counter() - start)
+                errors += r.status_code >= 400
+
+        start = time.perf_counter()
+        with counter.measure() as queries:
+            await asyncio.gather(*(worker() for _ in range(concurrency)))
+        elapsed = time.perf_counter() - start
+    if errors:
+        print(f"{name}: {errors} error responses")
+    return common.summarize(name, latencies, elapsed, queries["queries"])
+
+async def run(args) -> list:
+    from app.main import app
+
+    counter = common.QueryCounter().install()
+    month = datetime.now().strftime("%Y-%m")
+    rows = []
+    for name, fn in scenarios(month).items():
+        if args.only and name not in args.only:
+            continue
+        rows.append(await hammer(app, name, fn, args.requests, args.concurrency, counter))
+    return rows
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=100_000)
+    parser.add_argument("--months", type=int, default=24, help="seeded rows are spread over this many months")
+    parser.add_argument("--requests", type=int, default=500, help="requests per scenario")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--db", default=None, help=f"database URL (default {common.DEFAULT_DB})")
+    parser.add_argument("--reseed", action="store_true")
+    parser.add_argument("--only", type=lambda s: s.split(","), default=None, help="comma-separated scenario names")
+    args = parser.parse_args()
+
+    common.configure_env(args.db)
+    db_url = args.db or common.DEFAULT_DB
+    seed(db_url, args.rows, args.months, args.reseed)
+    common.print_table(asyncio.run(run(args)))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,95 @@
+"""
+Bot hot-path benchmark: drives handle_message / handle_item_reply / handle_photo (through the job
+scheduler, as the Application does) with synthetic Updates against a local stub LLM.
+
+    cd backend
+    python -m benchmarks.bench_bot                              # 20 users x 10 expenses, 800ms LLM
+    python -m benchmarks.bench_bot --users 50 --flows 20 --latency-ms 1500 --photo-ratio 0.2
+    python -m benchmarks.bench_bot --db postgresql://localhost/ledger_bench
+
+Each flow is one expense message (or receipt photo) followed by the item reply that saves it.
+Reports per-handler p50/p95/p99, flows per second, stub LLM calls and SQL statements per update.
+"""
+import argparse
+import asyncio
+import random
+import time
+
+from . import common, fake_telegram
+from .stub_llm import StubConfig, start as start_stub
+
+# Confident messages take the rule fast path; the vague ones need the (stub) LLM
+CONFIDENT = ["午饭 45 港币", "打车 32 元", "星巴克 38 rmb", "地铁 6 块", "超市买菜 126.5 元", "mtr 12 hkd"]
+VAGUE = ["给老王 300", "今天那个 88", "还款 1200", "交了 45", "早餐 20\n地铁 6\n午饭 45 港币"]
+
+async def run_flow(handlers, bot, user_id: int, photo: bool, latencies: dict, rng: random.Random, seed: int):
+    if photo:
+        update = fake_telegram.photo_update(bot, user_id, fake_telegram.receipt_jpeg(seed))
+        name = "handle_photo"
+    else:
+        text = rng.choice(CONFIDENT if rng.random() < 0.6 else VAGUE)
+        update = fake_telegram.text_update(user_id, text)
+        name = "handle_message"
+    start = time.perf_counter()
+    await handlers[name](update, fake_telegram.context(bot))
+    latencies[name].append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    await handlers["handle_item_reply"](fake_telegram.text_update(user_id, "确认", reply=True), fake_telegram.context(bot))
+    latencies["handle_item_reply"].append(time.perf_counter() - start)
+
+async def run(args) -> list:
+    from app import database
+    from app.services import bot as bot_module
+
+    database.init_db()
+    counter = common.QueryCounter().install()
+    handlers = {
+        "handle_message": bot_module._scheduled("text", bot_module.handle_message),
+        "handle_photo": bot_module._scheduled("vision", bot_module.handle_photo),
+        "handle_item_reply": bot_module._scheduled("text", bot_module.handle_item_reply),
+    }
+    bot = fake_telegram.FakeBot()
+    latencies = {name: [] for name in handlers}
+    rng = random.Random(args.seed)
+
+    async def user(user_id: int):
+        for i in range(args.flows):
+            photo = rng.random() < args.photo_ratio
+            await run_flow(handlers, bot, user_id, photo, latencies, rng, seed=user_id * 10_000 + i)
+
+    start = time.perf_counter()
+    with counter.measure() as queries:
+        await asyncio.gather(*(user(1000 + u) for u in range(args.users)))
+    elapsed = time.perf_counter() - start
+    await bot_module.pending_states.flush()
+
+    updates = sum(len(v) for v in latencies.values())
+    rows = [common.summarize(name, values, elapsed) for name, values in latencies.items() if values]
+    rows.append(common.summarize("all updates", [v for values in latencies.values() for v in values],
+                                 elapsed, queries["queries"]))
+    print(f"{args.users} users x {args.flows} flows in {elapsed:.2f}s: {args.users * args.flows / elapsed:.1f} expenses/s, "
+          f"{updates} updates, {queries['queries']} SQL statements ({queries['queries'] / updates:.1f}/update)")
+    return rows
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=20)
+    parser.add_argument("--flows", type=int, default=10, help="expenses per user")
+    parser.add_argument("--photo-ratio", type=float, default=0.1)
+    parser.add_argument("--latency-ms", type=float, default=800)
+    parser.add_argument("--jitter-ms", type=float, default=200)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--db", default=None, help=f"database URL (default {common.DEFAULT_DB})")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    _, stub = start_stub(args.port, StubConfig(args.latency_ms, args.jitter_ms, args.error_rate))
+    common.configure_env(args.db, f"http://127.0.0.1:{args.port}/v1")
+    rows = asyncio.run(run(args))
+    print(f"stub LLM calls: {stub.requests}")
+    common.print_table(rows)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,145 @@
+"""
+Database engine profile benchmark: runs the same mixed workload once per DB_PROFILE, each in a fresh
+subprocess (engines are configured at import time), and compares them.
+
+    cd backend
+    python -m benchmarks.bench_db                                  # tuned vs basic, SQLite
+    python -m benchmarks.bench_db --writers 16 --readers 16 --ops 200
+    python -m benchmarks.bench_db --db postgresql://localhost/ledger_bench --profiles tuned,basic
+
+Workload per profile: async writers saving expenses through run_db (the API / bot path), async readers
+listing the month and reading /stats, and a few thread writers on the sync engine (the parse cache
+path). Reports latency percentiles, throughput and how many operations failed (on SQLite mostly
+"database is locked").
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+
+from . import common
+
+def _sqlite_file(db_url: str) -> str | None:
+    return db_url[len("sqlite:///"):] if db_url.startswith("sqlite:///") else None
+
+async def workload(args) -> dict:
+    from app import database, crud, models
+
+    database.init_db()
+    month = datetime.now().strftime("%Y-%m")
+    month_range = (datetime.strptime(month, "%Y-%m"), datetime.now().replace(year=datetime.now().year + 1))
+    latencies = {"write": [], "read": [], "stats": [], "thread_write": []}
+    errors = {name: 0 for name in latencies}
+    rng = random.Random(args.seed)
+
+    async def timed(name: str, fn, *fn_args):
+        start = time.perf_counter()
+        try:
+            await database.run_db(fn, *fn_args)
+        except Exception as e:
+            errors[name] += 1
+            if errors[name] == 1:
+                print(f"{name} error: {e}", file=sys.stderr)
+            return
+        latencies[name].append(time.perf_counter() - start)
+
+    async def writer(n: int):
+        for i in range(args.ops):
+            await timed("write", crud.create_transaction, {
+                "user_id": str(1000 + n), "user_name": f"bench{n}", "amount": round(rng.uniform(1, 300), 2),
+                "currency": "CNY", "category": "餐饮", "item": "bench", "raw_text": f"bench {i}",
+            })
+
+    async def reader(n: int):
+        for i in range(args.ops):
+            if i % 4 == 0:
+                await timed("stats", crud.get_stats, crud.DEFAULT_LEDGER, "CNY", month)
+            else:
+                await timed("read", crud.list_transactions, crud.DEFAULT_LEDGER, 0, 100, "CNY", month_range)
+
+    stop = threading.Event()
+
+    def thread_writer(n: int):
+        # Sync-engine writes from worker threads, like the parse cache; they bypass run_db's write lock
+        i = 0
+        while not stop.is_set():
+            start = time.perf_counter()
+            db = database.SessionLocal()
+            try:
+                db.merge(models.ParseCacheEntry(key=f"bench-{n}-{i % 50}", namespace="bench", template="bench",
+                                                result={"i": i}))
+                db.commit()
+                latencies["thread_write"].append(time.perf_counter() - start)
+            except Exception as e:
+                db.rollback()
+                errors["thread_write"] += 1
+                if errors["thread_write"] == 1:
+                    print(f"thread_write error: {e}", file=sys.stderr)
+            finally:
+                db.close()
+            i += 1
+            time.sleep(0.005)
+
+    threads = [threading.Thread(target=thread_writer, args=(n,), daemon=True) for n in range(args.thread_writers)]
+    start = time.perf_counter()
+    for t in threads:
+        t.start()
+    await asyncio.gather(*(writer(n) for n in range(args.writers)), *(reader(n) for n in range(args.readers)))
+    elapsed = time.perf_counter() - start
+    stop.set()
+    for t in threads:
+        t.join()
+
+    rows = [common.summarize(name, values, elapsed) for name, values in latencies.items()]
+    for row in rows:
+        row["errors"] = errors[row["name"]]
+    return {"elapsed": elapsed, "rows": rows}
+
+def run_profile(profile: str, args) -> dict:
+    db_url = args.db or "sqlite:///" + os.path.join(tempfile.gettempdir(), f"family_ledger_bench_{profile}.db")
+    path = _sqlite_file(db_url)
+    if path:
+        for suffix in ("", "-wal", "-shm"):
+            if os.path.exists(path + suffix):
+                os.remove(path + suffix)
+    env = dict(os.environ, DB_PROFILE=profile, DATABASE_URL=db_url)
+    cmd = [sys.executable, "-m", "benchmarks.bench_db", "--worker",
+           "--writers", str(args.writers), "--readers", str(args.readers), "--ops", str(args.ops),
+           "--thread-writers", str(args.thread_writers), "--seed", str(args.seed)]
+    proc = subprocess.run(cmd, env=env, stdout=subprocess.PIPE, cwd=os.path.dirname(os.path.dirname(__file__)))
+    if proc.returncode != 0:
+        raise SystemExit(f"profile {profile} failed (exit {proc.returncode})")
+    return json.loads(proc.stdout.decode().strip().splitlines()[-1])
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--profiles", type=lambda s: s.split(","), default=["tuned", "basic"])
+    parser.add_argument("--writers", type=int, default=8)
+    parser.add_argument("--readers", type=int, default=8)
+    parser.add_argument("--ops", type=int, default=100, help="operations per async writer / reader")
+    parser.add_argument("--thread-writers", type=int, default=2)
+    parser.add_argument("--db", default=None, help="database URL (default: a fresh SQLite file per profile)")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--worker", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        common.configure_env(os.environ["DATABASE_URL"])
+        result = asyncio.run(workload(args))
+        print(json.dumps(result))
+        return
+
+    for profile in args.profiles:
+        result = run_profile(profile, args)
+        print(f"\nDB_PROFILE={profile} ({result['elapsed']:.2f}s)")
+        common.print_table([dict(row, name=f"{row['name']} ({row['errors']} errors)") for row in result["rows"]])
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,118 @@
+"""
+LLM routing benchmark: sends every message of a labelled corpus through llm._routed (the rule
+fast path and parse cache are skipped) once per route, and compares accuracy, tokens and latency.
+
+    cd backend
+    python -m benchmarks.bench_llm                          # local stub LLM, 800ms per call
+    python -m benchmarks.bench_llm --live                   # the configured provider (costs tokens)
+    python -m benchmarks.bench_llm --routes single,tiered --corpus my_messages.jsonl
+
+Corpus rows are {"text", "amount", "currency", "category"} (see rules_corpus.jsonl). Per route:
+accuracy on amount/currency/category, escalation rate, prompt / cached / completion tokens per
+message and per-message latency, plus usage_log's per-model breakdown.
+"""
+import argparse
+import asyncio
+import json
+import os
+import time
+
+from . import common
+from .stub_llm import StubConfig, start as start_stub
+
+CORPUS = os.path.join(os.path.dirname(__file__), "rules_corpus.jsonl")
+FIELDS = ("amount", "currency", "category")
+
+def load_corpus(path: str) -> list:
+    with open(path, encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+def _correct(parsed, row: dict) -> bool:
+    if not isinstance(parsed, dict):
+        return False
+    try:
+        return abs(float(parsed.get("amount")) - float(row["amount"])) < 1e-6 and all(
+            parsed.get(k) == row[k] for k in FIELDS[1:])
+    except (TypeError, ValueError):
+        return False
+
+async def run_route(llm, route: str, corpus: list, concurrency: int) -> dict:
+    llm.LLM_ROUTING = route
+    llm.usage_log.reset()
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies, correct, errors = [], 0, 0
+
+    async def one(row):
+        nonlocal correct, errors
+        text = row["text"]
+        async with semaphore:
+            start = time.perf_counter()
+            try:
+                content = await llm._routed("text", llm._text_messages(text, llm.COMPACT_PROMPT),
+                                            llm._text_messages(text), llm._check_text(text), llm.LLM_TEXT_TIMEOUT)
+            except Exception as e:
+                errors += 1
+                print(f"  {route}: {text!r} failed: {e!r}")
+                return
+            latencies.append(time.perf_counter() - start)
+            correct += _correct(llm._decode(content), row)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(one(row) for row in corpus))
+    elapsed = time.perf_counter() - start
+
+    stats = llm.usage_log.stats()
+    n = len(corpus)
+    totals = {key: sum(r[key] for r in stats["routes"]) for key in ("prompt_tokens", "cached_tokens", "completion_tokens")}
+    fast_calls = sum(r["calls"] for r in stats["routes"] if r["stage"] == "fast")
+    return {
+        "summary": common.summarize(route, latencies, elapsed),
+        "accuracy": correct / n,
+        "errors": errors,
+        "escalation_rate": sum(stats["escalations"].values()) / fast_calls if fast_calls else None,
+        "escalations": stats["escalations"],
+        "per_message": {key: value / n for key, value in totals.items()},
+        "routes": stats["routes"],
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--corpus", default=CORPUS)
+    parser.add_argument("--routes", default="single,tiered")
+    parser.add_argument("--live", action="store_true", help="use the configured provider instead of the stub")
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--latency-ms", type=float, default=800)
+    parser.add_argument("--jitter-ms", type=float, default=200)
+    parser.add_argument("--port", type=int, default=8765)
+    args = parser.parse_args()
+
+    if not args.live:
+        start_stub(args.port, StubConfig(args.latency_ms, args.jitter_ms))
+        common.configure_env(llm_url=f"http://127.0.0.1:{args.port}/v1")
+    from app.services import llm
+
+    corpus = load_corpus(args.corpus)
+
+    async def run_all():
+        # One event loop for all routes: llm_client's connections belong to it
+        return [await run_route(llm, route, corpus, args.concurrency) for route in args.routes.split(",")]
+
+    results = asyncio.run(run_all())
+
+    common.print_table([r["summary"] for r in results])
+    print()
+    print(f"{'route':<10}{'accuracy':>10}{'escalated':>11}{'prompt/msg':>12}{'cached/msg':>12}{'compl/msg':>11}{'errors':>8}")
+    for r in results:
+        per = r["per_message"]
+        escalated = f"{r['escalation_rate']:.1%}" if r["escalation_rate"] is not None else "-"
+        print(f"{r['summary']['name']:<10}{r['accuracy']:>10.1%}{escalated:>11}{per['prompt_tokens']:>12.0f}"
+              f"{per['cached_tokens']:>12.0f}{per['completion_tokens']:>11.0f}{r['errors']:>8}")
+    for r in results:
+        print(f"\n{r['summary']['name']}: escalations {r['escalations'] or '{}'}")
+        for route in r["routes"]:
+            print(f"  {route['stage']:<5} {route['model']:<16} calls={route['calls']:<4} "
+                  f"prompt={route['prompt_tokens']:<7} cached={route['cached_tokens']:<7} "
+                  f"completion={route['completion_tokens']:<6} avg={route['avg_latency_ms']}ms")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,104 @@
+"""
+Rule-engine fast path benchmark.
+
+    cd backend
+    python -m benchmarks.bench_rules                  # labels from rules_corpus.jsonl
+    python -m benchmarks.bench_rules --live           # compare against live LLM parses instead
+    python -m benchmarks.bench_rules --threshold 0.7 --llm-ms 1800
+
+Reports how many messages take the fast path, how often the fast path agrees with the
+LLM labels on amount/currency/category, and the LLM latency that saves.
+"""
+import argparse
+import asyncio
+import json
+import os
+import time
+
+from app.services import rules
+
+CORPUS = os.path.join(os.path.dirname(__file__), "rules_corpus.jsonl")
+FIELDS = ("amount", "currency", "category")
+
+def load_corpus(path: str) -> list:
+    with open(path, encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+def live_labels(corpus: list) -> tuple[list, float]:
+    """Label the corpus with the real LLM (through the app's async client); returns (labels, mean latency in ms)."""
+    from app.services import llm
+
+    if llm.llm_client is None:
+        raise SystemExit("--live needs OPENAI_API_KEY")
+
+    async def label() -> tuple[list, float]:
+        labels, elapsed = [], 0.0
+        for row in corpus:
+            start = time.perf_counter()
+            response = await llm.llm_client.chat(
+                llm.LLM_TEXT_TIMEOUT,
+                model=llm.TEXT_MODEL,
+                messages=[{"role": "system", "content": llm.SYSTEM_PROMPT}, {"role": "user", "content": row["text"]}],
+                response_format={"type": "json_object"},
+            )
+            elapsed += time.perf_counter() - start
+            parsed = json.loads(response.choices[0].message.content)
+            labels.append({"text": row["text"], **{k: parsed.get(k) for k in FIELDS}})
+        return labels, elapsed / len(corpus) * 1000
+
+    return asyncio.run(label())
+
+def run(corpus: list, threshold: float, llm_ms: float) -> dict:
+    hits = correct_hits = correct_all = 0
+    rule_ns = 0
+    mismatches = []
+    for row in corpus:
+        start = time.perf_counter_ns()
+        result = rules.parse(row["text"])
+        rule_ns += time.perf_counter_ns() - start
+
+        ok = bool(result) and all(
+            (abs(result[k] - float(row[k])) < 1e-9) if k == "amount" else result[k] == row[k] for k in FIELDS
+        )
+        correct_all += ok
+        if result and result["confidence"] >= threshold:
+            hits += 1
+            correct_hits += ok
+            if not ok:
+                mismatches.append((row["text"], {k: result[k] for k in FIELDS}, {k: row[k] for k in FIELDS}))
+
+    n = len(corpus)
+    return {
+        "messages": n,
+        "threshold": threshold,
+        "fast_path_hit_rate": hits / n,
+        "fast_path_accuracy": correct_hits / hits if hits else 0.0,
+        "rule_accuracy_all": correct_all / n,
+        "rule_latency_us": rule_ns / n / 1000,
+        "llm_latency_ms": llm_ms,
+        "latency_saved_ms_per_message": hits / n * llm_ms,
+        "fast_path_mismatches": mismatches,
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--corpus", default=CORPUS)
+    parser.add_argument("--threshold", type=float, default=rules.RULES_CONFIDENCE_THRESHOLD)
+    parser.add_argument("--llm-ms", type=float, default=1500.0, help="assumed LLM latency when not --live")
+    parser.add_argument("--live", action="store_true", help="label with the configured LLM and measure its latency")
+    args = parser.parse_args()
+
+    corpus = load_corpus(args.corpus)
+    llm_ms = args.llm_ms
+    if args.live:
+        corpus, llm_ms = live_labels(corpus)
+
+    report = run(corpus, args.threshold, llm_ms)
+    mismatches = report.pop("fast_path_mismatches")
+    for key, value in report.items():
+        print(f"{key:32} {value:.3f}" if isinstance(value, float) else f"{key:32} {value}")
+    for text, got, want in mismatches:
+        print(f"  mismatch: {text!r} rules={got} llm={want}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,87 @@
+"""Shared helpers for the benchmark scripts: latency summaries, query counting, env setup."""
+import os
+import tempfile
+import time
+from contextlib import contextmanager
+
+DEFAULT_DB = "sqlite:///" + os.path.join(tempfile.gettempdir(), "family_ledger_bench.db")
+
+def configure_env(db_url: str | None = None, llm_url: str | None = None):
+    """Point the app at the benchmark database / stub LLM. Must run before anything imports `app`."""
+    os.environ["DATABASE_URL"] = db_url or DEFAULT_DB
+    if llm_url:
+        os.environ["OPENAI_BASE_URL"] = llm_url
+        os.environ["OPENAI_API_KEY"] = "bench"
+        os.environ.pop("DASHSCOPE_API_KEY", None)
+    elif not (os.getenv("OPENAI_API_KEY") or os.getenv("DASHSCOPE_API_KEY")):
+        os.environ["OPENAI_API_KEY"] = "bench"  # the API benchmarks never reach the LLM
+    os.environ.setdefault("TELEGRAM_BOT_TOKEN", "")  # never start the real bot
+
+def percentile(sorted_values: list, p: float) -> float:
+    if not sorted_values:
+        return 0.0
+    k = (len(sorted_values) - 1) * p / 100
+    lo = int(k)
+    hi = min(lo + 1, len(sorted_values) - 1)
+    return sorted_values[lo] + (sorted_values[hi] - sorted_values[lo]) * (k - lo)
+
+def summarize(name: str, latencies: list, elapsed: float, queries: int = 0) -> dict:
+    """latencies in seconds; elapsed is the wall time of the whole run."""
+    values = sorted(latencies)
+    n = len(values)
+    return {
+        "name": name,
+        "n": n,
+        "p50_ms": percentile(values, 50) * 1000,
+        "p95_ms": percentile(values, 95) * 1000,
+        "p99_ms": percentile(values, 99) * 1000,
+        "max_ms": (values[-1] if values else 0.0) * 1000,
+        "rps": n / elapsed if elapsed else 0.0,
+        "queries_per_op": queries / n if n else 0.0,
+    }
+
+def print_table(rows: list):
+    header = f"{'benchmark':<34}{'n':>7}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'max ms':>10}{'ops/s':>10}{'q/op':>7}"
+    print(header)
+    print("-" * len(header))
+    for r in rows:
+        print(f"{r['name']:<34}{r['n']:>7}{r['p50_ms']:>10.1f}{r['p95_ms']:>10.1f}{r['p99_ms']:>10.1f}"
+              f"{r['max_ms']:>10.1f}{r['rps']:>10.1f}{r['queries_per_op']:>7.1f}")
+
+class QueryCounter:
+    """Counts SQL statements on the app's engines (sync and async) via SQLAlchemy events."""
+
+    def __init__(self):
+        self.count = 0
+
+    def install(self):
+        from sqlalchemy import event
+        from app import database
+
+        engines = [database.engine]
+        if database.async_engine is not None:
+            engines.append(database.async_engine.sync_engine)
+        for engine in engines:
+            event.listen(engine, "before_cursor_execute", self._on_execute)
+        return self
+
+    def _on_execute(self, conn, cursor, statement, parameters, context, executemany):
+        self.count += 1
+
+    @contextmanager
+    def measure(self):
+        """with counter.measure() as m: ...; m["queries"] afterwards."""
+        result = {"queries": 0}
+        start = self.count
+        try:
+            yield result
+        finally:
+            result["queries"] = self.count - start
+
+class Timer:
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.elapsed = time.perf_counter() - self.start
@@ -0,0 +1,83 @@
+"""Synthetic Telegram Updates and a bot double that records what would have been sent."""
+import io
+import itertools
+import random
+from types import SimpleNamespace
+
+from telegram import Update
+
+_ids = itertools.count(1)
+
+class FakeFile:
+    def __init__(self, data: bytes):
+        self.data = data
+
+    async def download_as_bytearray(self):
+        return bytearray(self.data)
+
+class FakeBot:
+    """Stands in for telegram.Bot: no network, counts calls, serves photo bytes by file_id."""
+
+    def __init__(self):
+        self.sent = 0
+        self.edited = 0
+        self.files: dict[str, bytes] = {}
+        self.last_text: dict[int, str] = {}
+
+    async def send_message(self, chat_id, text, **kwargs):
+        self.sent += 1
+        self.last_text[chat_id] = text
+        return SimpleNamespace(message_id=next(_ids), chat_id=chat_id, text=text)
+
+    async def edit_message_text(self, text, chat_id=None, message_id=None, **kwargs):
+        self.edited += 1
+        self.last_text[chat_id] = text
+        return True
+
+    async def get_file(self, file_id):
+        return FakeFile(self.files[file_id])
+
+def context(bot: FakeBot, args: list | None = None):
+    return SimpleNamespace(bot=bot, args=args or [])
+
+def _message(user_id: int, **fields) -> dict:
+    user = {"id": user_id, "is_bot": False, "first_name": f"user{user_id}"}
+    return {
+        "message_id": next(_ids),
+        "date": 0,
+        "chat": {"id": user_id, "type": "private"},
+        "from": user,
+        **fields,
+    }
+
+def text_update(user_id: int, text: str, reply: bool = False) -> Update:
+    fields = {"text": text}
+    if reply:
+        fields["reply_to_message"] = _message(user_id, text="预览")
+    return Update.de_json({"update_id": next(_ids), "message": _message(user_id, **fields)}, None)
+
+def photo_update(bot: FakeBot, user_id: int, image: bytes, width: int = 1280, height: int = 1707) -> Update:
+    """A photo message offering the usual Telegram thumbnails; all sizes download the same bytes."""
+    unique = f"photo{next(_ids)}"
+    sizes = []
+    for scale in (0.0703, 0.25, 0.625, 1.0):
+        file_id = f"{unique}-{scale}"
+        bot.files[file_id] = image
+        sizes.append({"file_id": file_id, "file_unique_id": file_id,
+                      "width": round(width * scale), "height": round(height * scale)})
+    return Update.de_json({"update_id": next(_ids), "message": _message(user_id, photo=sizes)}, None)
+
+def receipt_jpeg(seed: int, width: int = 1280, height: int = 1707) -> bytes:
+    """A noisy, receipt-sized JPEG; different seeds give perceptually different images."""
+    from PIL import Image, ImageDraw
+
+    rng = random.Random(seed)
+    image = Image.new("RGB", (width, height), "white")
+    draw = ImageDraw.Draw(image)
+    for _ in range(60):
+        x, y = rng.randrange(width), rng.randrange(height)
+        shade = rng.randrange(256)
+        draw.rectangle([x, y, x + rng.randrange(40, 400), y + rng.randrange(10, 120)], fill=(shade, shade, shade))
+    out = io.BytesIO()
+    image.save(out, format="JPEG", quality=90)
+    return out.getvalue()
@@ -0,0 +1,109 @@
+"""
+Local OpenAI-compatible stub for benchmarks: answers /chat/completions after a configurable delay.
+
+    python -m benchmarks.stub_llm --port 8765 --latency-ms 800 --jitter-ms 200 --error-rate 0.05
+
+Text requests get the rule parser's answer for the user message (several expenses when the
+message is a list), vision requests a fixed receipt; the rule confidence is passed on when the
+system prompt asks for one (llm.COMPACT_PROMPT). Responses include token usage (about two
+characters per token), with the system prompt reported as cached once it has been seen for the
+model and is at least --cache-min-tokens long, like a provider prefix cache.
+"""
+import argparse
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from app.services import rules
+
+class StubConfig:
+    def __init__(self, latency_ms: float = 800, jitter_ms: float = 0, error_rate: float = 0.0,
+                 cache_min_tokens: int = 1024):
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.error_rate = error_rate
+        self.cache_min_tokens = cache_min_tokens
+        self.requests = 0
+        self.prefixes = set()  # (model, system prompt) seen so far
+
+def _answer(body: dict) -> dict:
+    user = body["messages"][-1]["content"]
+    if isinstance(user, list):  # vision: [{"type": "text"}, {"type": "image_url"}]
+        return {"is_expense": True, "amount": 88.5, "currency": "HKD", "category": "餐饮", "item": "茶餐厅"}
+    wants_confidence = "confidence" in body["messages"][0]["content"]
+    segments = rules.split_expenses(user)
+    parsed = [rules.parse(seg) or {"is_expense": False} for seg in segments]
+    for p in parsed:
+        if not wants_confidence:
+            p.pop("confidence", None)
+    return {"expenses": parsed} if len(parsed) > 1 else parsed[0]
+
+def make_handler(config: StubConfig):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, *args):
+            pass
+
+        def do_POST(self):
+            body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+            config.requests += 1
+            delay = config.latency_ms + random.uniform(-config.jitter_ms, config.jitter_ms)
+            time.sleep(max(delay, 0) / 1000)
+            if random.random() < config.error_rate:
+                self._send(503, {"error": {"message": "stub overloaded"}})
+                return
+            content = json.dumps(_answer(body), ensure_ascii=False)
+            prompt_tokens = sum(len(str(m["content"])) for m in body["messages"]) // 2
+            prefix = (body["model"], body["messages"][0]["content"])
+            prefix_tokens = len(prefix[1]) // 2
+            cached = prefix_tokens if prefix in config.prefixes and prefix_tokens >= config.cache_min_tokens else 0
+            config.prefixes.add(prefix)
+            self._send(200, {
+                "id": f"stub-{config.requests}",
+                "object": "chat.completion",
+                "created": int(time.time()),
+                "model": body["model"],
+                "choices": [{"index": 0, "finish_reason": "stop", "message": {"role": "assistant", "content": content}}],
+                "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": len(content) // 2,
+                          "total_tokens": prompt_tokens + len(content) // 2,
+                          "prompt_tokens_details": {"cached_tokens": cached}},
+            })
+
+        def _send(self, status: int, payload: dict):
+            data = json.dumps(payload).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+    return Handler
+
+def start(port: int = 8765, config: StubConfig | None = None) -> tuple[ThreadingHTTPServer, StubConfig]:
+    """Start in a daemon thread; returns (server, config). Base URL: http://127.0.0.1:<port>/v1"""
+    config = config or StubConfig()
+    server = ThreadingHTTPServer(("127.0.0.1", port), make_handler(config))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, config
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency-ms", type=float, default=800)
+    parser.add_argument("--jitter-ms", type=float, default=0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--cache-min-tokens", type=int, default=1024)
+    args = parser.parse_args()
+    server, _ = start(args.port, StubConfig(args.latency_ms, args.jitter_ms, args.error_rate, args.cache_min_tokens))
+    print(f"Stub LLM on http://127.0.0.1:{args.port}/v1 ({args.latency_ms}ms ± {args.jitter_ms}ms)")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
+
+if __name__ == "__main__":
+    main()
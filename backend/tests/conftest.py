@@ -0,0 +1,54 @@
+"""
+Shared fixtures. The app reads its configuration when `app` is first imported, so the environment
+is set here, before any test module imports it: a throwaway SQLite file, a dummy LLM key (no call
+ever reaches a provider) and no Telegram bot.
+"""
+import asyncio
+import os
+import tempfile
+
+_tmp = tempfile.mkdtemp(prefix="family_ledger_test_")
+os.environ["DATABASE_URL"] = "sqlite:///" + os.path.join(_tmp, "test.db")
+os.environ["OPENAI_API_KEY"] = "test"
+os.environ.pop("DASHSCOPE_API_KEY", None)
+os.environ["TELEGRAM_BOT_TOKEN"] = ""
+os.environ["BOT_STATE_STORE"] = "memory"
+os.environ["LLM_CACHE_DB"] = "0"
+
+import pytest
+
+from app import database, models
+
+@pytest.fixture(scope="session")
+def engine():
+    database.init_db()
+    return database.engine
+
+@pytest.fixture
+def db(engine):
+    """A session on the test database; every table a test may write to is emptied afterwards."""
+    session = database.SessionLocal()
+    yield session
+    session.rollback()
+    for table in (models.TransactionChange, models.MonthlyRollup, models.Transaction, models.Ledger,
+                  models.BotOffset, models.BotState):
+        session.query(table).delete()
+    session.commit()
+    session.close()
+
+@pytest.fixture(scope="session")
+def loop():
+    # One loop for the whole run: the async engine's pooled connections and the SQLite write
+    # lock belong to the loop that first used them
+    loop = asyncio.new_event_loop()
+    yield loop
+    loop.close()
+
+@pytest.fixture
+def run(loop):
+    return loop.run_until_complete
+
+def tx(amount=10.0, currency="CNY", category="餐饮", item="午饭", user_id="1", user_name="A", **fields) -> dict:
+    """Row for crud.create_transactions."""
+    return dict(amount=amount, currency=currency, category=category, item=item, user_id=user_id,
+                user_name=user_name, **fields)
@@ -0,0 +1,80 @@
+import asyncio
+
+from app import crud, models
+from app.services import bot
+from benchmarks import fake_telegram
+from conftest import tx
+
+SINGLE = {"amount": 38.0, "currency": "CNY", "category": "餐饮", "item": "星巴克"}
+MULTI = {"expenses": [
+    {"amount": 20.0, "currency": "CNY", "category": "餐饮", "item": "早餐"},
+    {"amount": 6.0, "currency": "CNY", "category": "交通", "item": "地铁"},
+]}
+
+def test_confirm_keeps_recognised_items():
+    assert bot._reply_items(SINGLE, "确认") == ["星巴克"]
+    assert bot._reply_items(SINGLE, " 确认 ") == ["星巴克"]
+    assert bot._reply_items(MULTI, "确认") == ["早餐", "地铁"]
+    assert bot._reply_items(MULTI, "") == ["早餐", "地铁"]
+
+def test_reply_names_the_items():
+    assert bot._reply_items(SINGLE, "和同事喝咖啡") == ["和同事喝咖啡"]
+    assert bot._reply_items(MULTI, "包子\n\n  上班地铁 \n") == ["包子", "上班地铁"]
+
+def test_line_count_mismatch_is_rejected():
+    assert bot._reply_items(MULTI, "只有一行") is None
+    assert bot._reply_items(MULTI, "一\n二\n三") is None
+
+def _pending(update, results):
+    user = update.effective_user
+    return bot._pending_state(str(user.id), user.first_name, results, "早餐 20\n地铁 6")
+
+def test_save_pending_confirm_stores_recognised_item(db, run):
+    fake = fake_telegram.FakeBot()
+    update = fake_telegram.text_update(101, "确认", reply=True)
+    run(bot._save_pending(update, fake_telegram.context(fake), _pending(update, [SINGLE]), "确认"))
+    assert [t.item for t in db.query(models.Transaction)] == ["星巴克"]
+
+def test_save_pending_mismatch_reprompts_without_saving(db, run):
+    fake = fake_telegram.FakeBot()
+    update = fake_telegram.text_update(102, "只有一行", reply=True)
+    data = _pending(update, MULTI["expenses"])
+    run(bot._save_pending(update, fake_telegram.context(fake), data, "只有一行"))
+    assert db.query(models.Transaction).count() == 0
+    assert "2 行" in fake.last_text[102]
+    # Still pending, so a correct reply saves both
+    assert bot.get_state(bot.state_key(update)) == data
+    run(bot._save_pending(update, fake_telegram.context(fake), data, "包子\n地铁"))
+    assert sorted(t.item for t in db.query(models.Transaction)) == ["包子", "地铁"]
+
+def _group_update(chat_id: int, user_id: int, text: str):
+    message = fake_telegram._message(user_id, text=text)
+    message["chat"] = {"id": chat_id, "type": "group", "title": f"group{chat_id}"}
+    if text.startswith("/"):
+        message["entities"] = [{"type": "bot_command", "offset": 0, "length": len(text)}]
+    return fake_telegram.Update.de_json({"update_id": 1, "message": message}, None)
+
+def test_undo_cancels_only_this_chats_recognition(db, run, monkeypatch):
+    async def slow_parse(text):
+        await asyncio.sleep(1)
+        return [dict(SINGLE)]
+    monkeypatch.setattr(bot, "parse_expenses_text_async", slow_parse)
+    crud.create_transactions(db, [tx(ledger_id="-1", user_id="7"), tx(ledger_id="-2", user_id="7")])
+    fake = fake_telegram.FakeBot()
+    handle = bot._scheduled("text", bot.handle_message)
+
+    async def scenario():
+        in_a = asyncio.ensure_future(handle(_group_update(-1, 7, "那个 88"), fake_telegram.context(fake)))
+        await asyncio.sleep(0.01)
+        # /undo in the other chat undoes that chat's record and leaves chat -1's job alone
+        await bot.undo(_group_update(-2, 7, "/undo"), fake_telegram.context(fake))
+        assert fake.last_text[-2].startswith("已撤回记录")
+        assert not in_a.done()
+        await bot.undo(_group_update(-1, 7, "/undo"), fake_telegram.context(fake))
+        assert fake.last_text[-1] == "已取消 1 条正在识别的消息；已保存的记录未撤回，如需撤回请再发送 /undo"
+        await in_a
+        await asyncio.sleep(0.01)  # the on_cancel callback edits the status message
+
+    run(scenario())
+    assert fake.last_text[-1] == "🚫 已取消识别"
+    assert sorted(t.ledger_id for t in db.query(models.Transaction)) == ["-1"]  # chat -1's record is kept
@@ -0,0 +1,77 @@
+import io
+
+import pytest
+
+from app.services import imaging
+from app.services.imaging import ReceiptCache
+
+pytest.importorskip("PIL")
+
+def _receipt(total: float) -> bytes:
+    """Same shop, same layout, different amounts."""
+    from PIL import Image, ImageDraw
+
+    image = Image.new("RGB", (600, 1000), "white")
+    draw = ImageDraw.Draw(image)
+    draw.rectangle([40, 40, 560, 140], fill=(30, 30, 30))
+    for row in range(12):
+        draw.text((60, 200 + row * 50), f"ITEM {row:02d}   {total * (row + 1) % 97:>6.2f}", fill="black")
+    draw.text((60, 860), f"TOTAL {total:.2f}", fill="black")
+    out = io.BytesIO()
+    image.save(out, format="JPEG")
+    return out.getvalue()
+
+RESULT = {"is_expense": True, "amount": 38.0, "currency": "CNY", "category": "餐饮", "item": "午饭"}
+
+def test_exact_keys_are_scoped_to_the_ledger():
+    cache = ReceiptCache()
+    cache.put("A", RESULT, "file1", "digest1", 0b1011)
+    assert cache.get("A", "file1") == RESULT
+    assert cache.get("B", "file1") is None
+    assert cache.get("B", "other", "digest1") is None
+    # A digest hit learns the new file id, so the next re-send skips the download
+    assert cache.get("A", "file2", "digest1") == RESULT
+    assert cache.get("A", "file2") == RESULT
+    assert cache.stats() == {"entries": 1, "hits": 3, "misses": 2, "similar": 0}
+
+def test_near_hash_is_flagged_not_reused():
+    cache = ReceiptCache(max_distance=6)
+    cache.put("A", RESULT, "file1", "digest1", 0)
+    assert cache.get("A", "file2", "digest2") is None
+    assert cache.has_similar("A", 0b111111)
+    assert not cache.has_similar("A", 0b1111111)
+    assert not cache.has_similar("B", 0)
+    assert not cache.has_similar("A", None)
+
+def test_eviction_drops_every_key_of_a_receipt():
+    cache = ReceiptCache(max_entries=1)
+    cache.put("A", RESULT, "file1", "digest1", 1)
+    cache.get("A", "file1b", "digest1")
+    cache.put("A", {**RESULT, "amount": 5.0}, "file2", "digest2", 2 ** 64 - 1)
+    assert cache.get("A", "file1") is None and cache.get("A", "file1b") is None
+    assert not cache.has_similar("A", 1)
+    assert cache.get("A", "file2")["amount"] == 5.0
+    assert cache.stats()["entries"] == 1
+
+def test_template_receipts_share_a_hash_but_not_a_result(run, monkeypatch):
+    first, second = _receipt(38), _receipt(52)
+    assert imaging.prepare_image(first)[1] == imaging.prepare_image(second)[1]
+    parsed = []
+
+    async def parse(image):
+        parsed.append(image)
+        return {**RESULT, "amount": float(len(parsed))}
+    monkeypatch.setattr(imaging, "parse_expense_image_async", parse)
+    monkeypatch.setattr(imaging, "receipt_cache", ReceiptCache())
+
+    async def download(data):
+        return data
+
+    one = run(imaging.parse_receipt(lambda: download(first), "A", "f1"))
+    two = run(imaging.parse_receipt(lambda: download(second), "A", "f2"))
+    again = run(imaging.parse_receipt(lambda: download(first), "A", "f3"))
+    other_ledger = run(imaging.parse_receipt(lambda: download(first), "B", "f1"))
+    assert one == ({**RESULT, "amount": 1.0}, "")
+    assert two == ({**RESULT, "amount": 2.0}, "similar")
+    assert again == ({**RESULT, "amount": 1.0}, "same")
+    assert other_ledger == ({**RESULT, "amount": 3.0}, "")
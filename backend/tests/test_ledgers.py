@@ -0,0 +1,58 @@
+from fastapi.testclient import TestClient
+
+from app import crud, main, models
+from app.database import SessionLocal
+from app.services import bot
+from benchmarks import fake_telegram
+from conftest import tx
+
+def test_first_writes_to_a_new_ledger_race_without_failing(db, monkeypatch):
+    # Another member's first message created the ledger after this write looked it up
+    other = SessionLocal()
+    other.add(models.Ledger(id="-100", name="家"))
+    other.commit()
+    other.close()
+    get = db.get
+    monkeypatch.setattr(db, "get", lambda model, key, **kwargs: None if model is models.Ledger else get(model, key, **kwargs))
+    crud.create_transactions(db, [tx(ledger_id="-100")], "家")
+    monkeypatch.undo()
+    assert db.query(models.Ledger).filter_by(id="-100").count() == 1
+    assert db.query(models.Transaction).filter_by(ledger_id="-100").count() == 1
+
+def test_ledger_name_follows_the_chat_title(db):
+    crud.create_transactions(db, [tx(ledger_id="-100")], "家")
+    crud.create_transactions(db, [tx(ledger_id="-100")], "我们家")
+    crud.create_transactions(db, [tx(ledger_id="-100")])
+    assert crud.get_ledger(db, "-100").name == "我们家"
+
+def test_ledgers_do_not_see_each_others_transactions(db):
+    crud.create_transactions(db, [tx(ledger_id="-1", item="甲"), tx(ledger_id="-2", item="乙")])
+    cursor, rows = crud.list_transactions(db, "-1", 0, 10, None, None)
+    assert [t.item for t in rows] == ["甲"]
+    assert cursor == crud.current_cursor(db, "-1") < crud.current_cursor(db, "-2")
+
+def _update(chat_id: int, user_id: int, text: str = "确认"):
+    message = fake_telegram._message(user_id, text=text)
+    if chat_id != user_id:
+        message["chat"] = {"id": chat_id, "type": "group", "title": "家"}
+    return fake_telegram.Update.de_json({"update_id": 1, "message": message}, None)
+
+def test_each_chat_is_its_own_ledger_and_pending_slot():
+    private, group = _update(7, 7), _update(-100, 7)
+    assert (bot.ledger_id(private), bot.state_key(private)) == ("7", "7")
+    assert (bot.ledger_id(group), bot.state_key(group)) == ("-100", "-100:7")
+    assert bot.ledger_name(group) == "家"
+
+def test_bot_saves_into_the_chats_ledger(db, run):
+    update = _update(-100, 7)
+    data = bot._pending_state("7", "A", [{"amount": 38.0, "currency": "CNY", "category": "餐饮", "item": "午饭"}], "午饭 38")
+    run(bot._save_pending(update, fake_telegram.context(fake_telegram.FakeBot()), data, "确认"))
+    assert [(t.ledger_id, t.item) for t in db.query(models.Transaction)] == [("-100", "午饭")]
+    assert crud.get_ledger(db, "-100").name == "家"
+
+def test_api_reads_only_the_requested_ledger(db):
+    crud.create_transactions(db, [tx(ledger_id="-1", item="甲", amount=10.0), tx(ledger_id="-2", item="乙", amount=99.0)])
+    client = TestClient(main.app)
+    assert [t["item"] for t in client.get("/transactions", params={"ledger": "-1"}).json()] == ["甲"]
+    assert client.get("/stats", params={"ledger": "-2"}).json()["total"] == 99.0
+    assert client.get("/transactions").json() == []
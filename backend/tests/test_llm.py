@@ -0,0 +1,189 @@
+import asyncio
+import json
+from types import SimpleNamespace
+
+import openai
+import pytest
+
+from app.services import llm
+
+class FakeCompletions:
+    """chat.completions stand-in: each call pops the next outcome (an exception, "hang", or a response)."""
+
+    def __init__(self, *outcomes):
+        self.outcomes = list(outcomes)
+        self.calls = 0
+
+    async def create(self, **kwargs):
+        self.calls += 1
+        outcome = self.outcomes.pop(0)
+        if outcome == "hang":
+            await asyncio.sleep(3600)
+        if isinstance(outcome, BaseException):
+            raise outcome
+        return outcome
+
+def _client(*outcomes, failures=2):
+    client = llm.AsyncLLMClient(max_retries=0, hedge_after=0)
+    client.breaker = llm.CircuitBreaker(failure_threshold=failures, reset_after=60)
+    client._client = SimpleNamespace(chat=SimpleNamespace(completions=FakeCompletions(*outcomes)))
+    return client
+
+def _timeout():
+    return openai.APITimeoutError(request=None)
+
+def _half_open(breaker):
+    breaker.opened_at -= breaker.reset_after
+
+OK = SimpleNamespace(usage=None)
+
+def test_breaker_opens_after_consecutive_failures(run):
+    client = _client(_timeout(), OK, _timeout(), _timeout())
+
+    async def scenario():
+        for expected in (openai.APITimeoutError, None, openai.APITimeoutError, openai.APITimeoutError):
+            if expected:
+                with pytest.raises(expected):
+                    await client.chat(timeout=5, model="m")
+            else:
+                await client.chat(timeout=5, model="m")  # a success resets the count
+        assert client.breaker.state == "open"
+        with pytest.raises(llm.CircuitOpenError):
+            await client.chat(timeout=5, model="m")
+
+    run(scenario())
+    assert client.breaker.trips == 1
+    assert client.rejected == 1
+    assert client._client.chat.completions.calls == 4
+
+def test_half_open_probe_closes_or_reopens(run):
+    client = _client(_timeout(), OK, failures=1)
+    breaker = client.breaker
+
+    async def scenario():
+        with pytest.raises(openai.APITimeoutError):
+            await client.chat(timeout=5, model="m")
+        _half_open(breaker)
+        assert breaker.allow() and not breaker.allow()  # one probe at a time
+        breaker.record_failure()
+        assert breaker.state == "open" and breaker.trips == 2
+        _half_open(breaker)
+        await client.chat(timeout=5, model="m")
+
+    run(scenario())
+    assert breaker.state == "closed" and not breaker.probing
+
+def test_cancelled_probe_does_not_wedge_half_open(run):
+    client = _client(_timeout(), "hang", OK, failures=1)
+    breaker = client.breaker
+
+    async def scenario():
+        with pytest.raises(openai.APITimeoutError):
+            await client.chat(timeout=5, model="m")
+        _half_open(breaker)
+        probe = asyncio.ensure_future(client.chat(timeout=5, model="m"))
+        await asyncio.sleep(0.01)
+        probe.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await probe
+        # Counted as a failed probe: open again, then a fresh probe after reset_after
+        assert breaker.state == "open" and not breaker.probing
+        _half_open(breaker)
+        await client.chat(timeout=5, model="m")
+
+    run(scenario())
+    assert breaker.state == "closed"
+
+def test_cancelled_call_while_closed_is_not_a_failure(run):
+    client = _client("hang", failures=1)
+
+    async def scenario():
+        call = asyncio.ensure_future(client.chat(timeout=5, model="m"))
+        await asyncio.sleep(0.01)
+        call.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await call
+
+    run(scenario())
+    assert client.breaker.state == "closed" and client.breaker.failures == 0
+
+def _answer(parsed: dict, finish_reason: str = "stop"):
+    message = SimpleNamespace(content=json.dumps(parsed, ensure_ascii=False))
+    usage = SimpleNamespace(prompt_tokens=100, completion_tokens=20, prompt_tokens_details=None)
+    return SimpleNamespace(choices=[SimpleNamespace(message=message, finish_reason=finish_reason)], usage=usage)
+
+LUNCH = {"is_expense": True, "amount": 38.0, "currency": "CNY", "category": "餐饮", "item": "午饭", "confidence": 0.9}
+
+@pytest.mark.parametrize("parsed, text, reason", [
+    (LUNCH, "午饭 38", None),
+    (LUNCH, None, None),
+    ("not json", None, "invalid"),
+    ({**LUNCH, "amount": 0}, None, "amount"),
+    ({**LUNCH, "amount": True}, None, "amount"),
+    ({**LUNCH, "amount": "38"}, None, "amount"),
+    ({**LUNCH, "currency": "EUR"}, None, "currency"),
+    ({**LUNCH, "item": "lunch"}, None, "item"),
+    ({**LUNCH, "confidence": 0.5}, None, "low_confidence"),
+    ({**LUNCH, "amount": 380.0}, "午饭 38", "disagree"),
+    ({"is_expense": False}, "午饭 38", "disagree"),
+    ({"is_expense": False}, "今天天气不错", None),
+])
+def test_check_expense_escalation_reasons(parsed, text, reason):
+    assert llm._check_expense(parsed, text) == reason
+
+def test_check_multi_needs_one_expense_per_line():
+    check = llm._check_multi(["午饭 38", "买菜 200"])
+    assert check({"expenses": [LUNCH]}) == "count"
+    assert check({"expenses": [LUNCH, {**LUNCH, "amount": 200.0, "item": "买菜"}]}) is None
+    assert check({"expenses": [LUNCH, {**LUNCH, "item": "买菜"}]}) == "disagree"
+
+@pytest.fixture
+def routed(monkeypatch):
+    """Tiered routing on a fake client; returns the FakeCompletions to script per test."""
+    def install(*outcomes):
+        client = _client(*outcomes)
+        monkeypatch.setattr(llm, "llm_client", client)
+        monkeypatch.setattr(llm, "LLM_ROUTING", "tiered")
+        monkeypatch.setattr(llm, "usage_log", llm.UsageLog())
+        return client._client.chat.completions
+    return install
+
+def _route(run, text="午饭 38"):
+    return run(llm._routed("text", llm._text_messages(text, llm.COMPACT_PROMPT), llm._text_messages(text),
+                           llm._check_text(text), 10))
+
+def test_trusted_fast_answer_is_not_escalated(run, routed):
+    completions = routed(_answer(LUNCH))
+    assert json.loads(_route(run))["amount"] == 38.0
+    assert completions.calls == 1
+    assert llm.usage_log.stats()["escalations"] == {}
+
+@pytest.mark.parametrize("fast, reason", [
+    (_answer({**LUNCH, "confidence": 0.3}), "low_confidence"),
+    (_answer({**LUNCH, "amount": 83.0}), "disagree"),
+    (openai.BadRequestError("bad", response=SimpleNamespace(request=None, status_code=400, headers={}), body=None), "error"),
+])
+def test_untrusted_fast_answer_goes_to_the_full_model(run, routed, fast, reason):
+    completions = routed(fast, _answer({**LUNCH, "confidence": 0.95}))
+    assert json.loads(_route(run))["amount"] == 38.0
+    assert completions.calls == 2
+    stats = llm.usage_log.stats()
+    assert stats["escalations"] == {f"text:{reason}": 1}
+    assert [(r["stage"], r["model"]) for r in stats["routes"]] == [("fast", llm.FAST_TEXT_MODEL), ("full", llm.TEXT_MODEL)]
+
+RECEIPT = {"is_expense": True, "expenses": [
+    {"amount": 12.0, "currency": "CNY", "category": "餐饮", "item": "咖啡"},
+    {"amount": 8.0, "currency": "CNY", "category": "餐饮", "item": "面包"},
+]}
+
+def test_truncated_receipt_escalates_then_reports_too_many_items(run, routed):
+    completions = routed(_answer(RECEIPT, "length"), _answer(RECEIPT, "length"))
+    result = run(llm.parse_expense_image_async(b"jpeg"))
+    assert result == {"is_expense": False, "error": llm.TOO_MANY_ITEMS}
+    assert completions.calls == 2
+    assert llm.usage_log.stats()["escalations"] == {"vision:truncated": 1}
+
+def test_receipt_escalated_after_truncation_is_parsed(run, routed):
+    routed(_answer(RECEIPT, "length"), _answer(RECEIPT))
+    result = run(llm.parse_expense_image_async(b"jpeg"))
+    assert [e["item"] for e in result["expenses"]] == ["咖啡", "面包"]
@@ -0,0 +1,64 @@
+from types import SimpleNamespace
+
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from app import metrics
+
+@pytest.fixture(autouse=True)
+def registry():
+    """Metrics made here register globally; keep them out of the app's /metrics."""
+    saved = list(metrics._metrics)
+    yield
+    metrics._metrics[:] = saved
+
+def test_counter_renders_labels_escaped():
+    counter = metrics.Counter("t_total", "help", ("reason",))
+    counter.inc(reason='say "hi"\n')
+    counter.inc(2, reason='say "hi"\n')
+    assert counter.render()[-1] == 't_total{reason="say \\"hi\\"\\n"} 3'
+
+def test_histogram_buckets_are_cumulative():
+    histogram = metrics.Histogram("t_seconds", "help", ("op",), buckets=(0.1, 1.0))
+    for value in (0.05, 0.5, 0.7, 3.0):
+        histogram.observe(value, op="x")
+    assert histogram.render()[2:] == [
+        't_seconds_bucket{op="x",le="0.1"} 1',
+        't_seconds_bucket{op="x",le="1.0"} 3',
+        't_seconds_bucket{op="x",le="+Inf"} 4',
+        't_seconds_sum{op="x"} 4.25',
+        't_seconds_count{op="x"} 4',
+    ]
+
+def test_gauge_reads_at_scrape_time_and_survives_errors():
+    values = {("text", "queued"): 2}
+    gauge = metrics.Gauge("t_jobs", "help", lambda: values, ("kind", "state"))
+    values[("vision", "running")] = 1
+    assert gauge.render()[2:] == ['t_jobs{kind="text",state="queued"} 2', 't_jobs{kind="vision",state="running"} 1']
+    broken = metrics.Gauge("t_broken", "help", lambda: 1 / 0)
+    assert broken.render() == ["# HELP t_broken help", "# TYPE t_broken gauge"]
+
+def test_llm_tokens_include_cached_prompt():
+    usage = SimpleNamespace(prompt_tokens=1200, completion_tokens=40,
+                            prompt_tokens_details=SimpleNamespace(cached_tokens=1024))
+    before = dict(metrics.llm_tokens._values)
+    metrics.record_llm_response("t-model", 0.0, SimpleNamespace(usage=usage))
+    added = {key[1]: value - before.get(key, 0) for key, value in metrics.llm_tokens._values.items() if key[0] == "t-model"}
+    assert added == {"prompt": 1200, "completion": 40, "cached_prompt": 1024}
+
+def test_http_latency_is_keyed_by_route_template():
+    app = FastAPI()
+    app.add_middleware(metrics.MetricsMiddleware)
+
+    @app.get("/items/{item_id}")
+    def item(item_id: int):
+        return {"id": item_id}
+
+    before = dict(metrics.http_latency._values)
+    client = TestClient(app)
+    for path in ("/items/1", "/items/2", "/nope"):
+        client.get(path)
+    counts = {key: series[-1] - before.get(key, [0])[-1] for key, series in metrics.http_latency._values.items()}
+    assert counts[("GET", "/items/{item_id}", 200)] == 2
+    assert counts[("GET", "unmatched", 404)] == 1
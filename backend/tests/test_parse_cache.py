@@ -0,0 +1,45 @@
+from app import models
+from app.database import SessionLocal
+from app.services.parse_cache import ParseCache, cache_namespace, normalize
+
+LUNCH = {"is_expense": True, "amount": 38.0, "currency": "CNY", "category": "餐饮", "item": "午饭"}
+
+def test_amount_is_abstracted_into_the_template():
+    cache = ParseCache("ns", use_db=False)
+    cache.put("午饭 38", LUNCH)
+    assert cache.get("午饭 52") == {**LUNCH, "amount": 52.0}
+    assert cache.get("  午饭   38 ") == LUNCH
+    assert cache.get("晚饭 38") is None
+    assert cache.stats()["hits"] == 2 and cache.stats()["misses"] == 1
+
+def test_amount_not_in_the_text_is_kept_exact():
+    cache = ParseCache("ns", use_db=False)
+    cache.put("打车回家", {**LUNCH, "amount": 25.0, "item": "打车"})
+    assert cache.get("打车回家")["amount"] == 25.0
+
+def test_normalize_folds_width_case_and_spaces():
+    assert normalize(" Ｓtarbucks\t３８ ") == "starbucks 38"
+
+def test_lru_bound():
+    cache = ParseCache("ns", max_entries=2, use_db=False)
+    for text in ("午饭 1", "晚饭 1", "早饭 1"):
+        cache.put(text, {**LUNCH, "amount": 1.0})
+    assert cache.get("午饭 1") is None
+    assert cache.stats()["entries"] == 2
+
+def test_prompt_or_model_change_starts_a_fresh_cache(engine):
+    old, new = cache_namespace("gpt-4o-mini", "prompt v1"), cache_namespace("gpt-4o-mini", "prompt v2")
+    assert old != new and old != cache_namespace("gpt-4o", "prompt v1")
+    try:
+        ParseCache(old, use_db=True).put("午饭 38", LUNCH)
+        assert ParseCache(old, use_db=True).get("午饭 40") == {**LUNCH, "amount": 40.0}  # from the table
+        assert ParseCache(new, use_db=True).get("午饭 38") is None
+        db = SessionLocal()
+        # The first lookup under the new namespace purged the old rows
+        assert db.query(models.ParseCacheEntry).count() == 0
+        db.close()
+    finally:
+        db = SessionLocal()
+        db.query(models.ParseCacheEntry).delete()
+        db.commit()
+        db.close()
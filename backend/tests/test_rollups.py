@@ -0,0 +1,58 @@
+from datetime import datetime
+
+from app import crud, models
+from conftest import tx
+
+def _write_mix(db):
+    crud.create_transactions(db, [
+        tx(38, item="星巴克", created_at=datetime(2026, 3, 2)),
+        tx(12, "HKD", "交通", "mtr", user_id="2", user_name="B", created_at=datetime(2026, 3, 5)),
+        tx(200, category="购物", item="淘宝", created_at=datetime(2026, 4, 1)),
+        tx(45, "HKD", ledger_id="family", created_at=datetime(2026, 3, 9)),
+    ])
+
+def test_create_keeps_rollups_in_step(db):
+    _write_mix(db)
+    assert crud.verify_rollups(db) == []
+    stats = crud.get_stats(db, crud.DEFAULT_LEDGER, "CNY", "2026-03")
+    assert (stats["total"], stats["count"]) == (38, 1)
+    assert crud.get_stats(db, "family", "HKD", "2026-03")["total"] == 45
+
+def test_same_key_upserts_into_one_row(db):
+    crud.create_transactions(db, [tx(10, created_at=datetime(2026, 3, 1))])
+    crud.create_transactions(db, [tx(15, created_at=datetime(2026, 3, 20)), tx(5, created_at=datetime(2026, 3, 21))])
+    rows = db.query(models.MonthlyRollup).all()
+    assert [(r.amount, r.count) for r in rows] == [(30, 3)]
+    assert crud.verify_rollups(db) == []
+
+def test_undo_and_delete_subtract(db):
+    _write_mix(db)
+    assert crud.undo_last_transaction(db, crud.DEFAULT_LEDGER, "1") is not None
+    deleted = db.query(models.Transaction).filter_by(item="mtr").one()
+    assert crud.delete_user_transaction(db, crud.DEFAULT_LEDGER, deleted.id, "2")
+    assert crud.verify_rollups(db) == []
+    assert crud.get_stats(db, crud.DEFAULT_LEDGER, "HKD", "2026-03")["count"] == 0
+
+def test_apply_rollup_removes_emptied_keys(db):
+    crud.create_transactions(db, [tx(10, created_at=datetime(2026, 3, 1))])
+    row = db.query(models.Transaction).one()
+    crud.apply_rollup(db, [row], sign=-1)
+    db.commit()
+    assert db.query(models.MonthlyRollup).count() == 0
+
+def test_reset_only_touches_its_ledger(db):
+    _write_mix(db)
+    crud.reset_transactions(db, "family")
+    assert crud.verify_rollups(db) == []
+    assert crud.get_stats(db, "family", "HKD", "2026-03")["count"] == 0
+    assert crud.get_stats(db, crud.DEFAULT_LEDGER, "CNY", "2026-03")["count"] == 1
+
+def test_verify_finds_drift_and_rebuild_repairs_it(db):
+    _write_mix(db)
+    row = db.query(models.MonthlyRollup).filter_by(currency="CNY", month="2026-04").one()
+    row.amount += 1
+    db.commit()
+    mismatches = crud.verify_rollups(db)
+    assert [key for key, _, _ in mismatches] == [(crud.DEFAULT_LEDGER, "CNY", "2026-04", "购物", "1")]
+    crud.rebuild_rollups(db)
+    assert crud.verify_rollups(db) == []
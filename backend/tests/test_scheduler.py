@@ -0,0 +1,112 @@
+import asyncio
+
+import pytest
+
+from app.services.scheduler import JobScheduler, JobCancelled
+
+async def _settle():
+    for _ in range(5):
+        await asyncio.sleep(0)
+
+def test_jobs_of_one_key_run_in_arrival_order(run):
+    async def scenario():
+        scheduler = JobScheduler({"text": 4})
+        order = []
+
+        async def job(n, delay):
+            await asyncio.sleep(delay)
+            order.append(n)
+
+        # The first job is the slowest; the key's later jobs must still wait for it
+        await asyncio.gather(*(scheduler.run("u", "text", job, n, d) for n, d in ((1, 0.03), (2, 0), (3, 0.01))))
+        return order, scheduler.stats()["text"]
+
+    order, stats = run(scenario())
+    assert order == [1, 2, 3]
+    assert (stats["done"], stats["queued"], stats["running"]) == (3, 0, 0)
+
+def test_kind_limit_caps_concurrency_across_keys(run):
+    async def scenario():
+        scheduler = JobScheduler({"vision": 2})
+        running = peak = 0
+
+        async def job():
+            nonlocal running, peak
+            running += 1
+            peak = max(peak, running)
+            await asyncio.sleep(0.01)
+            running -= 1
+
+        await asyncio.gather(*(scheduler.run(f"u{i}", "vision", job) for i in range(6)))
+        return peak
+
+    assert run(scenario()) == 2
+
+def test_cancel_only_touches_its_key_and_runs_callbacks(run):
+    async def scenario():
+        scheduler = JobScheduler({"text": 4})
+        closed, ran = [], []
+
+        async def job(name):
+            async def close():
+                closed.append(name)
+            scheduler.on_cancel(close)
+            ran.append(name)
+            await asyncio.sleep(0.05)
+            return name
+
+        running = asyncio.ensure_future(scheduler.run("chat1:u", "text", job, "running"))
+        queued = asyncio.ensure_future(scheduler.run("chat1:u", "text", job, "queued"))
+        other = asyncio.ensure_future(scheduler.run("chat2:u", "text", job, "other chat"))
+        await _settle()
+        assert scheduler.cancel("chat1:u") == 2
+        assert scheduler.pending("chat1:u") == 0  # dropped at once, not when the tasks wind down
+        results = await asyncio.gather(running, queued, other, return_exceptions=True)
+        await _settle()
+        return results, closed, ran, scheduler
+
+    results, closed, ran, scheduler = run(scenario())
+    assert isinstance(results[0], JobCancelled) and isinstance(results[1], JobCancelled)
+    assert results[2] == "other chat"
+    assert closed == ["running"]           # the queued job never started, so had nothing to close
+    assert "queued" not in ran
+    stats = scheduler.stats()["text"]
+    assert (stats["cancelled"], stats["done"], stats["queued"], stats["running"]) == (2, 1, 0, 0)
+    assert scheduler.stats()["users_waiting"] == 0
+
+def test_key_accepts_new_jobs_after_cancel(run):
+    async def scenario():
+        scheduler = JobScheduler({"text": 1})
+
+        async def job(value, delay=0):
+            await asyncio.sleep(delay)
+            return value
+
+        slow = asyncio.ensure_future(scheduler.run("u", "text", job, "slow", 1))
+        await _settle()
+        scheduler.cancel("u")
+        with pytest.raises(JobCancelled):
+            await slow
+        return await asyncio.wait_for(scheduler.run("u", "text", job, "next"), 1)
+
+    assert run(scenario()) == "next"
+
+def test_failing_cancel_callback_is_contained(run, capsys):
+    async def scenario():
+        scheduler = JobScheduler({"text": 1})
+
+        async def job():
+            async def close():
+                raise RuntimeError("telegram down")
+            scheduler.on_cancel(close)
+            await asyncio.sleep(1)
+
+        task = asyncio.ensure_future(scheduler.run("u", "text", job))
+        await _settle()
+        scheduler.cancel("u")
+        with pytest.raises(JobCancelled):
+            await task
+        await _settle()
+
+    run(scenario())
+    assert "cancel callback failed" in capsys.readouterr().out
@@ -0,0 +1,58 @@
+from sqlalchemy.dialects import postgresql
+
+from app import crud, search
+from conftest import tx
+
+def _items(db, q, ledger_id="L", **kwargs):
+    return [t.item for t in search.search_transactions(db, ledger_id, q, 0, 20, **kwargs)]
+
+def _seed(db):
+    return crud.create_transactions(db, [
+        tx(item="星巴克拿铁", raw_text="星巴克 38", ledger_id="L"),
+        tx(item="MTR 地铁", raw_text="mtr 12", currency="HKD", ledger_id="L"),
+        tx(item="咖啡豆", raw_text="买咖啡豆 90", ledger_id="L"),
+        tx(item="星巴克", ledger_id="other"),
+    ])
+
+def test_sqlite_uses_fts5(engine):
+    assert search.backend == "fts5"
+
+def test_long_terms_match_substrings_case_insensitively(db):
+    _seed(db)
+    assert _items(db, "星巴克") == ["星巴克拿铁"]
+    assert _items(db, "mtr") == ["MTR 地铁"]
+    assert _items(db, "MTR", currency="CNY") == []
+
+def test_short_terms_fall_back_to_like(db):
+    _seed(db)
+    assert _items(db, "咖啡") == ["咖啡豆"]
+    assert _items(db, "星巴克 拿铁") == ["星巴克拿铁"]
+    assert _items(db, "星巴克 地铁") == []
+
+def test_fts_syntax_in_the_query_is_matched_literally(db):
+    _seed(db)
+    assert _items(db, '"星巴克') == []
+    assert _items(db, "mtr OR 星巴克") == []
+    assert _items(db, "NEAR(mtr)") == []
+    assert _items(db, "   ") == []
+
+def test_index_follows_updates_and_deletes(db):
+    first, second, *_ = _seed(db)
+    assert crud.update_user_transaction_item(db, "L", first.id, "1", "瑞幸咖啡")
+    assert _items(db, "星巴克拿铁") == []
+    assert _items(db, "瑞幸咖") == ["瑞幸咖啡"]
+    assert crud.delete_user_transaction(db, "L", second.id, "1")
+    assert _items(db, "mtr") == []
+
+def test_like_backend_matches_every_term(db, monkeypatch):
+    _seed(db)
+    monkeypatch.setattr(search, "backend", "like")
+    assert _items(db, "星巴克") == ["星巴克拿铁"]
+    assert _items(db, "mtr 地铁") == ["MTR 地铁"]
+    assert _items(db, "100%") == []
+
+def test_postgres_document_matches_the_index_expression():
+    compiled = search._document().compile(dialect=postgresql.dialect())
+    # Bind parameters would be cast and no longer match ix_transactions_search_trgm
+    assert compiled.params == {}
+    assert str(compiled) == "(coalesce(transactions.item, '') || ' ') || coalesce(transactions.raw_text, '')"
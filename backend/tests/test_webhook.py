@@ -0,0 +1,111 @@
+import asyncio
+from types import SimpleNamespace
+
+from app import crud
+from app.services.webhook import WebhookIngress
+from benchmarks import fake_telegram
+
+class FakeApplication:
+    """process_update waits on a per-update gate, so tests decide the order updates finish in."""
+
+    def __init__(self):
+        self.bot = SimpleNamespace(id=42, token="123:test")
+        self.gates: dict[int, asyncio.Event] = {}
+        self.processed: list[int] = []
+
+    def gate(self, update_id: int) -> asyncio.Event:
+        return self.gates.setdefault(update_id, asyncio.Event())
+
+    async def process_update(self, update):
+        await self.gate(update.update_id).wait()
+        self.processed.append(update.update_id)
+
+def _payload(update_id: int, user_id: int) -> dict:
+    return {"update_id": update_id, "message": fake_telegram._message(user_id, text="午饭 30")}
+
+async def _settle():
+    for _ in range(5):
+        await asyncio.sleep(0)
+
+def test_redeliveries_are_acknowledged_once(db, run):
+    app = FakeApplication()
+    ingress = WebhookIngress(app, queue_size=10, secret="s")
+
+    async def scenario():
+        await ingress.start(url=None)
+        assert ingress.submit(_payload(1, 0)) == "accepted"
+        assert ingress.submit(_payload(1, 0)) == "duplicate"  # still queued
+        assert ingress.submit({"update_id": "x"}) == "duplicate"
+        app.gate(1).set()
+        await _settle()
+        assert ingress.submit(_payload(1, 0)) == "duplicate"  # below the watermark
+        await ingress.stop()
+
+    run(scenario())
+    assert app.processed == [1]
+    assert ingress.stats()["duplicates"] == 2
+    assert crud.get_update_offset(db, "42") == 1
+
+def test_watermark_waits_for_the_oldest_running_update(db, run):
+    app = FakeApplication()
+    ingress = WebhookIngress(app, queue_size=10, secret="s")
+
+    async def scenario():
+        await ingress.start(url=None)
+        assert ingress.submit(_payload(1, 0)) == "accepted"
+        assert ingress.submit(_payload(2, 1)) == "accepted"  # another user runs alongside
+        app.gate(2).set()
+        await _settle()
+        assert app.processed == [2]
+        assert ingress.stats()["last_update_id"] == 0
+        assert ingress.submit(_payload(2, 1)) == "duplicate"
+        app.gate(1).set()
+        await _settle()
+        assert ingress.stats()["last_update_id"] == 2
+        await ingress.stop()
+
+    run(scenario())
+    assert crud.get_update_offset(db, "42") == 2
+
+def test_restart_loads_the_saved_watermark(db, run):
+    crud.save_update_offset(db, "42", 5)
+    app = FakeApplication()
+    ingress = WebhookIngress(app, queue_size=10, secret="s")
+
+    async def scenario():
+        await ingress.start(url=None)
+        assert ingress.submit(_payload(5, 0)) == "duplicate"
+        assert ingress.submit(_payload(6, 0)) == "accepted"
+        app.gate(6).set()
+        await ingress.stop()
+        assert ingress.submit(_payload(7, 0)) == "busy"
+
+    run(scenario())
+    assert app.processed == [6]
+    assert crud.get_update_offset(db, "42") == 6
+
+def test_slow_update_only_holds_back_its_own_sender(db, run):
+    app = FakeApplication()
+    ingress = WebhookIngress(app, queue_size=3, secret="s")
+
+    async def scenario():
+        await ingress.start(url=None)
+        assert ingress.submit(_payload(1, 0)) == "accepted"  # e.g. a receipt still being parsed
+        assert ingress.submit(_payload(2, 0)) == "accepted"
+        for update_id in range(3, 6):
+            app.gate(update_id).set()
+        app.gate(2).set()
+        assert ingress.submit(_payload(3, 1)) == "accepted"
+        assert ingress.submit(_payload(4, 2)) == "busy"  # queue_size updates in flight
+        await _settle()
+        assert app.processed == [3]  # other senders aren't behind update 1; its sender's 2 is
+        assert ingress.stats()["queued"] == 1
+        assert ingress.submit(_payload(4, 2)) == "accepted"
+        await _settle()
+        app.gate(1).set()
+        await _settle()
+        await ingress.stop()
+
+    run(scenario())
+    assert app.processed == [3, 4, 1, 2]
+    assert crud.get_update_offset(db, "42") == 4
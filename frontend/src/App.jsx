@@ -1,4 +1,4 @@
-import { useEffect, useState } from 'react';
+import { useEffect, useRef, useState } from 'react';
 import axios from 'axios';
 import { Layout, Card, Table, Tabs, Statistic, Row, Col, Tag, Spin, DatePicker, List, Avatar } from 'antd';
 import { PieChart, Pie, Cell, Tooltip, Legend, ResponsiveContainer } from 'recharts';
@@ -11,6 +11,25 @@ dayjs.locale('zh-cn');
 const { Header, Content } = Layout;
 
 const API_URL = import.meta.env.VITE_API_URL || 'https://two6ktv.onrender.com';
+// Each Telegram chat keeps its own ledger; the bot's /start shows the id to put in ?ledger=
+const LEDGER = new URLSearchParams(window.location.search).get('ledger') || 'default';
+
+// ?format=columnar -> row objects. Dictionary-encoded columns come as { values, codes };
+// created_at is epoch ms of the stored wall-clock time, turned back into the same ISO string the JSON format sends.
+const decodeColumnar = ({ count, columns }) => {
+  const names = Object.keys(columns);
+  const rows = new Array(count);
+  for (let i = 0; i < count; i++) {
+    const row = {};
+    for (const name of names) {
+      const col = columns[name];
+      row[name] = Array.isArray(col) ? col[i] : col.values[col.codes[i]];
+    }
+    if (row.created_at != null) row.created_at = new Date(row.created_at).toISOString().slice(0, -1);
+    rows[i] = row;
+  }
+  return rows;
+};
 
 const COLORS = ['#0088FE', '#00C49F', '#FFBB28', '#FF8042', '#AF19FF', '#FF1919'];
 const CATEGORY_COLORS = {
@@ -48,32 +67,46 @@ const CATEGORY_COLORS = {
 
 function App() {
   const [transactions, setTransactions] = useState([]);
+  const [stats, setStats] = useState(null);
+  // All currencies of the month converted to CNY (/stats/consolidated)
+  const [consolidated, setConsolidated] = useState(null);
+  // Change-log cursor of the data currently on screen (see /transactions/changes)
+  const cursorRef = useRef(null);
   const [loading, setLoading] = useState(true);
   const [error, setError] = useState(null);
   const [activeCurrency, setActiveCurrency] = useState('CNY');
   const [selectedMonth, setSelectedMonth] = useState(dayjs());
   const [isMobile, setIsMobile] = useState(typeof window !== 'undefined' ? window.innerWidth < 768 : false);
+  const [ledgerName, setLedgerName] = useState(null);
 
-  const deriveCategory = (record) => {
-    const base = (record?.category || '').trim();
-    if (base && base !== '其他') return base;
-    const src = `${record?.item || ''} ${record?.raw_text || ''}`.toLowerCase();
-    const hasAny = (arr) => arr.some(k => src.includes(k));
-    if (hasAny(['转账', 'fps', '轉帳', '轉賬', '转數快'])) return '转账';
-    if (hasAny(['餐', '饭', '午饭', '晚饭', '早餐', '吃饭', '超市', '买菜', '咖啡', '奶茶', '星巴克', '麦当劳', 'mcdonald', 'kfc'])) return '餐饮';
-    if (hasAny(['打车', '出租', '地铁', '公交', '的士', '巴士', 'mtr', '滴滴', '停车', '加油'])) return '交通';
-    if (hasAny(['快递', '顺丰', '菜鸟', '淘宝', '京东', '购物', '买衣服', '买鞋'])) return '购物';
-    if (hasAny(['房租', '水费', '电费', '燃气', '物业'])) return '居住';
-    if (hasAny(['电影', '游戏', '旅游', 'ktv'])) return '娱乐';
-    if (hasAny(['医院', '药', '体检', '看病'])) return '医疗';
-    return base || '其他';
-  };
+  useEffect(() => {
+    let source = null;
+    let interval = null;
+    let closed = false;
+    fetchData().then(() => {
+      if (closed) return;
+      if (typeof EventSource === 'undefined') {
+        // No SSE support: poll for changes every 10 seconds; idle polls are a bodyless 304
+        interval = setInterval(syncChanges, 10000);
+        return;
+      }
+      // Pushed after every write; reconnects resume from the last event id on their own
+      const url = `${API_URL}/transactions/stream?ledger=${encodeURIComponent(LEDGER)}&since=${cursorRef.current ?? 0}`;
+      source = new EventSource(url);
+      source.addEventListener('changes', (e) => applyChanges(JSON.parse(e.data)));
+    });
+    return () => {
+      closed = true;
+      if (source) source.close();
+      if (interval) clearInterval(interval);
+    };
+  }, [activeCurrency, selectedMonth]);
 
   useEffect(() => {
-    fetchData();
-    // Simple polling to refresh data every 10 seconds
-    const interval = setInterval(fetchData, 10000);
-    return () => clearInterval(interval);
+    // Chat title of the ledger, shown next to the app name
+    axios.get(`${API_URL}/ledgers/${encodeURIComponent(LEDGER)}`, { timeout: 15000 })
+      .then(res => setLedgerName(res.data.name))
+      .catch(() => {});
   }, []);
 
   useEffect(() => {
@@ -87,11 +120,20 @@ function App() {
       console.log("Starting fetch from:", API_URL);
       setError(null);
       
+      // Totals / pie / ranking are aggregated server-side; only the selected month's rows are listed
+      const params = { ledger: LEDGER, currency: activeCurrency, month: selectedMonth.format('YYYY-MM') };
       // Add timeout to force error if backend hangs
-      const res = await axios.get(`${API_URL}/transactions/`, { timeout: 15000 });
+      const [statsRes, listRes, consolidatedRes] = await Promise.all([
+        axios.get(`${API_URL}/stats`, { params, timeout: 15000 }),
+        axios.get(`${API_URL}/transactions/`, { params: { ...params, limit: 500, format: 'columnar' }, timeout: 15000 }),
+        axios.get(`${API_URL}/stats/consolidated`, { params: { ledger: LEDGER, month: params.month }, timeout: 15000 }),
+      ]);
       
-      console.log("Fetch success:", res.data);
-      setTransactions(res.data || []);
+      console.log("Fetch success:", statsRes.data);
+      cursorRef.current = Number(listRes.headers['x-ledger-cursor'] || 0);
+      setStats(statsRes.data);
+      setConsolidated(consolidatedRes.data);
+      setTransactions(listRes.data ? decodeColumnar(listRes.data) : []);
     } catch (error) {
       console.error("Failed to fetch data", error);
       let msg = error.message;
@@ -106,6 +148,44 @@ function App() {
     }
   };
 
+  const syncChanges = async () => {
+    if (cursorRef.current === null) return fetchData();
+    try {
+      const res = await axios.get(`${API_URL}/transactions/changes`, {
+        params: { ledger: LEDGER, since: cursorRef.current },
+        headers: { 'If-None-Match': `"${cursorRef.current}"` },
+        validateStatus: (status) => status === 200 || status === 304,
+        timeout: 15000,
+      });
+      if (res.status === 304) return;
+      await applyChanges(res.data);
+    } catch (error) {
+      console.error("Failed to sync changes", error);
+    }
+  };
+
+  // Merge a /transactions/changes delta (polled or pushed) into the current view
+  const applyChanges = async ({ cursor, reset, upserts, deletes }) => {
+    if (reset) return fetchData();
+    try {
+      const month = selectedMonth.format('YYYY-MM');
+      const touched = new Set([...deletes, ...upserts.map(t => t.id)]);
+      const visible = upserts.filter(t => t.currency === activeCurrency && dayjs(t.created_at).format('YYYY-MM') === month);
+      setTransactions(prev => [...prev.filter(t => !touched.has(t.id)), ...visible]
+        .sort((a, b) => new Date(b.created_at) - new Date(a.created_at) || b.id - a.id));
+      cursorRef.current = cursor;
+
+      const [statsRes, consolidatedRes] = await Promise.all([
+        axios.get(`${API_URL}/stats`, { params: { ledger: LEDGER, currency: activeCurrency, month }, timeout: 15000 }),
+        axios.get(`${API_URL}/stats/consolidated`, { params: { ledger: LEDGER, month }, timeout: 15000 }),
+      ]);
+      setStats(statsRes.data);
+      setConsolidated(consolidatedRes.data);
+    } catch (error) {
+      console.error("Failed to refresh stats", error);
+    }
+  };
+
   const handleReset = async () => {
     if (!window.confirm("⚠️ 警告：确定要删除所有账单数据吗？\n\n此操作不可恢复！")) return;
     
@@ -114,7 +194,7 @@ function App() {
 
     try {
       setLoading(true);
-      await axios.delete(`${API_URL}/transactions/reset`);
+      await axios.delete(`${API_URL}/transactions/reset`, { params: { ledger: LEDGER } });
       alert("✅ 所有数据已成功清空");
       fetchData();
     } catch (error) {
@@ -139,42 +219,22 @@ function App() {
     </div>
   );
 
-  // 1. 先按币种过滤
-  const currencyData = transactions.filter(t => t.currency === activeCurrency);
+  // 列表已由后端按币种和月份过滤
+  const currentData = transactions;
 
-  // 2. 再按月份过滤
-  const currentData = currencyData.filter(t => 
-    dayjs(t.created_at).isSame(selectedMonth, 'month')
-  );
-  
-  // Calculate total
-  const totalAmount = currentData.reduce((sum, t) => sum + t.amount, 0);
-  
-  // Calculate category stats for Pie Chart
-  const categoryStats = currentData.reduce((acc, t) => {
-    const cat = deriveCategory(t);
-    acc[cat] = (acc[cat] || 0) + t.amount;
-    return acc;
-  }, {});
-  
-  const pieData = Object.keys(categoryStats).map(key => ({
-    name: key,
-    value: categoryStats[key]
-  }));
+  // 汇总数据来自 /stats (SQL GROUP BY)
+  const totalAmount = stats?.total || 0;
 
-  // Calculate member stats
-  const memberStats = currentData.reduce((acc, t) => {
-    const user = t.user_name || 'Unknown';
-    acc[user] = (acc[user] || 0) + t.amount;
-    return acc;
-  }, {});
+  const pieData = (stats?.categories || []).map(c => ({
+    name: c.name,
+    value: c.amount
+  }));
 
-  const memberData = Object.keys(memberStats)
-    .map(key => ({
-      name: key,
-      value: memberStats[key]
-    }))
-    .sort((a, b) => b.value - a.value); // 降序排列
+  // 已按金额降序排列
+  const memberData = (stats?.members || []).map(m => ({
+    name: m.name,
+    value: m.amount
+  }));
 
   const columns = [
     {
@@ -189,7 +249,7 @@ function App() {
       title: '类别',
       dataIndex: 'category',
       key: 'category',
-      render: (_, record) => <Tag color="blue">{deriveCategory(record)}</Tag>,
+      render: (category) => <Tag color="blue">{category || '其他'}</Tag>,
       width: 100,
     },
     {
@@ -220,17 +280,17 @@ function App() {
     {
       key: 'CNY',
       label: '🇨🇳 人民币 (CNY)',
-      children: renderContent(currentData, totalAmount, pieData, memberData, columns, activeCurrency, isMobile),
+      children: renderContent(currentData, totalAmount, pieData, memberData, columns, activeCurrency, isMobile, stats?.count ?? currentData.length),
     },
     {
       key: 'HKD',
       label: '🇭🇰 港币 (HKD)',
-      children: renderContent(currentData, totalAmount, pieData, memberData, columns, activeCurrency, isMobile),
+      children: renderContent(currentData, totalAmount, pieData, memberData, columns, activeCurrency, isMobile, stats?.count ?? currentData.length),
     },
     {
       key: 'USDT',
       label: '🇺🇸 泰达币 (USDT)',
-      children: renderContent(currentData, totalAmount, pieData, memberData, columns, activeCurrency, isMobile),
+      children: renderContent(currentData, totalAmount, pieData, memberData, columns, activeCurrency, isMobile, stats?.count ?? currentData.length),
     },
   ];
 
@@ -243,6 +303,7 @@ function App() {
       <Header className={headerClass} style={{ height: 'auto', lineHeight: 'normal' }}>
         <h1 className={`${isMobile ? 'text-lg' : 'text-xl'} font-bold text-gray-800 m-0`}>
           💰 {isMobile ? '启徳三币种记账' : '启徳三币种记账'}
+          {ledgerName && <span className="text-gray-400 font-normal text-sm ml-2">{ledgerName}</span>}
         </h1>
         <div className="flex items-center gap-2">
           {!isMobile && <span className="text-gray-500">选择月份:</span>}
@@ -263,6 +324,14 @@ function App() {
             <Spin size="large" />
           </div>
         ) : (
+          <>
+          {consolidated && consolidated.count > 0 && (
+            <div className="mb-4 text-gray-500 text-sm">
+              本月全部币种合计（折合 CNY）：<span className="font-bold text-gray-800">¥ {consolidated.total.toFixed(2)}</span>
+              {consolidated.currencies.map(c => ` · ${c.name} ${c.amount.toFixed(2)}`).join('')}
+              {consolidated.estimated > 0 && <span className="text-gray-400">（{consolidated.estimated} 笔按最近汇率估算）</span>}
+            </div>
+          )}
           <Tabs 
             defaultActiveKey="CNY" 
             activeKey={activeCurrency}
@@ -272,6 +341,7 @@ function App() {
             size="large"
             destroyInactiveTabPane={true} // 确保切换Tab时彻底重绘
           />
+          </>
         )}
 
         {/* Reset Data Button - Disabled by user request */}
@@ -291,7 +361,7 @@ function App() {
   );
 }
 
-function renderContent(data, totalAmount, pieData, memberData, columns, currency, isMobile) {
+function renderContent(data, totalAmount, pieData, memberData, columns, currency, isMobile, count) {
   const currencySymbol = currency === 'CNY' ? '¥' : (currency === 'HKD' ? 'HK$' : '₮');
   const colorMap = CATEGORY_COLORS[currency] || CATEGORY_COLORS.CNY;
 
@@ -309,7 +379,7 @@ function renderContent(data, totalAmount, pieData, memberData, columns, currency
               valueStyle={{ color: '#1677ff', fontWeight: 'bold' }}
             />
             <div className="text-gray-400 text-xs mt-2">
-              {data.length} 笔交易
+              {count} 笔交易
             </div>
           </Card>
         </Col>